@@ -0,0 +1,301 @@
+#!/usr/bin/python
+"""
+Loopback ceod benchmark
+
+Runs ceod on localhost with stub ops and drives it with concurrent ceoc
+requests shaped like adduser, mail and mysql calls, reporting throughput
+and latency percentiles per op, plus ceod's own per-phase stats.
+
+Kerberos is not involved: the daemon and client are the no-auth builds
+from `make -C src noauth`, which trust the username the client sends and
+only talk over loopback. Everything runs as the current user; the
+configuration and ops live in a temporary CEO_CONFIG_DIR and CEO_LIB_DIR.
+For example, to measure a change to dmaster.c/dslave.c/net.c:
+
+    make -C src noauth
+    python bench/ceod.py --clients 16 --requests 2000 --output after.json
+
+Latencies include starting ceoc, as with ceo.remote.run_ceoc.
+"""
+
+import os, sys, json, shutil, socket, subprocess, tempfile, threading, time
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ceo import ceo_pb2
+
+STUB_OP = """#!/bin/sh
+cat >/dev/null
+%(sleep)s
+exec cat %(response)s
+"""
+
+
+### Requests ###
+
+def build_adduser(i):
+    request = ceo_pb2.AddUser()
+    request.type = ceo_pb2.AddUser.MEMBER
+    request.username = 'bench%06d' % i
+    request.password = 'correct horse battery staple'
+    request.realname = 'Benchmark User %d' % i
+    request.program = 'Computer Science'
+    request.email = 'bench%06d@example.com' % i
+    return request.SerializeToString()
+
+
+def build_mail(i):
+    request = ceo_pb2.UpdateMail()
+    request.username = 'bench%06d' % i
+    request.forward = 'bench%06d@example.com' % i
+    return request.SerializeToString()
+
+
+def build_mysql(i):
+    request = ceo_pb2.AddMySQLUser()
+    request.username = 'bench%06d' % i
+    return request.SerializeToString()
+
+
+def build_response(response_type):
+    response = response_type()
+    message = response.messages.add()
+    message.status = 0
+    message.message = 'ok'
+    return response.SerializeToString()
+
+
+# name, message id, request builder, response type
+OPS = [
+    ('adduser', 0x01, build_adduser, ceo_pb2.AddUserResponse),
+    ('mail', 0x02, build_mail, ceo_pb2.UpdateMailResponse),
+    ('mysql', 0x03, build_mysql, ceo_pb2.AddMySQLUserResponse),
+]
+
+
+### Harness ###
+
+class Daemon:
+    """A ceod-noauth with stub ops in a temporary directory."""
+
+    def __init__(self, ceod, port, op_delay, limits):
+        self.ceod = ceod
+        self.port = port
+        self.op_delay = op_delay
+        self.limits = limits
+        self.proc = None
+        self.log = None
+        self.tmpdir = None
+
+    def env(self):
+        return dict(os.environ,
+                CEO_CONFIG_DIR=os.path.join(self.tmpdir, 'etc'),
+                CEO_LIB_DIR=os.path.join(self.tmpdir, 'lib'),
+                CEO_PORT=str(self.port))
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='ceo-ceod-')
+        etc_dir = os.path.join(self.tmpdir, 'etc')
+        lib_dir = os.path.join(self.tmpdir, 'lib')
+        os.makedirs(os.path.join(etc_dir, 'ops'))
+        os.mkdir(lib_dir)
+        shutil.copy(os.path.join(ROOT, 'etc', 'accounts.cf'), etc_dir)
+
+        # ops are local when their host is this machine's name
+        host = os.uname()[1]
+        user = os.environ.get('USER') or os.environ.get('LOGNAME')
+        if not user:
+            import pwd
+            user = pwd.getpwuid(os.getuid()).pw_name
+
+        with open(os.path.join(etc_dir, 'ops', 'bench'), 'w') as f:
+            for name, op_id, builder, response_type in OPS:
+                limit = self.limits.get(name, '')
+                f.write('%s %s %s 0x%02x %s\n' % (host, name, user, op_id, limit))
+
+                response = os.path.join(lib_dir, '%s.response' % name)
+                with open(response, 'wb') as out:
+                    out.write(build_response(response_type))
+
+                path = os.path.join(lib_dir, 'op-%s' % name)
+                with open(path, 'w') as out:
+                    out.write(STUB_OP % {
+                        'sleep': 'sleep %s' % self.op_delay if self.op_delay else '',
+                        'response': response,
+                    })
+                os.chmod(path, 0755)
+
+    def start(self):
+        self.setup()
+        self.log = open(os.path.join(self.tmpdir, 'ceod.log'), 'w')
+        self.proc = subprocess.Popen([ self.ceod, '--quiet' ], env=self.env(),
+                stdout=self.log, stderr=subprocess.STDOUT)
+
+        deadline = time.time() + 10
+        while True:
+            if self.proc.poll() is not None:
+                raise Exception('ceod exited:\n%s' % open(self.log.name).read())
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    raise Exception('ceod is not listening on port %d' % self.port)
+                time.sleep(0.05)
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+        if self.log:
+            self.log.close()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir)
+
+
+def percentile(times, pct):
+    if not times:
+        return None
+    index = min(len(times) - 1, int(round(pct / 100.0 * (len(times) - 1))))
+    return times[index]
+
+
+def summarize(times, elapsed):
+    times = sorted(times)
+    return {
+        'requests': len(times),
+        'throughput': len(times) / elapsed if elapsed else None,
+        'p50': percentile(times, 50),
+        'p90': percentile(times, 90),
+        'p99': percentile(times, 99),
+        'max': times[-1] if times else None,
+    }
+
+
+class LoadGenerator:
+    """Sends requests from a number of client threads, round-robin over ops."""
+
+    def __init__(self, ceoc, env, clients, requests, ops):
+        self.ceoc = ceoc
+        self.env = env
+        self.clients = clients
+        self.requests = requests
+        self.ops = ops
+        self.next = 0
+        self.lock = threading.Lock()
+        self.times = dict((op[0], []) for op in ops)
+        self.errors = dict((op[0], 0) for op in ops)
+
+    def take(self):
+        with self.lock:
+            i = self.next
+            self.next += 1
+        return i if i < self.requests else None
+
+    def send(self, i):
+        name, op_id, builder, response_type = self.ops[i % len(self.ops)]
+        data = builder(i)
+
+        start = time.time()
+        proc = subprocess.Popen([ self.ceoc, name ], env=self.env,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate(data)
+        elapsed = time.time() - start
+
+        ok = not proc.returncode and out
+        if ok:
+            response = response_type()
+            response.ParseFromString(out)
+            ok = all(message.status == 0 for message in response.messages)
+
+        with self.lock:
+            if ok:
+                self.times[name].append(elapsed)
+            else:
+                self.errors[name] += 1
+
+    def worker(self):
+        while True:
+            i = self.take()
+            if i is None:
+                break
+            self.send(i)
+
+    def run(self):
+        threads = [ threading.Thread(target=self.worker) for i in xrange(self.clients) ]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+
+def main():
+    parser = OptionParser(usage='%prog [--clients N] [--requests N] [--ops adduser,mail,mysql] [--output FILE]')
+    parser.add_option('--ceod', default=os.path.join(ROOT, 'src', 'ceod-noauth'))
+    parser.add_option('--ceoc', default=os.path.join(ROOT, 'src', 'ceoc-noauth'))
+    parser.add_option('--port', type='int', default=19987)
+    parser.add_option('--clients', type='int', default=8)
+    parser.add_option('--requests', type='int', default=1000)
+    parser.add_option('--ops', default='adduser,mail,mysql')
+    parser.add_option('--op-delay', type='float', default=0,
+            help='seconds each stub op sleeps, to stand in for real work')
+    parser.add_option('--limit', action='append', default=[], metavar='OP=N',
+            help='concurrency limit for an op, as in etc/ops')
+    parser.add_option('--output', help='write results here instead of stdout')
+    options, args = parser.parse_args()
+
+    for path in options.ceod, options.ceoc:
+        if not os.access(path, os.X_OK):
+            parser.error('%s not found; run make -C src noauth' % path)
+
+    wanted = options.ops.split(',')
+    ops = [ op for op in OPS if op[0] in wanted ]
+    if len(ops) != len(wanted):
+        parser.error('unknown op in %s' % options.ops)
+    limits = dict(limit.split('=', 1) for limit in options.limit)
+
+    daemon = Daemon(options.ceod, options.port, options.op_delay, limits)
+    try:
+        daemon.start()
+        load = LoadGenerator(options.ceoc, daemon.env(), options.clients, options.requests, ops)
+        elapsed = load.run()
+
+        host = os.uname()[1]
+        server_stats = subprocess.Popen([ options.ceoc, '--stats', host ], env=daemon.env(),
+                stdout=subprocess.PIPE).communicate()[0]
+    finally:
+        daemon.stop()
+
+    results = {
+        'clients': options.clients,
+        'op_delay': options.op_delay,
+        'limits': limits,
+        'seconds': elapsed,
+        'total': summarize(sum(load.times.values(), []), elapsed),
+        'ops': {},
+        'server_stats': server_stats.splitlines(),
+    }
+    for name, times in load.times.iteritems():
+        results['ops'][name] = summarize(times, elapsed)
+        results['ops'][name]['errors'] = load.errors[name]
+
+    print >>sys.stderr, '%-8s %8s %8s %10s %8s %8s %8s' % ('op', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms')
+    for name, summary in sorted(results['ops'].items()) + [ ('total', results['total']) ]:
+        if not summary['requests']:
+            continue
+        print >>sys.stderr, '%-8s %8d %8d %10.1f %8.1f %8.1f %8.1f' % (name, summary['requests'],
+                summary.get('errors', sum(load.errors.values())), summary['throughput'],
+                summary['p50'] * 1000, summary['p90'] * 1000, summary['p99'] * 1000)
+
+    output = open(options.output, 'w') if options.output else sys.stdout
+    json.dump(results, output, indent=2, sort_keys=True)
+    output.write('\n')
+    if options.output:
+        output.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/python
+"""
+Directory benchmark
+
+Times the ceo.members API and the console reports against a generated
+directory of N members, their terms and groups. The directory is served
+by a throwaway slapd (loaded with etc/csc.schema) when one is installed,
+or by the in-memory fake in bench/fakeldap.py otherwise, e.g.
+
+    python bench/directory.py --members 50000 --output slapd-50k.json
+
+Results are written as JSON: for each case the min, median and mean
+seconds per run, and the directory calls it made as recorded by
+ceo.ldapi. Runs with the same backend, size and seed are comparable.
+"""
+
+import os, sys, json, random, shutil, signal, subprocess, tempfile, time, urllib
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ldap, ldif
+from ceo import members, ldapi, terms
+
+SUFFIX = 'dc=csclub,dc=uwaterloo,dc=ca'
+USERS_BASE = 'ou=People,' + SUFFIX
+GROUPS_BASE = 'ou=Group,' + SUFFIX
+ROOT_DN = 'cn=bench,' + SUFFIX
+ROOT_PW = 'bench'
+
+SLAPD_PATHS = [ '/usr/sbin/slapd', '/usr/libexec/slapd', '/usr/local/libexec/slapd' ]
+SCHEMA_DIRS = [ '/etc/ldap/schema', '/etc/openldap/schema' ]
+SCHEMAS = [ 'core', 'cosine', 'nis', 'inetorgperson' ]
+MODULE_DIRS = [ '/usr/lib/ldap', '/usr/lib/openldap', '/usr/lib64/openldap' ]
+
+FIRST_NAMES = [ 'Alex', 'Calum', 'Dana', 'Jordan', 'Kim', 'Michael', 'Priya', 'Sam', 'Wei', 'Zoe' ]
+LAST_NAMES = [ 'Chen', 'Dalek', 'Gupta', 'Li', 'MacDonald', 'Nguyen', 'Patel', 'Smith', 'Spang', 'Tremblay' ]
+PROGRAMS = [ 'Computer Science', 'Mathematics', 'Software Engineering',
+        'Electrical Engineering', 'Physics', 'Alumni' ]
+POSITIONS = [ 'president', 'vicepresident', 'treasurer', 'secretary',
+        'sysadmin', 'cro', 'librarian', 'imapd', 'webmaster', 'offsck' ]
+
+# number of members looked up or registered by the per-member cases
+SAMPLE = 100
+
+# first uid/gid number handed out to generated entries
+FIRST_ID = 20000
+
+
+### Population ###
+
+def username(i):
+    return 'user%06d' % i
+
+
+def generate(n_members, seed):
+    """
+    Builds the directory as a list of (dn, attributes). The same size and
+    seed always give the same directory.
+    """
+
+    rand = random.Random(seed)
+    recent = terms.interval(terms.add(terms.current(), -11), 12)
+
+    entries = [
+        (SUFFIX, { 'objectClass': [ 'top', 'dcObject', 'organization' ],
+                   'dc': [ 'csclub' ], 'o': [ 'Computer Science Club' ] }),
+        (USERS_BASE, { 'objectClass': [ 'top', 'organizationalUnit' ], 'ou': [ 'People' ] }),
+        (GROUPS_BASE, { 'objectClass': [ 'top', 'organizationalUnit' ], 'ou': [ 'Group' ] }),
+    ]
+
+    for i in xrange(n_members):
+        uid = username(i)
+        attrs = {
+            'objectClass': [ 'account', 'member', 'posixAccount', 'shadowAccount' ],
+            'uid': [ uid ],
+            'cn': [ '%s %s' % (rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES)) ],
+            'uidNumber': [ str(FIRST_ID + i) ],
+            'gidNumber': [ str(FIRST_ID + i) ],
+            'homeDirectory': [ '/users/%s' % uid ],
+            'loginShell': [ '/bin/bash' ],
+            'program': [ rand.choice(PROGRAMS) ],
+        }
+        paid = sorted(rand.sample(recent, rand.randint(1, 4)))
+        if rand.random() < 0.1:
+            attrs['nonMemberTerm'] = paid
+        else:
+            attrs['term'] = paid
+        if i < len(POSITIONS):
+            attrs['position'] = [ POSITIONS[i] ]
+        entries.append(('uid=%s,%s' % (uid, USERS_BASE), attrs))
+
+    groups = [ ('syscom', 30), ('office', 200) ]
+    groups += [ ('club%04d' % i, 10) for i in xrange(max(1, n_members / 20)) ]
+    for name, size in groups:
+        chosen = rand.sample(xrange(n_members), min(size, n_members))
+        entries.append(('cn=%s,%s' % (name, GROUPS_BASE), {
+            'objectClass': [ 'top', 'group' ],
+            'cn': [ name ],
+            'uniqueMember': [ 'uid=%s,%s' % (username(j), USERS_BASE) for j in sorted(chosen) ],
+        }))
+
+    return entries
+
+
+### Backends ###
+
+class FakeBackend:
+    """Loads the directory into a bench.fakeldap.FakeLDAPObject."""
+
+    name = 'fake'
+
+    def start(self, entries):
+        from fakeldap import FakeLDAPObject
+        self.ld = FakeLDAPObject()
+        for dn, attrs in entries:
+            self.ld.add_s(dn, attrs.items())
+        return self.ld
+
+    def stop(self):
+        pass
+
+
+class SlapdBackend:
+    """Runs a private slapd on a unix socket in a temporary directory."""
+
+    name = 'slapd'
+
+    def __init__(self, slapd):
+        self.slapd = slapd
+        self.proc = None
+        self.tmpdir = None
+
+    def config(self):
+        schema_dir = find_dir(SCHEMA_DIRS, 'core.schema')
+        if not schema_dir:
+            raise Exception('no OpenLDAP schema directory found')
+        lines = [ 'include %s/%s.schema' % (schema_dir, schema) for schema in SCHEMAS ]
+        lines.append('include %s' % os.path.join(ROOT, 'etc', 'csc.schema'))
+        module_dir = find_dir(MODULE_DIRS, 'back_mdb.la')
+        if module_dir:
+            lines += [ 'modulepath %s' % module_dir, 'moduleload back_mdb' ]
+        lines += [
+            'pidfile %s/slapd.pid' % self.tmpdir,
+            'database mdb',
+            'maxsize 4294967296',
+            'suffix "%s"' % SUFFIX,
+            'rootdn "%s"' % ROOT_DN,
+            'rootpw %s' % ROOT_PW,
+            'directory %s/db' % self.tmpdir,
+            'index objectClass eq',
+            'index uid,cn eq',
+            'index term,nonMemberTerm eq',
+            'index position pres',
+            'index uniqueMember eq',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def start(self, entries):
+        self.tmpdir = tempfile.mkdtemp(prefix='ceo-slapd-')
+        os.mkdir(os.path.join(self.tmpdir, 'db'))
+        conf_file = os.path.join(self.tmpdir, 'slapd.conf')
+        ldif_file = os.path.join(self.tmpdir, 'data.ldif')
+        socket_path = os.path.join(self.tmpdir, 'ldapi')
+        uri = 'ldapi://' + urllib.quote(socket_path, safe='')
+
+        with open(conf_file, 'w') as f:
+            f.write(self.config())
+        with open(ldif_file, 'w') as f:
+            writer = ldif.LDIFWriter(f)
+            for dn, attrs in entries:
+                writer.unparse(dn, attrs)
+
+        # bulk load offline; adding entries one by one over the wire is slow
+        slapadd = [ os.path.join(os.path.dirname(self.slapd), 'slapadd') ]
+        if not os.path.exists(slapadd[0]):
+            slapadd = [ self.slapd, '-T', 'add' ]
+        subprocess.check_call(slapadd + [ '-q', '-f', conf_file, '-l', ldif_file ])
+
+        self.proc = subprocess.Popen([ self.slapd, '-d', '0', '-f', conf_file, '-h', uri ])
+        deadline = time.time() + 30
+        while not os.path.exists(socket_path):
+            if self.proc.poll() is not None or time.time() > deadline:
+                raise Exception('slapd did not start')
+            time.sleep(0.05)
+
+        ld = ldap.initialize(uri)
+        ld.simple_bind_s(ROOT_DN, ROOT_PW)
+        return ld
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            os.kill(self.proc.pid, signal.SIGTERM)
+            self.proc.wait()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir)
+
+
+def find_dir(candidates, filename):
+    for path in candidates:
+        if os.path.exists(os.path.join(path, filename)):
+            return path
+    return None
+
+
+def make_backend(name):
+    slapd = None
+    for path in SLAPD_PATHS:
+        if os.path.exists(path):
+            slapd = path
+            break
+    if name == 'slapd' and not slapd:
+        raise Exception('slapd not found in %s' % ', '.join(SLAPD_PATHS))
+    if name == 'fake' or not slapd:
+        return FakeBackend()
+    return SlapdBackend(slapd)
+
+
+### Cases ###
+
+def sample_users(n_members):
+    step = max(1, n_members / SAMPLE)
+    return [ username(i) for i in range(0, n_members, step)[:SAMPLE] ]
+
+
+def console(command_class, args):
+    # reports print every member; only the time to produce them matters
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        command_class().main(args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def make_cases(n_members):
+    from ceo.console.memberlist import MemberList
+    from ceo.console.inactive import Inactive
+
+    users = sample_users(n_members)
+
+    def get_sample(run):
+        for uid in users:
+            members.get(uid)
+
+    def registered_sample(run):
+        for uid in users:
+            members.registered(uid, terms.current())
+
+    def registered_current_sample(run):
+        # includes loading the term's member list once
+        members.term_members_cache.clear()
+        for uid in users:
+            members.registered_current(uid)
+
+    def register_sample(run):
+        # a term nobody has yet, so every run really modifies the entries
+        term = terms.add(terms.current(), 4 + run)
+        for uid in users:
+            members.register(uid, term)
+
+    return [
+        ('members.get x%d' % len(users), get_sample),
+        ('members.list_all', lambda run: members.list_all()),
+        ('members.list_term', lambda run: members.list_term(terms.current())),
+        ('members.list_group office', lambda run: members.list_group('office')),
+        ('members.list_positions', lambda run: members.list_positions()),
+        ('members.registered x%d' % len(users), registered_sample),
+        ('members.registered_current x%d' % len(users), registered_current_sample),
+        ('members.register x%d' % len(users), register_sample),
+        ('members.expired_accounts', lambda run: members.expired_accounts()),
+        ('console memberlist', lambda run: console(MemberList, [])),
+        ('console inactive 3', lambda run: console(Inactive, [ '3' ])),
+    ]
+
+
+def directory_calls():
+    calls = []
+    for (op, shape), totals in sorted(ldapi.stats().items()):
+        totals.update(op=op, filter=shape)
+        calls.append(totals)
+    return calls
+
+
+def run_case(func, runs):
+    ldapi.reset_stats()
+    times = []
+    for run in xrange(runs):
+        start = time.time()
+        func(run)
+        times.append(time.time() - start)
+    times.sort()
+    return {
+        'runs': runs,
+        'min': times[0],
+        'median': times[len(times) / 2],
+        'mean': sum(times) / len(times),
+        'calls': directory_calls(),
+    }
+
+
+def main():
+    parser = OptionParser(usage='%prog [--members N] [--backend auto|fake|slapd] [--runs N] [--output FILE]')
+    parser.add_option('--members', type='int', default=10000)
+    parser.add_option('--backend', choices=[ 'auto', 'fake', 'slapd' ], default='auto')
+    parser.add_option('--runs', type='int', default=5)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--output', help='write results here instead of stdout')
+    options, args = parser.parse_args()
+
+    entries = generate(options.members, options.seed)
+    backend = make_backend(options.backend)
+
+    members.cfg.update({
+        'ldap_users_base': USERS_BASE,
+        'ldap_groups_base': GROUPS_BASE,
+    })
+
+    try:
+        start = time.time()
+        members.ld = backend.start(entries)
+        load_time = time.time() - start
+
+        results = {
+            'backend': backend.name,
+            'members': options.members,
+            'entries': len(entries),
+            'seed': options.seed,
+            'term': terms.current(),
+            'load_seconds': load_time,
+            'cases': {},
+        }
+        for name, func in make_cases(options.members):
+            results['cases'][name] = run_case(func, options.runs)
+            print >>sys.stderr, '%-28s %10.1f ms' % (name, results['cases'][name]['median'] * 1000)
+    finally:
+        members.ld = None
+        backend.stop()
+
+    output = open(options.output, 'w') if options.output else sys.stdout
+    json.dump(results, output, indent=2, sort_keys=True)
+    output.write('\n')
+    if options.output:
+        output.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+In-memory LDAP directory
+
+A small stand-in for a python-ldap LDAPObject, good enough to run the
+ceo.members code against when no slapd is available. It supports the
+synchronous search, add, modify and delete calls and the usual filter
+syntax (&, |, !, =, =*, substrings, >=, <= and ~=). Matching is case
+insensitive and every search is a linear scan, so absolute numbers are
+only comparable with other runs against the fake.
+"""
+
+import ldap
+
+
+def normalize_dn(dn):
+    return ','.join(part.strip() for part in dn.lower().split(','))
+
+
+def unescape(value):
+    out, i = [], 0
+    while i < len(value):
+        if value[i] == '\\' and i + 2 < len(value):
+            out.append(chr(int(value[i+1:i+3], 16)))
+            i += 3
+        else:
+            out.append(value[i])
+            i += 1
+    return ''.join(out)
+
+
+class FilterError(Exception):
+    pass
+
+
+def parse_filter(text):
+    """Compiles a filter string into a function of an entry's attributes."""
+
+    func, pos = parse_item(text, 0)
+    if pos != len(text):
+        raise FilterError('trailing characters in filter %r' % text)
+    return func
+
+
+def parse_item(text, pos):
+    if text[pos] != '(':
+        raise FilterError('expected ( at %d in %r' % (pos, text))
+    pos += 1
+    if text[pos] in '&|':
+        op = text[pos]
+        pos += 1
+        children = []
+        while text[pos] == '(':
+            child, pos = parse_item(text, pos)
+            children.append(child)
+        if op == '&':
+            func = lambda attrs: all(child(attrs) for child in children)
+        else:
+            func = lambda attrs: any(child(attrs) for child in children)
+    elif text[pos] == '!':
+        child, pos = parse_item(text, pos + 1)
+        func = lambda attrs: not child(attrs)
+    else:
+        end = text.index(')', pos)
+        func = parse_assertion(text[pos:end])
+        pos = end
+    if text[pos] != ')':
+        raise FilterError('expected ) at %d in %r' % (pos, text))
+    return func, pos + 1
+
+
+def parse_assertion(text):
+    for operator in ('>=', '<=', '~=', '='):
+        if operator in text:
+            attr, value = text.split(operator, 1)
+            break
+    else:
+        raise FilterError('bad assertion %r' % text)
+    attr = attr.strip().lower()
+
+    def values(attrs):
+        return attrs.get(attr, ())
+
+    if operator == '=' and value == '*':
+        return lambda attrs: bool(values(attrs))
+    if operator == '=' and '*' in value:
+        parts = [ unescape(part).lower() for part in value.split('*') ]
+        def substring(attrs):
+            for candidate in values(attrs):
+                candidate = candidate.lower()
+                if not candidate.startswith(parts[0]):
+                    continue
+                pos = len(parts[0])
+                for part in parts[1:-1]:
+                    pos = candidate.find(part, pos)
+                    if pos < 0:
+                        break
+                    pos += len(part)
+                else:
+                    if candidate[pos:].endswith(parts[-1]):
+                        return True
+            return False
+        return substring
+
+    value = unescape(value).lower()
+    if operator == '=':
+        return lambda attrs: value in [ v.lower() for v in values(attrs) ]
+    if operator == '>=':
+        return lambda attrs: any(v.lower() >= value for v in values(attrs))
+    if operator == '<=':
+        return lambda attrs: any(v.lower() <= value for v in values(attrs))
+    return lambda attrs: any(value in v.lower() for v in values(attrs))
+
+
+class FakeLDAPObject:
+    """Implements the LDAPObject methods used by ceo."""
+
+    def __init__(self):
+        # normalized dn -> (dn, attributes)
+        self.entries = {}
+        self.filters = {}
+
+    def connected(self):
+        return True
+
+    def unbind_s(self):
+        pass
+
+    def simple_bind_s(self, who='', cred=''):
+        pass
+
+    def add_s(self, dn, modlist):
+        key = normalize_dn(dn)
+        if key in self.entries:
+            raise ldap.ALREADY_EXISTS({ 'desc': 'Already exists', 'info': dn })
+        self.entries[key] = (dn, dict((attr, list(values)) for attr, values in modlist))
+
+    def delete_s(self, dn):
+        if self.entries.pop(normalize_dn(dn), None) is None:
+            raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object', 'info': dn })
+
+    def modify_s(self, dn, modlist):
+        key = normalize_dn(dn)
+        if key not in self.entries:
+            raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object', 'info': dn })
+        attrs = self.entries[key][1]
+        for op, attr, values in modlist:
+            name = self.attr_name(attrs, attr)
+            if values is not None and type(values) is not list:
+                values = [ values ]
+            if op == ldap.MOD_ADD:
+                attrs.setdefault(name, []).extend(values)
+            elif op == ldap.MOD_REPLACE:
+                attrs[name] = list(values or [])
+            elif op == ldap.MOD_DELETE:
+                if values:
+                    attrs[name] = [ v for v in attrs.get(name, []) if v not in values ]
+                else:
+                    attrs[name] = []
+            if not attrs.get(name):
+                attrs.pop(name, None)
+
+    def attr_name(self, attrs, attr):
+        for name in attrs:
+            if name.lower() == attr.lower():
+                return name
+        return attr
+
+    def compile(self, search_filter):
+        if search_filter not in self.filters:
+            self.filters[search_filter] = parse_filter(search_filter)
+        return self.filters[search_filter]
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        match = self.compile(filterstr)
+        base_key = normalize_dn(base)
+
+        if scope == ldap.SCOPE_BASE:
+            if base_key not in self.entries:
+                raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object', 'info': base })
+            candidates = [ self.entries[base_key] ]
+        else:
+            suffix = ',' + base_key
+            candidates = [ entry for key, entry in self.entries.iteritems() if key.endswith(suffix) ]
+            if scope == ldap.SCOPE_ONELEVEL:
+                depth = base_key.count(',') + 1
+                candidates = [ entry for entry in candidates
+                        if normalize_dn(entry[0]).count(',') == depth ]
+
+        wanted = attrlist and set(attr.lower() for attr in attrlist)
+        results = []
+        for dn, attrs in candidates:
+            lowered = dict((name.lower(), values) for name, values in attrs.iteritems())
+            if not match(lowered):
+                continue
+            # hand out copies, as python-ldap would
+            results.append((dn, dict((name, [] if attrsonly else list(values))
+                for name, values in attrs.iteritems()
+                if not wanted or name.lower() in wanted)))
+        return results
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+"""
+Library query benchmark
+
+Times the queries behind each library screen in ceo.urwid.library, and
+counts the SQL statements each one issues, against a SQLite catalogue
+made by bench/libraryfixture.py (one is generated in a temporary
+directory if --database is not given, and indexed with
+ceo.library.migrate()), e.g.
+
+    python bench/libraryfixture.py --books 50000 /tmp/library.db
+    python bench/librarydb.py --database /tmp/library.db --runs 5
+
+Each case does what its screen does: run the query and build the text
+shown for every result. SQLObject's instance cache is cleared before
+each run, so every run is what a freshly opened screen costs.
+"""
+
+import os, sys, json, shutil, tempfile, time
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ceo import library as lib
+import libraryfixture
+
+
+class StatementCounter:
+    """Counts the statements sent through a SQLObject connection."""
+
+    def __init__(self, conn):
+        self.count = 0
+        self.execute = conn._executeRetry
+        conn._executeRetry = self.execute_counted
+
+    def execute_counted(self, rawconn, cursor, query):
+        self.count += 1
+        return self.execute(rawconn, cursor, query)
+
+
+def overdue_screen():
+    return [ str(d) for d in lib.overdue_report() ]
+
+
+def outstanding_screen():
+    return [ str(d) for d in lib.display_signouts(lib.outstanding()) ]
+
+
+def user_screen(username):
+    return [ str(d) for d in lib.display_signouts(lib.outstanding(username)) ]
+
+
+def title_screen(title):
+    return [ str(d) for d in lib.display_books(lib.title_search(title)) ]
+
+
+def catalogue_screen(text):
+    return [ str(d) for d in lib.display_books(lib.search_books(text)) ]
+
+
+def isbn_screen(isbn):
+    return [ str(d) for d in lib.display_books(lib.isbn_search(isbn)) ]
+
+
+def sign_in(book_id, username):
+    # what Book.sign_in looks up, without changing the fixture
+    book = lib.Book.get(book_id)
+    s = book.signouts.filter(lib.AND(lib.Signout.q.indate==None,
+                                     lib.Signout.q.username==username))
+    return list(s.orderBy(lib.Signout.q.outdate).limit(1))
+
+
+def book_str(isbn):
+    return [ str(b) for b in lib.isbn_search(isbn) ]
+
+
+def make_cases():
+    # a borrower with something out, and a real isbn, from the fixture
+    signout = list(lib.outstanding().limit(1))[0]
+    username, isbn, book_id = signout.username, signout.book.isbn, signout.bookID
+
+    return [
+        ('overdue books', overdue_screen),
+        ('signed out books', outstanding_screen),
+        ('signed out to %s' % username, lambda: user_screen(username)),
+        ('title search "Compilers"', lambda: title_screen('Compilers')),
+        ('title search "Concrete Mathematics"', lambda: title_screen('Concrete Mathematics')),
+        ('catalogue search "Compilers"', lambda: catalogue_screen('Compilers')),
+        ('catalogue search "knuth compil"', lambda: catalogue_screen('knuth compil')),
+        ('catalogue search "prentice"', lambda: catalogue_screen('prentice')),
+        ('isbn search', lambda: isbn_screen(isbn)),
+        ('sign in lookup', lambda: sign_in(book_id, username)),
+        ('str(Book)', lambda: book_str(isbn)),
+    ]
+
+
+def run_case(conn, counter, func, runs):
+    times, statements = [], []
+    for run in xrange(runs):
+        conn.cache.clear()
+        counter.count = 0
+        start = time.time()
+        rows = len(func())
+        times.append(time.time() - start)
+        statements.append(counter.count)
+    times.sort()
+    return {
+        'runs': runs,
+        'rows': rows,
+        'statements': max(statements),
+        'min': times[0],
+        'median': times[len(times) / 2],
+        'mean': sum(times) / len(times),
+    }
+
+
+def main():
+    parser = OptionParser(usage='%prog [--database FILE | --books N ...] [--runs N] [--output FILE]')
+    parser.add_option('--database', help='fixture made by libraryfixture.py')
+    parser.add_option('--books', type='int', default=20000)
+    parser.add_option('--authors', type='int', default=5000)
+    parser.add_option('--signouts', type='int', default=40000)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--runs', type='int', default=5)
+    parser.add_option('--output', help='write results here instead of stdout')
+    options, args = parser.parse_args()
+
+    tmpdir = None
+    try:
+        if options.database:
+            conn = libraryfixture.use_database(options.database)
+        else:
+            tmpdir = tempfile.mkdtemp(prefix='ceo-library-')
+            conn = libraryfixture.use_database(os.path.join(tmpdir, 'library.db'))
+            libraryfixture.create_tables()
+            libraryfixture.populate(options.books, options.authors, options.signouts,
+                    2000, options.seed)
+            lib.migrate()
+
+        results = {
+            'books': lib.Book.select().count(),
+            'authors': lib.Author.select().count(),
+            'signouts': lib.Signout.select().count(),
+            'cases': {},
+        }
+
+        counter = StatementCounter(conn)
+        for name, func in make_cases():
+            results['cases'][name] = run_case(conn, counter, func, options.runs)
+            case = results['cases'][name]
+            print >>sys.stderr, '%-40s %6d rows %7d statements %10.1f ms' % (name,
+                    case['rows'], case['statements'], case['median'] * 1000)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+    output = open(options.output, 'w') if options.output else sys.stdout
+    json.dump(results, output, indent=2, sort_keys=True)
+    output.write('\n')
+    if options.output:
+        output.close()
+
+if __name__ == '__main__':
+    main()
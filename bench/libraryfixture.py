@@ -0,0 +1,130 @@
+#!/usr/bin/python
+"""
+Library fixture generator
+
+Fills a SQLite database with a generated catalogue for ceo.library:
+books with one to three authors each, and a signout history in which
+most books have been returned, some are out and some of those are
+overdue, e.g.
+
+    python bench/libraryfixture.py --books 50000 /tmp/library.db
+
+Rows are inserted directly with executemany, as creating tens of
+thousands of SQLObject instances one at a time would take minutes.
+The same sizes and seed always give the same database. The catalogue
+search index is built afterwards with ceo.library.migrate().
+"""
+
+import os, sys, random
+from datetime import date, timedelta
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ceo import library as lib
+
+WORDS = [ 'Algorithms', 'Analysis', 'Applied', 'Art', 'Compilers', 'Computer',
+        'Concrete', 'Data', 'Design', 'Discrete', 'Distributed', 'Elements',
+        'Engineering', 'Functional', 'Graphics', 'Guide', 'Handbook',
+        'Introduction', 'Language', 'Learning', 'Linux', 'Logic', 'Mathematics',
+        'Modern', 'Networks', 'Operating', 'Patterns', 'Practice', 'Principles',
+        'Programming', 'Programs', 'Structure', 'Structures', 'Systems', 'Theory',
+        'Unix' ]
+FIRST_NAMES = [ 'Alan', 'Barbara', 'Brian', 'Donald', 'Edsger', 'Frances',
+        'Grace', 'John', 'Ken', 'Leslie', 'Niklaus', 'Robert', 'Tony' ]
+LAST_NAMES = [ 'Abelson', 'Dijkstra', 'Hoare', 'Hopper', 'Kernighan', 'Knuth',
+        'Lamport', 'Liskov', 'McCarthy', 'Ritchie', 'Sussman', 'Tarjan', 'Wirth' ]
+PUBLISHERS = [ 'Addison-Wesley', 'MIT Press', "O'Reilly", 'Prentice Hall', 'Springer' ]
+
+# fraction of signouts still out, and of those the fraction that are overdue
+OUTSTANDING = 0.05
+OVERDUE = 0.5
+
+
+def isbn13(rand):
+    digits = [ 9, 7, 8 ] + [ rand.randint(0, 9) for i in xrange(9) ]
+    check = -sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10
+    return ''.join(str(d) for d in digits + [ check ])
+
+
+def title(rand):
+    return ' '.join(rand.sample(WORDS, rand.randint(2, 5)))
+
+
+def use_database(path):
+    """Points ceo.library at the SQLite database in path."""
+
+    lib.cfg['library_connect_string'] = 'sqlite://' + os.path.abspath(path)
+    return lib.hub.getConnection()
+
+
+def create_tables():
+    for cls in lib.Book, lib.Author, lib.Signout:
+        cls.createTable(ifNotExists=True)
+
+
+def populate(books, authors, signouts, users, seed):
+    rand = random.Random(seed)
+    today = date.today()
+    conn = lib.hub.getConnection()
+    raw = conn.getConnection()
+    cursor = raw.cursor()
+
+    def insert(cls, columns, rows):
+        names = [ 'id' ] + [ cls.sqlmeta.columns[column].dbName for column in columns ]
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (cls.sqlmeta.table,
+            ', '.join(names), ', '.join('?' * len(names))), rows)
+
+    insert(lib.Author, [ 'name' ], [ (i + 1, '%s %s' % (rand.choice(FIRST_NAMES),
+        rand.choice(LAST_NAMES))) for i in xrange(authors) ])
+
+    insert(lib.Book, [ 'isbn', 'title', 'year', 'publisher' ], [ (i + 1, isbn13(rand),
+        title(rand), str(rand.randint(1960, today.year)), rand.choice(PUBLISHERS))
+        for i in xrange(books) ])
+
+    join = [ j for j in lib.Book.sqlmeta.joins if j.otherClass is lib.Author ][0]
+    cursor.executemany('INSERT INTO %s (%s, %s) VALUES (?, ?)' % (join.intermediateTable,
+        join.joinColumn, join.otherColumn), [ (book, author)
+            for book in xrange(1, books + 1)
+            for author in rand.sample(xrange(1, authors + 1), rand.randint(1, 3)) ])
+
+    rows = []
+    for i in xrange(signouts):
+        outdate = today - timedelta(days=rand.randint(0, 730))
+        indate = outdate + timedelta(days=rand.randint(1, 30))
+        if rand.random() < OUTSTANDING:
+            if rand.random() < OVERDUE:
+                outdate = today - lib.LOAN_PERIOD - timedelta(days=rand.randint(1, 60))
+            else:
+                outdate = today - timedelta(days=rand.randint(0, lib.LOAN_PERIOD.days - 1))
+            indate = None
+        rows.append((i + 1, 'user%06d' % rand.randint(0, users - 1),
+            rand.randint(1, books), outdate, indate))
+    insert(lib.Signout, [ 'username', 'bookID', 'outdate', 'indate' ], rows)
+
+    raw.commit()
+    conn.releaseConnection(raw)
+
+
+def main():
+    parser = OptionParser(usage='%prog [--books N] [--authors N] [--signouts N] DATABASE')
+    parser.add_option('--books', type='int', default=20000)
+    parser.add_option('--authors', type='int', default=5000)
+    parser.add_option('--signouts', type='int', default=40000)
+    parser.add_option('--users', type='int', default=2000)
+    parser.add_option('--seed', type='int', default=0)
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('expected a database file name')
+    if os.path.exists(args[0]):
+        parser.error('%s already exists' % args[0])
+
+    use_database(args[0])
+    create_tables()
+    populate(options.books, options.authors, options.signouts, options.users, options.seed)
+    print lib.migrate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+"""
+Startup benchmark
+
+Times how long a fresh ceo process takes to get as far as running a
+console command, i.e. loading bin/ceo and the command's module. No LDAP
+server or configuration is needed; the commands are not run.
+
+With --baseline REV the same measurement is made on a copy of that git
+revision, so the cost of eager imports can be compared, e.g.
+
+    python bench/startup.py --baseline HEAD~1 --runs 20
+"""
+
+import os, sys, subprocess, shutil, tempfile, time
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# load bin/ceo as a module (which does not call start()), then the command
+LOAD_COMMAND = """
+import imp
+imp.load_source('ceo_script', 'bin/ceo')
+import ceo.console.%s
+"""
+
+def time_run(tree, args):
+    path = [ tree ] + filter(None, [ os.environ.get('PYTHONPATH') ])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path))
+    start = time.time()
+    proc = subprocess.Popen([ sys.executable ] + args, cwd=tree, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    elapsed = time.time() - start
+    if proc.returncode:
+        raise Exception('%s failed in %s:\n%s' % (' '.join(args), tree, err))
+    return elapsed
+
+def measure(tree, args, runs):
+    # the first run compiles .pyc files; do not count it
+    time_run(tree, args)
+    times = sorted(time_run(tree, args) for i in xrange(runs))
+    return times[0], times[len(times) / 2]
+
+def export_revision(rev):
+    tree = tempfile.mkdtemp(prefix='ceo-startup-')
+    archive = subprocess.Popen([ 'git', 'archive', rev ], cwd=ROOT, stdout=subprocess.PIPE)
+    tar = subprocess.Popen([ 'tar', '-x', '-C', tree ], stdin=archive.stdout)
+    archive.stdout.close()
+    if tar.wait() or archive.wait():
+        raise Exception('could not export revision %s' % rev)
+    # generated from src/ceo.proto at build time, so not in git
+    generated = os.path.join(ROOT, 'ceo', 'ceo_pb2.py')
+    if os.path.exists(generated):
+        shutil.copy(generated, os.path.join(tree, 'ceo'))
+    return tree
+
+def main():
+    parser = OptionParser(usage='%prog [--baseline REV] [--runs N] [--command NAME]')
+    parser.add_option('--baseline', help='git revision to compare against')
+    parser.add_option('--runs', type='int', default=10)
+    parser.add_option('--command', default='memberlist')
+    options, args = parser.parse_args()
+
+    trees = [ ('working tree', ROOT) ]
+    if options.baseline:
+        trees.insert(0, (options.baseline, export_revision(options.baseline)))
+
+    cases = [ ('load %s' % options.command, [ '-c', LOAD_COMMAND % options.command ]) ]
+
+    try:
+        print '%-16s %-24s %10s %10s' % ('tree', 'case', 'min ms', 'median ms')
+        for name, tree in trees:
+            for label, args in cases:
+                best, median = measure(tree, args, options.runs)
+                print '%-16s %-24s %10.1f %10.1f' % (name, label, best * 1000, median * 1000)
+    finally:
+        for name, tree in trees:
+            if tree != ROOT:
+                shutil.rmtree(tree)
+
+if __name__ == '__main__':
+    main()
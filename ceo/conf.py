@@ -51,6 +51,18 @@ Resultant Dictionary:
 
 """
 from curses.ascii import isspace
+import os, stat, marshal, tempfile
+from hashlib import sha1
+
+# bump when the cache layout or parser output changes
+CACHE_VERSION = 3
+
+# root-owned sticky directory holding one private cache directory per
+# user; CEO_CONF_CACHE_DIR overrides it outside of ceod
+CACHE_ROOT = '/var/cache/ceo/conf'
+
+# parsed files for this process: filename -> (stamps, options)
+memo = {}
 
 
 class ConfigurationException(Exception):
@@ -60,6 +72,11 @@ class ConfigurationException(Exception):
 def read(filename, included=None):
     """
     Function to read a configuration file into a dictionary.
+
+    Results are remembered for the life of the process, and reused for
+    as long as the file and the files it includes are unchanged. They
+    are also cached on disk in a directory private to the user (see
+    cache_dir), so that each op run by ceod need not parse them again.
     
     Parmaeters:
         filename - the file to read
@@ -69,8 +86,133 @@ def read(filename, included=None):
         IOError - when the configuration file cannot be read
     """
 
-    if not included:
+    if included is not None:
+        return parse(filename, included)
+
+    if filename in memo:
+        stamps, options = memo[filename]
+        if stamps == file_stamps([ path for path, stamp in stamps ]):
+            return dict(options)
+
+    cached = read_cache(filename)
+    if cached:
+        stamps, options = cached
+    else:
         included = []
+        options = parse(filename, included)
+        stamps = file_stamps(included)
+        write_cache(filename, stamps, options)
+
+    memo[filename] = (stamps, options)
+    return dict(options)
+
+
+def file_stamps(paths):
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamps.append((path, (st.st_dev, st.st_ino, st.st_size, st.st_mtime)))
+        except OSError:
+            stamps.append((path, None))
+    return stamps
+
+
+def private(st):
+    # owned by this user, and nobody else can read or write it
+    return st.st_uid == os.geteuid() and not st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+
+
+def cache_dir():
+    """
+    The directory for the disk cache, or None to cache only in this
+    process. It is a directory named for the uid inside CACHE_ROOT,
+    which must be owned by root and either writable only by root or
+    sticky. The user's directory is created if missing, and is only
+    used if it belongs to the user and nobody else can get into it,
+    since the cached options can hold passwords.
+    """
+
+    root = CACHE_ROOT
+    if 'CEO_USER' not in os.environ:
+        root = os.environ.get('CEO_CONF_CACHE_DIR', root)
+    try:
+        st = os.stat(root)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != 0:
+        return None
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not st.st_mode & stat.S_ISVTX:
+        return None
+
+    directory = os.path.join(root, str(os.geteuid()))
+    try:
+        os.mkdir(directory, 0700)
+    except OSError:
+        pass
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or not private(st):
+        return None
+    return directory
+
+
+def cache_path(directory, filename):
+    key = sha1(os.path.abspath(filename)).hexdigest()
+    return os.path.join(directory, 'conf-%s.marshal' % key)
+
+
+def read_cache(filename):
+    directory = cache_dir()
+    if not directory:
+        return None
+    path = cache_path(directory, filename)
+    try:
+        cachefile = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        if not private(os.fstat(cachefile.fileno())):
+            return None
+        version, cached_name, stamps, options = marshal.load(cachefile)
+    except (ValueError, EOFError, TypeError, OSError, IOError):
+        return None
+    finally:
+        cachefile.close()
+
+    if version != CACHE_VERSION or cached_name != filename:
+        return None
+    stamps = [ (stamp_path, stamp and tuple(stamp)) for stamp_path, stamp in stamps ]
+    if stamps != file_stamps([ stamp_path for stamp_path, stamp in stamps ]):
+        return None
+    return stamps, options
+
+
+def write_cache(filename, stamps, options):
+    # the cache is only an optimization; failing to write it is fine
+    directory = cache_dir()
+    if not directory:
+        return
+    try:
+        # mkstemp creates the file with mode 0600
+        fd, temp = tempfile.mkstemp(dir=directory, prefix='.conf-')
+        try:
+            cachefile = os.fdopen(fd, 'wb')
+            marshal.dump((CACHE_VERSION, filename, stamps, options), cachefile)
+            cachefile.close()
+            os.rename(temp, cache_path(directory, filename))
+        except:
+            os.unlink(temp)
+            raise
+    except (OSError, IOError, ValueError):
+        pass
+
+
+def parse(filename, included):
+    """Parses a configuration file, adding the files read to included."""
+
     if filename in included:
         return {}
     included.append(filename)
@@ -103,7 +245,7 @@ def read(filename, included=None):
         if line.find("include") == 0 and isspace(line[7]):
 
             filename = line[8:].strip()
-            options.update(read(filename, included))
+            options.update(parse(filename, included))
             continue
 
         # split 'key = value' into key and value and strip results
@@ -0,0 +1,16 @@
+from ceo import library
+
+class Library:
+  help = '''
+library migrate
+
+Brings the library database up to date: creates any missing indexes,
+and creates the catalogue search index and the triggers that keep it up
+to date, or rebuilds them if they exist. Run this once after upgrading
+ceo; it is safe to run again.
+'''
+  def main(self, args):
+    if args != [ 'migrate' ]:
+      print self.help
+      return
+    print library.migrate()
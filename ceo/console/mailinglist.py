@@ -0,0 +1,49 @@
+import sys
+from ceo import members, terms
+
+class MailingList:
+  help = '''
+mailinglist sync [--dry-run]
+
+Compares the members mailing list with the members registered for the
+current term, then subscribes the missing members and unsubscribes
+everyone else. With --dry-run, only the differences are displayed.
+'''
+  def main(self, args):
+    if len(args) not in (1, 2) or args[0] != 'sync' or args[1:] not in ([], ['--dry-run']):
+      print self.help
+      return
+    dry_run = args[1:] == ['--dry-run']
+
+    current = members.list_term(terms.current())
+    wanted = set(member['uid'][0] for member in current.values())
+    try:
+      roster = members.mailing_list_roster()
+    except members.MemberException, e:
+      print "Failed to read the mailing list: %s" % e
+      return
+
+    to_add = sorted(wanted - roster)
+    to_remove = sorted(roster - wanted)
+
+    for uid in to_add:
+      print '+%s' % uid
+    for uid in to_remove:
+      print '-%s' % uid
+    print '%d to subscribe, %d to unsubscribe' % (len(to_add), len(to_remove))
+
+    if dry_run or not (to_add or to_remove):
+      return
+
+    sys.stderr.write("If you want to apply these changes to the mailing list " \
+      "then type 'Yes, do this' and hit enter\n")
+    if raw_input() != 'Yes, do this':
+      return
+
+    try:
+      if to_add:
+        sys.stdout.write(members.subscribe_all_to_mailing_list(to_add))
+      if to_remove:
+        sys.stdout.write(members.unsubscribe_all_from_mailing_list(to_remove))
+    except members.MemberException, e:
+      print "Failed to update the mailing list: %s" % e
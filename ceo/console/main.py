@@ -1,38 +1,95 @@
-import sys, ldap, termios
-from ceo import members, terms, uwldap, ldapi
-
-from ceo.console.memberlist import MemberList
-from ceo.console.updateprograms import UpdatePrograms
-from ceo.console.expiredaccounts import ExpiredAccounts
-from ceo.console.inactive import Inactive
-from ceo.console.mysql import MySQL
+import sys
 
+# command name -> (module, class); modules are imported when used
 commands = {
-  'memberlist' : MemberList(),
-  'updateprograms' : UpdatePrograms(),
-  'expiredaccounts' : ExpiredAccounts(),
-  'inactive': Inactive(),
-  'mysql': MySQL(),
+  'memberlist' : ('ceo.console.memberlist', 'MemberList'),
+  'updateprograms' : ('ceo.console.updateprograms', 'UpdatePrograms'),
+  'expiredaccounts' : ('ceo.console.expiredaccounts', 'ExpiredAccounts'),
+  'inactive': ('ceo.console.inactive', 'Inactive'),
+  'mysql': ('ceo.console.mysql', 'MySQL'),
+  'mailinglist': ('ceo.console.mailinglist', 'MailingList'),
+  'quota': ('ceo.console.quota', 'Quota'),
+  'library': ('ceo.console.library', 'Library'),
 }
 help_opts = [ '--help', '-h' ]
-def start():
+
+# (label, source file) pairs whose wall time is reported by --profile
+profile_groups = [
+  ('ceo.ldapi', 'ceo/ldapi.py'),
+  ('python-ldap', 'ldap/ldapobject.py'),
+  ('remote ops', 'ceo/remote.py'),
+]
+
+def load_command(name):
+  module_name, class_name = commands[name]
+  module = __import__(module_name, fromlist=[ class_name ])
+  return getattr(module, class_name)()
+
+def start(auth_callback=None):
+  profile = None
+  if len(sys.argv) > 1 and sys.argv[1].split('=')[0] == '--profile':
+    profile = sys.argv.pop(1).partition('=')[2] or '-'
   args = sys.argv[1:]
-  if args[0] in help_opts:
+  if not args or args[0] in help_opts:
     help()
   elif args[0] in commands:
-    command = commands[args[0]]
+    command = load_command(args[0])
     if len(args) >= 2 and args[1] in help_opts:
       print command.help
+    elif profile:
+      run_profiled(profile, command, args[1:], auth_callback)
     else:
+      connect(auth_callback)
       command.main(args[1:])
   else:
     print "Invalid command '%s'" % args[0]
 
+def run_profiled(output, command, args, auth_callback):
+  import cProfile, pstats, time
+  profiler = cProfile.Profile()
+  start_time = time.time()
+  try:
+    profiler.runcall(connect, auth_callback)
+    profiler.runcall(command.main, args)
+  finally:
+    elapsed = time.time() - start_time
+    stats = pstats.Stats(profiler, stream=sys.stderr)
+    if output != '-':
+      stats.dump_stats(output)
+    print >>sys.stderr, ''
+    print >>sys.stderr, 'Total wall time: %.3fs' % elapsed
+    for label, path in profile_groups:
+      spent = group_time(stats, path)
+      print >>sys.stderr, '  in %-12s %8.3fs (%4.1f%%)' % (label, spent, 100 * spent / max(elapsed, 1e-9))
+    if output == '-':
+      stats.sort_stats('cumulative').print_stats(25)
+    else:
+      print >>sys.stderr, 'Profile written to %s' % output
+
+def group_time(stats, path):
+  """Time spent in functions from a file, counting nested calls once."""
+  def in_group(func):
+    return func[0].endswith(path) or func[0].endswith(path + 'c')
+  total = 0.0
+  for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+    if not in_group(func):
+      continue
+    for caller, caller_stats in callers.items():
+      if not in_group(caller):
+        total += caller_stats[3]
+  return total
+
+def connect(auth_callback):
+  from ceo import members
+  members.configure()
+  if auth_callback:
+    members.connect(auth_callback)
+
 def help():
   args = sys.argv[2:]
   if len(args) == 1:
     if args[0] in commands:
-      print commands[args[0]].help
+      print load_command(args[0]).help
     else:
       print 'Unknown command %s.' % args[0]
   else:
@@ -47,3 +104,5 @@ def help():
     print ''
     print 'Run \'ceo command --help\' for help on a specific command.'
     print ''
+    print 'Run \'ceo --profile[=file] command\' to profile a command.'
+    print ''
@@ -2,14 +2,18 @@ from ceo import members, terms, mysql
 
 class MySQL:
   help = '''
-mysql create <username>
+mysql create <username> [<username> ...]
 
-Creates a mysql database for a user.
+Creates a mysql database for a user. If several users are given, their
+databases are created together in a single request.
 '''
   def main(self, args):
-    if len(args) != 2 or args[0] != 'create':
+    if len(args) < 2 or args[0] != 'create':
         print self.help
         return
+    if len(args) > 2:
+        self.create_batch(args[1:])
+        return
     username = args[1]
     problem = None
     try:
@@ -36,3 +40,25 @@ Creates a mysql database for a user.
         print
         print "We failed to create the database. The error was:\n\n%s" % e
 
+  def create_batch(self, usernames):
+    try:
+        passwords, failures = mysql.create_mysql_batch(usernames)
+    except mysql.MySQLException, e:
+        print "Failed to create MySQL databases"
+        print
+        print "We failed to create the databases. The error was:\n\n%s" % e
+        return
+
+    for username in usernames:
+        if username not in passwords:
+            print "%s: failed" % username
+            continue
+        try:
+            mysql.write_mysql_info(username, passwords[username])
+            print "%s: created, settings written to ~%s/ceo-mysql-info" % (username, username)
+        except (KeyError, IOError, OSError), e:
+            print "%s: created, error writing the settings file: %s" % (username, e)
+
+    if failures:
+        print
+        print "The following errors occured:\n\n%s" % '\n'.join(failures)
@@ -0,0 +1,24 @@
+from ceo import members
+
+class Quota:
+  help = '''
+quota apply [<username> ...]
+
+Reapplies the prototype disk quotas to the given accounts, or to every
+member and club account if none are given. The accounts are updated by
+a single request to the file server.
+'''
+  def main(self, args):
+    if len(args) < 1 or args[0] != 'apply':
+      print self.help
+      return
+    try:
+      messages = members.apply_quota(args[1:])
+    except members.MemberException, e:
+      print "Failed to apply quotas: %s" % e
+      return
+    for status, message in messages:
+      if status:
+        print "Error: %s" % message
+      else:
+        print message
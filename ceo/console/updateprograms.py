@@ -15,7 +15,7 @@ Interactively updates the program field for an account by querying uwdir.
     fd = sys.stdin.fileno()
     for (dn, member) in mlist:
       uid = member['uid'][0]
-      user = uwl.search_s(uwldap.base(), ldap.SCOPE_SUBTREE,
+      user = ldapi.search_s(uwl, uwldap.base(), ldap.SCOPE_SUBTREE,
         '(uid=%s)' % ldapi.escape(uid))
       if len(user) == 0:
         continue
@@ -46,4 +46,4 @@ Interactively updates the program field for an account by querying uwdir.
       # TODO: don't use members.ld directly
       #if newprog != '':
       #  members.set_program(uid, newprog)
-      members.ld.modify_s(dn, mlist)
+      ldapi.modify_s(members.ld, dn, mlist)
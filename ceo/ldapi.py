@@ -4,9 +4,121 @@ LDAP Utilities
 This module makes use of python-ldap, a Python module with bindings
 to libldap, OpenLDAP's native C client library.
 """
-import ldap.modlist, os, pwd
+import ldap.modlist, os, pwd, re, time, json
 from subprocess import Popen, PIPE
 
+KINIT = '/usr/bin/kinit'
+
+# set to a file name to append a JSON line for every directory call
+TRACE_ENV = 'CEO_LDAP_TRACE'
+
+# (operation, filter shape) -> totals, see stats()
+call_stats = {}
+trace_file = None
+
+
+### Instrumentation ###
+
+def filter_shape(search_filter):
+    """
+    Reduces a search filter to its shape by replacing assertion values,
+    so that searches differing only in the user or term group together.
+    Object classes and presence tests are kept.
+    """
+
+    if search_filter is None:
+        return None
+
+    def replace(match):
+        attr, operator, value = match.groups()
+        if value == '*' or attr.lower() == 'objectclass':
+            return match.group(0)
+        return '(%s%s?)' % (attr, operator)
+    return re.sub(r'\(([^()=<>~]+)([<>~]?=)([^()]*)\)', replace, search_filter)
+
+
+def result_size(result):
+    """Returns (entries, bytes) for a search result."""
+
+    if type(result) is not list:
+        return 0, 0
+    size = 0
+    for dn, attrs in result:
+        size += len(dn)
+        for attr, values in attrs.iteritems():
+            size += len(attr) + sum(len(value) for value in values)
+    return len(result), size
+
+
+def record_call(op, target, search_filter, seconds, result, error):
+    entries, size = result_size(result)
+    shape = filter_shape(search_filter)
+
+    totals = call_stats.setdefault((op, shape),
+        { 'calls': 0, 'errors': 0, 'seconds': 0.0, 'entries': 0, 'bytes': 0 })
+    totals['calls'] += 1
+    totals['seconds'] += seconds
+    totals['entries'] += entries
+    totals['bytes'] += size
+    if error:
+        totals['errors'] += 1
+
+    global trace_file
+    if trace_file is None and os.environ.get(TRACE_ENV):
+        try:
+            trace_file = open(os.environ[TRACE_ENV], 'a')
+        except IOError:
+            trace_file = False
+    if trace_file:
+        trace_file.write(json.dumps({ 'time': time.time(), 'op': op, 'target': target,
+            'filter': shape, 'seconds': seconds, 'entries': entries, 'bytes': size,
+            'error': error }) + '\n')
+        trace_file.flush()
+
+
+def call(op, target, search_filter, method, *args):
+    """
+    Makes a directory call, recording its latency, the number and size
+    of entries returned and the shape of the filter. Every LDAP request
+    made by ceo should go through here.
+    """
+
+    start = time.time()
+    result, error = None, None
+    try:
+        result = method(*args)
+        return result
+    except ldap.LDAPError, e:
+        error = e.__class__.__name__
+        raise
+    finally:
+        record_call(op, target, search_filter, time.time() - start, result, error)
+
+
+def stats():
+    """
+    Returns the directory calls made so far, as a dictionary mapping
+    (operation, filter shape) to the number of calls and errors, the
+    total seconds, and the entries and bytes returned.
+    """
+
+    return dict((key, dict(value)) for key, value in call_stats.iteritems())
+
+
+def reset_stats():
+    call_stats.clear()
+
+
+def search_s(ld, base, scope, search_filter='(objectClass=*)', attrlist=None, attrsonly=0):
+    return call('search', base, search_filter, ld.search_s, base, scope, search_filter, attrlist, attrsonly)
+
+
+def modify_s(ld, dn, mlist):
+    return call('modify', dn, None, ld.modify_s, dn, mlist)
+
+
+### Directory Operations ###
+
 
 def connect_sasl(uri, mech, realm, password):
 
@@ -14,9 +126,15 @@ def connect_sasl(uri, mech, realm, password):
         # open the connection
         ld = ldap.initialize(uri)
         
-        # authenticate
+        # authenticate with the tickets already in the credential cache;
+        # if the server refuses them, they may only need renewing
         sasl = Sasl(mech, realm, password)
-        ld.sasl_interactive_bind_s('', sasl)
+        try:
+            call('bind', uri, None, ld.sasl_interactive_bind_s, '', sasl)
+        except ldap.LOCAL_ERROR:
+            if mech != 'GSSAPI' or password is not None or not renew_ccache():
+                raise
+            call('bind', uri, None, ld.sasl_interactive_bind_s, '', sasl)
 
     except ldap.LOCAL_ERROR, e:
         raise e
@@ -33,9 +151,9 @@ def abslookup(ld, dn, objectclass=None):
     try:
         if objectclass:
             search_filter = '(objectclass=%s)' % escape(objectclass)
-            matches = ld.search_s(dn, ldap.SCOPE_BASE, search_filter)
+            matches = search_s(ld, dn, ldap.SCOPE_BASE, search_filter)
         else:
-            matches = ld.search_s(dn, ldap.SCOPE_BASE)
+            matches = search_s(ld, dn, ldap.SCOPE_BASE)
     except ldap.NO_SUCH_OBJECT:
         return None
 
@@ -59,13 +177,13 @@ def search(ld, base, search_filter, params=[], scope=ldap.SCOPE_SUBTREE, attrlis
     real_filter = search_filter % tuple(escape(x) for x in params)
 
     # search for entries that match the filter
-    matches = ld.search_s(base, scope, real_filter, attrlist, attrsonly)
+    matches = search_s(ld, base, scope, real_filter, attrlist, attrsonly)
     return matches
 
 
 def modify(ld, rdntype, rdnval, base, mlist):
     dn = '%s=%s,%s' % (rdntype, escape(rdnval), base)
-    ld.modify_s(dn, mlist)
+    modify_s(ld, dn, mlist)
 
 
 def modify_attrs(ld, rdntype, rdnval, base, old, attrs):
@@ -75,7 +193,7 @@ def modify_attrs(ld, rdntype, rdnval, base, old, attrs):
     changes = ldap.modlist.modifyModlist(old, attrs)
 
     # apply changes
-    ld.modify_s(dn, changes)
+    modify_s(ld, dn, changes)
 
 
 def modify_diff(ld, rdntype, rdnval, base, old, new):
@@ -85,7 +203,7 @@ def modify_diff(ld, rdntype, rdnval, base, old, new):
     changes = make_modlist(old, new)
 
     # apply changes
-    ld.modify_s(dn, changes)
+    modify_s(ld, dn, changes)
 
 
 def escape(value):
@@ -130,6 +248,19 @@ def format_ldaperror(ex):
         return str(ex)
 
 
+def renew_ccache():
+    """
+    Renews the ticket-granting ticket in the credential cache, for when
+    a bind fails because it expired.
+
+    Returns: True if the ticket was renewed
+    """
+
+    renew = Popen([ KINIT, '-R' ], stdout=PIPE, stderr=PIPE)
+    renew.communicate()
+    return renew.returncode == 0
+
+
 class Sasl:
 
     def __init__(self, mech, realm, password):
@@ -138,11 +269,9 @@ class Sasl:
 
         if mech == 'GSSAPI' and password is not None:
             userid = pwd.getpwuid(os.getuid()).pw_name
-            kinit = '/usr/bin/kinit'
-            kinit_args = [ kinit, '%s@%s' % (userid, realm) ]
+            kinit_args = [ KINIT, '%s@%s' % (userid, realm) ]
             kinit = Popen(kinit_args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            kinit.stdin.write('%s\n' % password)
-            kinit.wait()
+            kinit.communicate('%s\n' % password)
 
     def callback(self, id, challenge, prompt, defresult):
         return ''
@@ -1,13 +1,24 @@
 from sqlobject import *
 from sqlobject.sqlbuilder import *
+from sqlobject import dbconnection
 from ceo import conf
 from ceo import members
-from ceo import terms
+import os
+import re
 import time
 from datetime import datetime, timedelta
 
 CONFIG_FILE = "/etc/csc/library.cf"
 
+# how long a book may be signed out for
+LOAN_PERIOD = timedelta(weeks=2)
+
+# ids per IN (...) clause when loading related rows in bulk
+BATCH_SIZE = 500
+
+# most books returned by a catalogue search
+SEARCH_LIMIT = 200
+
 cfg = {}
 
 def configure():
@@ -18,15 +29,49 @@ def configure():
     
     temp_cfg = conf.read(CONFIG_FILE)
     conf.check_string_fields(CONFIG_FILE, cfg_fields, temp_cfg)
+    if "library_connect_timeout" in temp_cfg:
+        conf.check_integer_fields(CONFIG_FILE, [ "library_connect_timeout" ], temp_cfg)
     cfg.update(temp_cfg)
-    
-    sqlhub.processConnection = connectionForURI(cfg["library_connect_string"])
+
+class LazyConnectionHub(dbconnection.ConnectionHub):
+    """
+    Connection hub that opens the library database the first
+    time a query needs it, rather than when ceo starts, and
+    then keeps the connection (and its pool) for the session.
+    """
+    def __init__(self):
+        dbconnection.ConnectionHub.__init__(self)
+        self.connection = None
+        self.ready = False
+
+    def getConnection(self):
+        # connections set up for a transaction take precedence
+        try:
+            return self.threadingLocal.connection
+        except AttributeError:
+            pass
+        if not self.ready:
+            # newer SQLObjects ask for the connection's style while
+            # the classes are defined, and handle AttributeError
+            raise AttributeError("library classes are not defined yet")
+        if self.connection is None:
+            if not cfg:
+                configure()
+            timeout = cfg.get("library_connect_timeout")
+            if timeout:
+                # honoured by libpq, which psycopg uses
+                os.environ["PGCONNECT_TIMEOUT"] = str(timeout)
+            self.connection = connectionForURI(cfg["library_connect_string"])
+        return self.connection
+
+hub = LazyConnectionHub()
 
 class Book(SQLObject):
     """
     A book.  This does all the stuff we could
     ever want to do with a book.
     """
+    _connection = hub
     isbn = StringCol()
     title = StringCol()
     year = StringCol()
@@ -39,7 +84,7 @@ class Book(SQLObject):
         Call this with a username to sign out
         a book.
         """
-        if members.registered(u, terms.current()):
+        if members.registered_current(u):
             s = Signout(username=u, book=self,
                         outdate=datetime.today(), indate=None)
 
@@ -62,26 +107,7 @@ class Book(SQLObject):
         Magic drugs to make books display
         nicely.
         """
-        book = "%s [%s]" % (self.title, self.year)
-        book += "\nBy: "
-        for a in self.authors:
-            book += a.name
-            book += ", "
-
-        if self.authors.count() < 1:
-            book += "(unknown)"
-
-        book = book.strip(", ")
-
-        signouts = self.signouts.filter(Signout.q.indate==None)
-        if signouts.count() > 0:
-            book += "\nSigned Out: "
-            for s in signouts:
-                book += s.username + " (" + str(s.due_date) + "), "
-
-        book = book.strip(", ")
-        
-        return book
+        return str(display_books([self])[0])
 
 
 class Author(SQLObject):
@@ -90,6 +116,7 @@ class Author(SQLObject):
     can have many authors.  This lets us map
     both ways.
     """
+    _connection = hub
     name = StringCol()
     books = RelatedJoin("Book")
 
@@ -100,11 +127,20 @@ class Signout(SQLObject):
     that a book has been signed out by a particular
     user.
     """
+    _connection = hub
     username = StringCol()
     book = ForeignKey("Book")
     outdate = DateCol()
     indate = DateCol()
 
+    # open signouts (indate is null), oldest first, for the
+    # overdue and signed out lists
+    open_index = DatabaseIndex("indate", "outdate")
+    # open signouts of some books, for sign_in and list views
+    book_index = DatabaseIndex("book", "indate")
+    # open signouts of a user
+    user_index = DatabaseIndex("username", "indate")
+
     def sign_in(self):
         """
         Terminate the signout (return the book).
@@ -116,7 +152,402 @@ class Signout(SQLObject):
         Compute the due date of the book based on the sign-out
         date.
         """
-        return self.outdate + timedelta(weeks=2)
+        return self.outdate + LOAN_PERIOD
+
+hub.ready = True
+
+class BookDisplay:
+    """
+    What the list views show for a book: its title, year,
+    author names and open signouts, loaded up front by
+    display_books() so that showing a list of books does
+    not query the database for each one.
+    """
+    def __init__(self, book, authors, signouts):
+        self.book = book
+        self.title = book.title
+        self.year = book.year
+        self.authors = authors
+        # (username, due date) pairs
+        self.signouts = signouts
+
+    def __str__(self):
+        book = "%s [%s]" % (self.title, self.year)
+        book += "\nBy: " + (", ".join(self.authors) or "(unknown)")
+        if self.signouts:
+            book += "\nSigned Out: " + ", ".join("%s (%s)" % (username, due)
+                                                 for username, due in self.signouts)
+        return book
+
+def _batches(ids):
+    for i in xrange(0, len(ids), BATCH_SIZE):
+        yield ids[i:i + BATCH_SIZE]
+
+def _unique(ids):
+    seen = set()
+    return [ i for i in ids if not (i in seen or seen.add(i)) ]
+
+def _author_names(book_ids):
+    """
+    Maps each book id to its author names, with one query
+    per batch on the book-author table.
+    """
+    join = [ j for j in Book.sqlmeta.joins if j.joinMethodName == "authors" ][0]
+    link = Table(join.intermediateTable)
+    book_id = getattr(link, join.joinColumn)
+    conn = hub.getConnection()
+
+    names = {}
+    for batch in _batches(book_ids):
+        query = Select([ book_id, Author.q.name ],
+                       where=AND(IN(book_id, batch),
+                                 getattr(link, join.otherColumn)==Author.q.id),
+                       orderBy=Author.q.id)
+        for book, name in conn.queryAll(conn.sqlrepr(query)):
+            names.setdefault(book, []).append(name)
+    return names
+
+def _open_signouts(book_ids):
+    """
+    Maps each book id to its open signouts, as (username,
+    due date) pairs, with one query per batch.
+    """
+    signouts = {}
+    for batch in _batches(book_ids):
+        for s in Signout.select(AND(IN(Signout.q.bookID, batch), Signout.q.indate==None),
+                                orderBy=Signout.q.id):
+            signouts.setdefault(s.bookID, []).append((s.username, s.due_date))
+    return signouts
+
+def display_books(books):
+    """
+    Loads the authors and open signouts of some books in
+    bulk.  Returns a BookDisplay for each book, in order.
+    """
+    books = list(books)
+    ids = _unique([ b.id for b in books ])
+    authors = _author_names(ids)
+    signouts = _open_signouts(ids)
+    return [ BookDisplay(b, authors.get(b.id, []), signouts.get(b.id, []))
+             for b in books ]
+
+def display_signouts(signouts):
+    """
+    Like display_books(), for the books of some signouts.
+    Returns a BookDisplay for each signout, in order.
+    """
+    signouts = list(signouts)
+    ids = _unique([ s.bookID for s in signouts ])
+    books = {}
+    for batch in _batches(ids):
+        for b in Book.select(IN(Book.q.id, batch)):
+            books[b.id] = b
+    displays = dict((d.book.id, d) for d in display_books([ books[i] for i in ids ]))
+    return [ displays[s.bookID] for s in signouts ]
+
+def overdue():
+    """
+    Signouts that have not been returned within the
+    loan period.
+    """
+    oldest = datetime.today() - LOAN_PERIOD
+    return Signout.select(AND(Signout.q.outdate<oldest, Signout.q.indate==None))
+
+class OverdueBook:
+    """
+    A line of the overdue report: a book's title and year,
+    and who has it, as (username, due date, copies) triples.
+    """
+    def __init__(self, book_id, title, year):
+        self.book_id = book_id
+        self.title = title
+        self.year = year
+        self.signouts = []
+
+    def __str__(self):
+        book = "%s [%s]" % (self.title, self.year)
+        book += "\nOverdue: " + ", ".join("%s (%s%s)" % (username, due,
+                                                        copies > 1 and ", %d copies" % copies or "")
+                                          for username, due, copies in self.signouts)
+        return book
+
+def _to_date(value):
+    # SQLite hands back dates from raw queries as strings
+    if isinstance(value, basestring):
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+def overdue_report():
+    """
+    The overdue books, with their titles and borrowers,
+    in a single query grouped by book and borrower.
+
+    Returns: a list of OverdueBook, longest overdue first
+    """
+    oldest = datetime.today() - LOAN_PERIOD
+    first_out = func.MIN(Signout.q.outdate)
+    query = Select([ Book.q.id, Book.q.title, Book.q.year, Signout.q.username,
+                     first_out, func.COUNT(Signout.q.id) ],
+                   where=AND(Signout.q.bookID==Book.q.id,
+                             Signout.q.indate==None, Signout.q.outdate<oldest),
+                   groupBy=[ Book.q.id, Book.q.title, Book.q.year, Signout.q.username ],
+                   orderBy=[ first_out, Book.q.id, Signout.q.username ])
+    conn = hub.getConnection()
+
+    books = {}
+    report = []
+    for book_id, title, year, username, outdate, copies in conn.queryAll(conn.sqlrepr(query)):
+        if book_id not in books:
+            books[book_id] = OverdueBook(book_id, title, year)
+            report.append(books[book_id])
+        books[book_id].signouts.append((username, _to_date(outdate) + LOAN_PERIOD, copies))
+    return report
+
+def outstanding(username=None):
+    """
+    Signouts that have not been returned, optionally
+    only those of one user.
+    """
+    if username:
+        return Signout.select(AND(Signout.q.username==username, Signout.q.indate==None))
+    return Signout.select(Signout.q.indate==None)
+
+def title_search(title):
+    """
+    Books whose title contains the given text.
+    """
+    return Book.select(LIKE(Book.q.title, "%" + title + "%"))
+
+def isbn_search(isbn):
+    """
+    Books with exactly the given ISBN.
+    """
+    return Book.select(Book.q.isbn==isbn)
+
+### Catalogue search ###
+
+# full-text index for SQLite, an FTS5 table with the book id as rowid
+SQLITE_SEARCH_TABLE = "book_search"
+
+# full-text index for PostgreSQL, a column on the book table
+POSTGRES_SEARCH_COLUMN = "search_vector"
+
+# the text indexed for each book, as (rowid, isbn, title, publisher, authors)
+SQLITE_SEARCH_ROWS = """SELECT b.id, b.isbn, b.title, b.publisher,
+    (SELECT group_concat(a.name, ' ') FROM %(author)s a
+       JOIN %(link)s l ON l.%(link_author)s = a.id WHERE l.%(link_book)s = b.id)
+  FROM %(book)s b"""
+
+SQLITE_SEARCH_REFRESH = """DELETE FROM %(search)s WHERE rowid IN (%(ids)s);
+    INSERT INTO %(search)s (rowid, isbn, title, publisher, authors)
+    """ + SQLITE_SEARCH_ROWS + """ WHERE b.id IN (%(ids)s);"""
+
+SQLITE_SEARCH_TRIGGERS = [
+    ("AFTER INSERT ON %(book)s", "NEW.id"),
+    ("AFTER UPDATE ON %(book)s", "OLD.id, NEW.id"),
+    ("AFTER DELETE ON %(book)s", "OLD.id"),
+    ("AFTER INSERT ON %(link)s", "NEW.%(link_book)s"),
+    ("AFTER DELETE ON %(link)s", "OLD.%(link_book)s"),
+    ("AFTER UPDATE OF name ON %(author)s",
+     "SELECT %(link_book)s FROM %(link)s WHERE %(link_author)s = NEW.id"),
+]
+
+POSTGRES_SEARCH_SCHEMA = [
+    """CREATE OR REPLACE FUNCTION %(search)s_refresh(ids integer[]) RETURNS void AS $$
+       UPDATE %(book)s b SET %(search)s =
+           setweight(to_tsvector('simple', coalesce(b.title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce((SELECT string_agg(a.name, ' ')
+               FROM %(author)s a JOIN %(link)s l ON l.%(link_author)s = a.id
+               WHERE l.%(link_book)s = b.id), '')), 'B') ||
+           setweight(to_tsvector('simple', coalesce(b.publisher, '') || ' ' ||
+               coalesce(b.isbn, '')), 'C')
+        WHERE b.id = ANY(ids)
+       $$ LANGUAGE sql""",
+    """CREATE OR REPLACE FUNCTION %(search)s_book() RETURNS trigger AS $$
+       BEGIN
+           PERFORM %(search)s_refresh(ARRAY[NEW.id]);
+           RETURN NULL;
+       END $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION %(search)s_link() RETURNS trigger AS $$
+       BEGIN
+           IF TG_OP = 'DELETE' THEN
+               PERFORM %(search)s_refresh(ARRAY[OLD.%(link_book)s]);
+           ELSE
+               PERFORM %(search)s_refresh(ARRAY[NEW.%(link_book)s]);
+           END IF;
+           RETURN NULL;
+       END $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION %(search)s_author() RETURNS trigger AS $$
+       BEGIN
+           PERFORM %(search)s_refresh(ARRAY(SELECT %(link_book)s FROM %(link)s
+                                            WHERE %(link_author)s = NEW.id));
+           RETURN NULL;
+       END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS %(search)s_book ON %(book)s",
+    """CREATE TRIGGER %(search)s_book AFTER INSERT OR UPDATE OF isbn, title, publisher
+       ON %(book)s FOR EACH ROW EXECUTE PROCEDURE %(search)s_book()""",
+    "DROP TRIGGER IF EXISTS %(search)s_link ON %(link)s",
+    """CREATE TRIGGER %(search)s_link AFTER INSERT OR DELETE
+       ON %(link)s FOR EACH ROW EXECUTE PROCEDURE %(search)s_link()""",
+    "DROP TRIGGER IF EXISTS %(search)s_author ON %(author)s",
+    """CREATE TRIGGER %(search)s_author AFTER UPDATE OF name
+       ON %(author)s FOR EACH ROW EXECUTE PROCEDURE %(search)s_author()""",
+    "DROP INDEX IF EXISTS %(search)s_idx",
+    "CREATE INDEX %(search)s_idx ON %(book)s USING gin(%(search)s)",
+    "SELECT %(search)s_refresh(ARRAY(SELECT id FROM %(book)s))",
+]
+
+# the kind of index search_books() uses, found on first use
+_search_kind = None
+
+def _schema_names(search):
+    join = [ j for j in Book.sqlmeta.joins if j.joinMethodName == "authors" ][0]
+    return {
+        "book": Book.sqlmeta.table,
+        "author": Author.sqlmeta.table,
+        "link": join.intermediateTable,
+        "link_book": join.joinColumn,
+        "link_author": join.otherColumn,
+        "search": search,
+    }
+
+def _find_search_kind(conn):
+    if conn.dbName == "sqlite":
+        if conn.queryOne("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s"
+                         % conn.sqlrepr(SQLITE_SEARCH_TABLE)):
+            return "fts5"
+    elif conn.dbName == "postgres":
+        if conn.queryOne("SELECT 1 FROM information_schema.columns "
+                         "WHERE table_name = %s AND column_name = %s"
+                         % (conn.sqlrepr(Book.sqlmeta.table), conn.sqlrepr(POSTGRES_SEARCH_COLUMN))):
+            return "tsvector"
+    return "like"
+
+def _index_exists(conn, name):
+    if conn.dbName == "sqlite":
+        query = "SELECT name FROM sqlite_master WHERE type = 'index' AND name = %s"
+    else:
+        query = "SELECT indexname FROM pg_indexes WHERE indexname = %s"
+    return conn.queryOne(query % conn.sqlrepr(name)) is not None
+
+def _migrate_indexes(conn, trans):
+    """
+    Creates the indexes declared on the tables that a
+    database made by an older ceo does not have yet.
+    """
+    done = []
+    if conn.dbName not in ("sqlite", "postgres"):
+        return [ "not checking the indexes of a %s database" % conn.dbName ]
+    for cls in Book, Author, Signout:
+        for index in cls.sqlmeta.indexes:
+            name = "%s_%s" % (cls.sqlmeta.table, index.name)
+            if not _index_exists(trans, name):
+                trans.query(conn.createIndexSQL(cls, index))
+                done.append("created index %s" % name)
+    return done
+
+def migrate():
+    """
+    Brings an existing library database up to date: creates
+    any missing indexes, and creates or rebuilds the catalogue
+    search index and the triggers that keep it up to date as
+    books and authors are added and changed.  Safe to run
+    more than once.
+
+    Returns: a description of what was done
+    """
+    global _search_kind
+    conn = hub.getConnection()
+    trans = conn.transaction()
+    try:
+        done = _migrate_indexes(conn, trans)
+        if conn.dbName == "sqlite":
+            names = _schema_names(SQLITE_SEARCH_TABLE)
+            trans.query("CREATE VIRTUAL TABLE IF NOT EXISTS %(search)s "
+                        "USING fts5(isbn, title, publisher, authors)" % names)
+            for i, (event, ids) in enumerate(SQLITE_SEARCH_TRIGGERS):
+                names["ids"] = ids % names
+                trans.query("DROP TRIGGER IF EXISTS %s_%d" % (SQLITE_SEARCH_TABLE, i))
+                trans.query(("CREATE TRIGGER %s_%d " % (SQLITE_SEARCH_TABLE, i)) + event % names +
+                            " BEGIN " + SQLITE_SEARCH_REFRESH % names + " END")
+            trans.query("DELETE FROM %(search)s" % names)
+            trans.query(("INSERT INTO %(search)s (rowid, isbn, title, publisher, authors) "
+                         + SQLITE_SEARCH_ROWS) % names)
+            done.append("built SQLite full-text index %s" % SQLITE_SEARCH_TABLE)
+        elif conn.dbName == "postgres":
+            names = _schema_names(POSTGRES_SEARCH_COLUMN)
+            if _find_search_kind(conn) != "tsvector":
+                trans.query("ALTER TABLE %(book)s ADD COLUMN %(search)s tsvector" % names)
+            for statement in POSTGRES_SEARCH_SCHEMA:
+                trans.query(statement % names)
+            done.append("built PostgreSQL full-text index on %(book)s.%(search)s" % names)
+        else:
+            done.append("no full-text index for %s; catalogue search will use LIKE" % conn.dbName)
+        trans.commit()
+    except:
+        trans.rollback()
+        raise
+    _search_kind = None
+    return "\n".join(done)
+
+def _search_terms(text):
+    return re.findall(r"[A-Za-z0-9]+", text)
+
+def _rank_ids(conn, kind, words, limit):
+    if kind == "fts5":
+        match = " ".join('"%s"*' % word for word in words)
+        # isbn, title, publisher and author matches, best first
+        query = ("SELECT rowid FROM %s WHERE %s MATCH %s "
+                 "ORDER BY bm25(%s, 1.0, 10.0, 2.0, 5.0) LIMIT %d"
+                 % (SQLITE_SEARCH_TABLE, SQLITE_SEARCH_TABLE, conn.sqlrepr(match),
+                    SQLITE_SEARCH_TABLE, limit))
+    else:
+        match = " & ".join("%s:*" % word for word in words)
+        query = ("SELECT id FROM %s, to_tsquery('simple', %s) query "
+                 "WHERE %s @@ query ORDER BY ts_rank(%s, query) DESC, id LIMIT %d"
+                 % (Book.sqlmeta.table, conn.sqlrepr(match), POSTGRES_SEARCH_COLUMN,
+                    POSTGRES_SEARCH_COLUMN, limit))
+    return [ row[0] for row in conn.queryAll(query) ]
+
+def _like_search(words, limit):
+    join = [ j for j in Book.sqlmeta.joins if j.joinMethodName == "authors" ][0]
+    link = Table(join.intermediateTable)
+    clauses = []
+    for word in words:
+        by_author = Select(getattr(link, join.joinColumn),
+                           where=AND(getattr(link, join.otherColumn)==Author.q.id,
+                                     CONTAINSSTRING(Author.q.name, word)))
+        clauses.append(OR(CONTAINSSTRING(Book.q.title, word),
+                          CONTAINSSTRING(Book.q.publisher, word),
+                          CONTAINSSTRING(Book.q.isbn, word),
+                          IN(Book.q.id, by_author)))
+    return list(Book.select(AND(*clauses), orderBy=Book.q.title).limit(limit))
+
+def search_books(text, limit=SEARCH_LIMIT):
+    """
+    Searches the catalogue for books matching every word of
+    the text in their title, authors, publisher or ISBN.
+    Words match as prefixes.  Uses the full-text index made
+    by migrate(), or LIKE when there is none.
+
+    Returns: a list of books, best match first
+    """
+    global _search_kind
+    words = _search_terms(text)
+    if not words:
+        return []
+
+    conn = hub.getConnection()
+    if _search_kind is None:
+        _search_kind = _find_search_kind(conn)
+    if _search_kind == "like":
+        return _like_search(words, limit)
+
+    ids = _rank_ids(conn, _search_kind, words, limit)
+    books = dict((b.id, b) for b in Book.select(IN(Book.q.id, ids))) if ids else {}
+    return [ books[i] for i in ids if i in books ]
 
 if __name__ == "__main__":
     print "This functionality isn't implemented yet."
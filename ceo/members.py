@@ -9,7 +9,7 @@ Transactions are used in each method that modifies the database.
 Future changes to the members database that need to be atomic
 must also be moved into this module.
 """
-import os, re, subprocess, ldap, socket
+import os, re, subprocess, ldap, socket, time
 from ceo import conf, ldapi, terms, remote, ceo_pb2
 from ceo.excep import InvalidArgument
 
@@ -217,6 +217,32 @@ def change_email(username, forward):
         raise MemberException(e)
 
 
+def apply_quota(usernames=()):
+    """
+    Reapplies the prototype disk quotas to accounts.
+
+    Parameters:
+        usernames - accounts to update; every member and club account
+                    is updated if none are given
+
+    Returns: a list of (status, message) pairs from the quota op
+    """
+
+    try:
+        request = ceo_pb2.ApplyQuota()
+        request.usernames.extend(usernames)
+
+        out = remote.run_remote('quota', request.SerializeToString())
+
+        response = ceo_pb2.ApplyQuotaResponse()
+        response.ParseFromString(out)
+
+        return [ (message.status, message.message) for message in response.messages ]
+    except remote.RemoteException, e:
+        raise MemberException(e)
+    except OSError, e:
+        raise MemberException(e)
+
 def get(userid):
     """
     Look up attributes of a member by userid.
@@ -339,7 +365,7 @@ def list_positions():
              ]
     """
 
-    members = ld.search_s(cfg['ldap_users_base'], ldap.SCOPE_SUBTREE, '(position=*)')
+    members = ldapi.search_s(ld, cfg['ldap_users_base'], ldap.SCOPE_SUBTREE, '(position=*)')
     positions = {}
     for (_, member) in members:
         for position in member['position']:
@@ -360,7 +386,7 @@ def set_position(position, members):
     Example: set_position('president', ['dtbartle'])
     """
 
-    res = ld.search_s(cfg['ldap_users_base'], ldap.SCOPE_SUBTREE,
+    res = ldapi.search_s(ld, cfg['ldap_users_base'], ldap.SCOPE_SUBTREE,
         '(&(objectClass=member)(position=%s))' % ldapi.escape(position))
     old = set([ member['uid'][0] for (_, member) in res ])
     new = set(members)
@@ -382,7 +408,7 @@ def set_position(position, members):
             elif action == 'add':
                 entry = (entry2, entry1)
             mlist = ldapi.make_modlist(entry[0], entry[1])
-            ld.modify_s(dn, mlist)
+            ldapi.modify_s(ld, dn, mlist)
 
 
 def change_group_member(action, group, userid):
@@ -398,7 +424,7 @@ def change_group_member(action, group, userid):
     else:
         raise InvalidArgument("action", action, "invalid action")
     mlist = ldapi.make_modlist(entry[0], entry[1])
-    ld.modify_s(group_dn, mlist)
+    ldapi.modify_s(ld, group_dn, mlist)
 
 
 
@@ -514,7 +540,10 @@ def register(userid, term_list):
             new_member['term'].append(term)
 
     mlist = ldapi.make_modlist(ldap_member, new_member)
-    ld.modify_s(user_dn, mlist)
+    ldapi.modify_s(ld, user_dn, mlist)
+
+    for term in term_list:
+        term_members_cache.pop(term, None)
 
 
 def register_nonmember(userid, term_list):
@@ -549,7 +578,7 @@ def register_nonmember(userid, term_list):
             new_member['nonMemberTerm'].append(term)
 
     mlist = ldapi.make_modlist(ldap_member, new_member)
-    ld.modify_s(user_dn, mlist)
+    ldapi.modify_s(ld, user_dn, mlist)
 
 
 def registered(userid, term):
@@ -573,6 +602,64 @@ def registered(userid, term):
         return False
 
 
+# seconds a term's list of members is reused before searching again
+TERM_MEMBERS_TTL = 10 * 60
+
+# term -> (time loaded, set of usernames)
+term_members_cache = {}
+
+def term_members(term):
+    """
+    Usernames of the members registered for a term.
+
+    The list comes from one search that asks only for uids,
+    and is reused for TERM_MEMBERS_TTL seconds.
+
+    Parameters:
+        term - the term to list
+
+    Returns: a set of usernames
+
+    Example: term_members("f2006") -> set(['mspang', 'ctdalek', ...])
+    """
+
+    now = time.time()
+    if term in term_members_cache:
+        loaded, uids = term_members_cache[term]
+        if now - loaded < TERM_MEMBERS_TTL:
+            return uids
+
+    members = ldapi.search(ld, cfg['ldap_users_base'],
+            '(&(objectClass=member)(term=%s))', [ term ], attrlist=[ 'uid' ])
+    uids = set(uid for dn, attrs in members for uid in attrs.get('uid', []))
+    term_members_cache[term] = (now, uids)
+    return uids
+
+
+def registered_current(userid):
+    """
+    Determines whether a member is registered for the
+    current term, using term_members().  A member missing
+    from the list is looked up directly, in case they
+    registered since it was loaded.
+
+    Parameters:
+        userid - the member's username
+
+    Returns: whether the member is registered
+
+    Example: registered_current("mspang") -> True
+    """
+
+    term = terms.current()
+    if userid in term_members(term):
+        return True
+    if registered(userid, term):
+        term_members_cache[term][1].add(userid)
+        return True
+    return False
+
+
 def group_members(group):
 
     """
@@ -596,9 +683,105 @@ def send_account_expired_email(name, email):
     args = [ cfg['expire_hook'], name, email ]
     os.spawnv(os.P_WAIT, cfg['expire_hook'], args)
 
-def subscribe_to_mailing_list(name):
+# maximum number of usernames sent to op-mailman in one request
+MAILMAN_BATCH_SIZE = 500
+
+# mailman results that mean the address is on the list, or needn't be
+MAILMAN_OK = ('Subscribed', 'Already a member', 'Disabled')
+
+# usernames waiting for flush_mailing_list_queue()
+mailing_list_queue = []
+
+def subscribe_to_mailing_list(name, defer=False):
+    """
+    Subscribes a member to the members mailing list.
+
+    Parameters:
+        name  - the member's username
+        defer - queue the subscription until flush_mailing_list_queue()
+                is called, so that many subscriptions share one request
+
+    Returns: the output of the mailman op
+    """
+
     member = get(name)
-    if member is not None:
-        return remote.run_remote('mailman', name)
-    else:
+    if member is None:
         return 'Error: member does not exist'
+
+    if defer:
+        if name not in mailing_list_queue:
+            mailing_list_queue.append(name)
+        return 'Queued: %s' % name
+
+    return remote.run_remote('mailman', name)
+
+def mailman_batches(requests):
+    """Sends op-mailman requests in batches of MAILMAN_BATCH_SIZE."""
+
+    output = []
+    try:
+        for i in xrange(0, len(requests), MAILMAN_BATCH_SIZE):
+            batch = requests[i:i+MAILMAN_BATCH_SIZE]
+            output.append(remote.run_remote('mailman', '\n'.join(batch) + '\n'))
+    except remote.RemoteException, e:
+        raise MemberException(e)
+    except OSError, e:
+        raise MemberException(e)
+    return ''.join(output)
+
+def subscribe_all_to_mailing_list(names):
+    """
+    Subscribes several members to the members mailing list, sending
+    them to the mailman op in batches of MAILMAN_BATCH_SIZE.
+
+    Returns: the combined output of the mailman op
+    """
+
+    return mailman_batches([ '+%s' % name for name in names ])
+
+def unsubscribe_all_from_mailing_list(names):
+    """
+    Unsubscribes several users from the members mailing list.
+
+    Returns: the combined output of the mailman op
+    """
+
+    return mailman_batches([ '-%s' % name for name in names ])
+
+def mailing_list_roster():
+    """
+    Lists the local users subscribed to the members mailing list. The
+    op returns the roster a page at a time, so that a long list never
+    exceeds the ceod message size limit.
+
+    Returns: a set of usernames
+    """
+
+    roster, start = set(), 0
+    try:
+        while start is not None:
+            out = remote.run_remote('mailman', '?%d\n' % start)
+            start = None
+            for line in out.splitlines():
+                if line.startswith('Member: '):
+                    roster.add(line[len('Member: '):])
+                elif line.startswith('More: '):
+                    start = int(line[len('More: '):])
+                elif line.strip():
+                    raise MemberException(line)
+    except remote.RemoteException, e:
+        raise MemberException(e)
+    except OSError, e:
+        raise MemberException(e)
+    return roster
+
+def flush_mailing_list_queue():
+    """
+    Sends all deferred mailing list subscriptions.
+
+    Returns: the combined output of the mailman op
+    """
+
+    names = mailing_list_queue[:]
+    del mailing_list_queue[:]
+    return subscribe_all_to_mailing_list(names)
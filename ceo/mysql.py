@@ -52,3 +52,20 @@ def create_mysql(username):
     except remote.RemoteException, e:
         raise MySQLException(e)
 
+
+def create_mysql_batch(usernames):
+    try:
+        request = ceo_pb2.AddMySQLUser()
+        request.usernames.extend(usernames)
+
+        out = remote.run_remote('mysql', request.SerializeToString())
+
+        response = ceo_pb2.AddMySQLUserResponse()
+        response.ParseFromString(out)
+
+        passwords = dict((user.username, user.password) for user in response.users)
+        failures = [ message.message for message in response.messages if message.status != 0 ]
+
+        return passwords, failures
+    except remote.RemoteException, e:
+        raise MySQLException(e)
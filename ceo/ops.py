@@ -1,11 +1,20 @@
 import os, syslog, grp
 
+def get_trace_id():
+    return os.environ.get('CEO_TRACE_ID')
+
+def log(priority, message):
+    trace_id = get_trace_id()
+    if trace_id:
+        message = '[%s] %s' % (trace_id, message)
+    syslog.syslog(priority, message)
+
 def response_message(response, status, message):
     if status:
         priority = syslog.LOG_ERR
     else:
         priority = syslog.LOG_INFO
-    syslog.syslog(priority, message)
+    log(priority, message)
     msg = response.messages.add()
     msg.status = status
     msg.message = message
@@ -7,19 +7,70 @@ import datetime
 import hashlib
 import base64
 import hmac
+import os
+import re
+import stat
+import marshal
+import tempfile
+import threading
 
 class PyMazonError(Exception):
     """Holds information about an error that occured during a pymazon request"""
-    def __init__(self, messages):
+    def __init__(self, messages, codes=()):
         self.__message = '\n'.join(messages)
+        self.__codes = list(codes)
 
     def __get_message(self):
         return self.__message
 
+    def __get_codes(self):
+        return self.__codes
+
     def __str__(self):
         return repr(self.__message)
 
     message = property(fget=__get_message)
+    codes = property(fget=__get_codes)
+
+
+def isbn13_check(digits):
+    """Check digit for the first twelve digits of an ISBN-13."""
+    total = sum(int(d) * (i % 2 and 3 or 1) for i, d in enumerate(digits[:12]))
+    return str(-total % 10)
+
+
+def isbn10_check(digits):
+    """Check digit for the first nine digits of an ISBN-10."""
+    total = sum(int(d) * (10 - i) for i, d in enumerate(digits[:9]))
+    return '0123456789X0'[-total % 11]
+
+
+def normalize_isbn(isbn):
+    """
+    Returns the ISBN-13 for an ISBN-10 or ISBN-13, ignoring
+    spaces and hyphens, or None if isbn is neither.
+    """
+    digits = re.sub(r'[\s-]', '', isbn).upper()
+    if re.match(r'^[0-9]{9}[0-9X]$', digits):
+        digits = '978' + digits[:9]
+        return digits + isbn13_check(digits)
+    if re.match(r'^[0-9]{13}$', digits):
+        return digits
+    return None
+
+
+def isbn_forms(isbn):
+    """
+    The ways an ISBN might have been written down: as given,
+    without spaces and hyphens, and as an ISBN-13 and ISBN-10.
+    """
+    forms = [ isbn, re.sub(r'[\s-]', '', isbn) ]
+    isbn13 = normalize_isbn(isbn)
+    if isbn13:
+        forms.append(isbn13)
+        if isbn13.startswith('978'):
+            forms.append(isbn13[3:12] + isbn10_check(isbn13[3:12]))
+    return [ form for i, form in enumerate(forms) if form not in forms[:i] ]
 
 
 class PyMazonBook:
@@ -72,14 +123,147 @@ class PyMazonBook:
     edition = property(fget=__get_edition)
 
 
+class PyMazonCache:
+    """
+    Remembers lookups on disk, one file per ISBN-13, so that a
+    book is only fetched from Amazon once.  Lookups that Amazon
+    answered with an error are remembered for less time.
+    """
+
+    # bump when the layout of the cache files changes
+    VERSION = 2
+
+    # errors that say the ISBN itself is bad, rather than the request
+    # (throttling, signatures, accounts), and so are worth remembering
+    ITEM_ERRORS = [ 'AWS.InvalidParameterValue', 'AWS.ECommerceService.ItemNotAccessible' ]
+
+    def __init__(self, directory, ttl=90 * 86400, error_ttl=86400):
+        self.__directory = directory
+        self.__ttl = ttl
+        self.__error_ttl = error_ttl
+
+    def __path(self, isbn13):
+        return os.path.join(self.__directory, '%s.marshal' % isbn13)
+
+    def get(self, isbn):
+        """
+        Returns the cached book for an ISBN, or None if there is
+        none.  Raises PyMazonError if the cached lookup failed.
+        """
+        isbn13 = normalize_isbn(isbn)
+        if not isbn13:
+            return None
+        try:
+            cachefile = open(self.__path(isbn13), 'rb')
+        except IOError:
+            return None
+        try:
+            # only trust files nobody else could have written
+            st = os.fstat(cachefile.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                return None
+            version, stored, book, errors = marshal.load(cachefile)
+        except (ValueError, EOFError, TypeError, OSError, IOError):
+            return None
+        finally:
+            cachefile.close()
+
+        age = time.time() - stored
+        if version != self.VERSION or age < 0:
+            return None
+        if errors is not None:
+            if age < self.__error_ttl:
+                raise PyMazonError(*errors)
+            return None
+        if age < self.__ttl:
+            return PyMazonBook(*book)
+        return None
+
+    def __store(self, isbn, book, errors):
+        isbn13 = normalize_isbn(isbn)
+        if not isbn13:
+            return
+        # the cache is only an optimization; failing to write it is fine
+        try:
+            if not os.path.isdir(self.__directory):
+                os.makedirs(self.__directory, 0700)
+            fd, temp = tempfile.mkstemp(dir=self.__directory, prefix='.pymazon-')
+            try:
+                cachefile = os.fdopen(fd, 'wb')
+                marshal.dump((self.VERSION, time.time(), book, errors), cachefile)
+                cachefile.close()
+                os.rename(temp, self.__path(isbn13))
+            except:
+                os.unlink(temp)
+                raise
+        except (OSError, IOError, ValueError):
+            pass
+
+    def put(self, isbn, book):
+        """Remembers the book found for an ISBN."""
+        self.__store(isbn, (book.title, book.authors, book.publisher, book.year,
+                            book.isbn10, book.isbn13, book.edition), None)
+
+    def put_error(self, isbn, error):
+        """
+        Remembers that looking up an ISBN failed with a PyMazonError,
+        if Amazon said that the ISBN is invalid or unknown.  Other
+        errors are not cached.
+        """
+        if not error.codes or [ code for code in error.codes if code not in self.ITEM_ERRORS ]:
+            return
+        self.__store(isbn, None, (error.message.split('\n'), error.codes))
+
+
+class TokenBucket:
+    """
+    Paces requests to rate per second on average, allowing
+    bursts of up to burst requests.  Safe to share between
+    threads.
+    """
+    def __init__(self, rate, burst=1):
+        self.__rate = float(rate)
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__updated = time.time()
+        self.__lock = threading.Lock()
+
+    def take(self):
+        """Waits until a request may be sent, and spends a token on it."""
+        self.__lock.acquire()
+        try:
+            now = time.time()
+            self.__tokens = min(self.__burst,
+                                self.__tokens + (now - self.__updated) * self.__rate)
+            self.__updated = now
+            # tokens may go negative: each caller reserves its slot,
+            # then sleeps until it comes round, without the lock
+            self.__tokens -= 1
+            wait = -self.__tokens / self.__rate
+        finally:
+            self.__lock.release()
+        if wait > 0:
+            time.sleep(wait)
+
+
 class PyMazon:
     """A method of looking up book information on Amazon."""
-    def __init__(self, accesskey, secretkey):
+
+    # Amazon's endpoint, and its limits: ItemIds per ItemLookup,
+    # and requests per second
+    HOST = 'ecs.amazonaws.com'
+    MAX_BATCH = 10
+    RATE = 1.0
+
+    def __init__(self, accesskey, secretkey, cache=None, host=HOST, rate=RATE, threads=4):
         self.__key = accesskey
         self.__secret = secretkey
-        self.__last_query_time = 0
+        self.__cache = cache
+        self.__host = host
+        self.__limiter = TokenBucket(rate)
+        self.__threads = threads
 
-    def __form_request(self, isbn):
+    def __form_request(self, isbns):
         content = {}
         dstamp = datetime.datetime.utcfromtimestamp(time.time())
         content['Timestamp'] = dstamp.strftime('%Y-%m-%dT%H:%M:%S.000Z')
@@ -89,7 +273,7 @@ class PyMazon:
         content['ResponseGroup'] = 'ItemAttributes'
         content['IdType'] = 'ISBN'
         content['SearchIndex'] = 'Books'
-        content['ItemId'] = isbn
+        content['ItemId'] = ','.join(isbns)
         content['AWSAccessKeyId'] = self.__key
 
         URI_String = []
@@ -98,13 +282,13 @@ class PyMazon:
             URI_String.append('%s=%s' % (key, urllib.quote(value)))
 
         req = '&'.join(URI_String)
-        to_sign_req = 'GET\necs.amazonaws.com\n/onca/xml\n' + req
+        to_sign_req = 'GET\n' + self.__host + '\n/onca/xml\n' + req
 
         h = hmac.new(self.__secret, to_sign_req, hashlib.sha256)
         sig = base64.b64encode(h.digest())
         req += '&Signature=%s' % urllib.quote(sig)
 
-        return 'http://ecs.amazonaws.com/onca/xml?' + req
+        return 'http://' + self.__host + '/onca/xml?' + req
 
     def __elements_text(self, element, name):
         result = []
@@ -119,9 +303,12 @@ class PyMazon:
         return result
 
     def __format_errors(self, errors):
+        """Returns (code, message) for each Error in some Errors elements."""
         error_list = []
-        for error in errors:
-            error_list.extend(self.__elements_text(error, 'Message'))
+        for errors_element in errors:
+            for error in errors_element.getElementsByTagName('Error'):
+                error_list.append((self.__extract_single(error, 'Code'),
+                                   self.__extract_single(error, 'Message')))
         return error_list
 
     def __extract_single(self, element, name):
@@ -130,26 +317,282 @@ class PyMazon:
             return ''
         return matches[0]
 
-    def lookup(self, isbn):
-        file = urllib.urlretrieve(self.__form_request(isbn))[0]
-        xmldoc = minidom.parse(file)
-
-        cur_time = time.time()
-        while cur_time - self.__last_query_time < 1.0:
-            sleep(cur_time - self.__last_query_time)
-            cur_time = time.time()
-        self.__last_query_time = cur_time
-
-        errors = xmldoc.getElementsByTagName('Errors')
-        if len(errors) != 0:
-            raise PyMazonError, self.__format_errors(errors)
-
-        title = self.__extract_single(xmldoc, 'Title')
-        authors = self.__elements_text(xmldoc, 'Author')
-        publisher = self.__extract_single(xmldoc, 'Publisher')
-        year = self.__extract_single(xmldoc, 'PublicationDate')[0:4]
-        isbn10 = self.__extract_single(xmldoc, 'ISBN')
-        isbn13 = self.__extract_single(xmldoc, 'EAN')
-        edition = self.__extract_single(xmldoc, 'Edition')
-        
+    def __make_book(self, item):
+        title = self.__extract_single(item, 'Title')
+        authors = self.__elements_text(item, 'Author')
+        publisher = self.__extract_single(item, 'Publisher')
+        year = self.__extract_single(item, 'PublicationDate')[0:4]
+        isbn10 = self.__extract_single(item, 'ISBN')
+        isbn13 = self.__extract_single(item, 'EAN')
+        edition = self.__extract_single(item, 'Edition')
+
         return PyMazonBook(title, authors, publisher, year, isbn10, isbn13, edition)
+
+    def __fetch(self, isbns):
+        """
+        Sends one ItemLookup for up to MAX_BATCH isbns.  Returns
+        a dictionary from each isbn to its book, or to the
+        PyMazonError for it if Amazon did not return one, and
+        the set of isbns whose errors Amazon gave for that ItemId
+        (rather than for the whole request).
+        """
+        self.__limiter.take()
+        response = urllib.urlopen(self.__form_request(isbns))
+        try:
+            xmldoc = minidom.parseString(response.read())
+        finally:
+            response.close()
+
+        items = xmldoc.getElementsByTagName('Item')
+        books = {}
+        for item in items:
+            book = self.__make_book(item)
+            for number in book.isbn10, book.isbn13:
+                if normalize_isbn(number):
+                    books[normalize_isbn(number)] = book
+        errors = self.__format_errors(xmldoc.getElementsByTagName('Errors'))
+
+        results = {}
+        item_errors = set()
+        for isbn in isbns:
+            key = normalize_isbn(isbn) or isbn
+            if key in books:
+                results[isbn] = books[key]
+            elif len(isbns) == 1 and len(items) == 1 and not errors:
+                results[isbn] = self.__make_book(items[0])
+            else:
+                # Amazon names the bad ItemId in its messages; any
+                # other error (throttling, signature) is the request's
+                mine = [ error for error in errors if isbn in error[1] ]
+                if mine:
+                    item_errors.add(isbn)
+                else:
+                    mine = errors
+                if mine:
+                    results[isbn] = PyMazonError([ message for code, message in mine ],
+                                                 [ code for code, message in mine ])
+                else:
+                    results[isbn] = PyMazonError([ 'No item found for %s' % isbn ])
+        return results, item_errors
+
+    def lookup(self, isbn):
+        """
+        Looks up a book by ISBN-10 or ISBN-13, from the cache
+        if one was given and it has the book (or the error).
+        """
+        result = self.lookup_many([ isbn ])[isbn]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def lookup_many(self, isbns):
+        """
+        Looks up many books, MAX_BATCH to a request, sending
+        requests from several threads as fast as the rate limit
+        allows.
+
+        Returns: a dictionary from each isbn to its PyMazonBook,
+                 or to the exception looking it up raised
+                 (PyMazonError, or IOError if Amazon could not
+                 be reached).  Only errors Amazon gave for the
+                 isbn itself are cached.
+        """
+        results = {}
+        wanted = []
+        for isbn in isbns:
+            if isbn in results or isbn in wanted:
+                continue
+            if self.__cache is not None:
+                try:
+                    book = self.__cache.get(isbn)
+                except PyMazonError, e:
+                    book = e
+                if book is not None:
+                    results[isbn] = book
+                    continue
+            wanted.append(isbn)
+
+        batches = [ wanted[i:i + self.MAX_BATCH]
+                    for i in xrange(0, len(wanted), self.MAX_BATCH) ]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                lock.acquire()
+                try:
+                    if not batches:
+                        return
+                    batch = batches.pop(0)
+                finally:
+                    lock.release()
+
+                try:
+                    fetched, item_errors = self.__fetch([ normalize_isbn(isbn) or isbn
+                                                          for isbn in batch ])
+                    fetched = dict((isbn, fetched[normalize_isbn(isbn) or isbn])
+                                   for isbn in batch)
+
+                    for isbn, result in fetched.items():
+                        if self.__cache is not None:
+                            if isinstance(result, PyMazonBook):
+                                self.__cache.put(isbn, result)
+                            elif (normalize_isbn(isbn) or isbn) in item_errors:
+                                self.__cache.put_error(isbn, result)
+                except Exception, e:
+                    # IOError, a malformed response, or a bug; either
+                    # way the isbns get an answer, and nothing is cached
+                    fetched = dict((isbn, e) for isbn in batch)
+
+                lock.acquire()
+                try:
+                    results.update(fetched)
+                finally:
+                    lock.release()
+
+        if len(batches) <= 1:
+            worker()
+        else:
+            threads = [ threading.Thread(target=worker)
+                        for i in xrange(min(self.__threads, len(batches))) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return results
+
+
+### Tests ###
+
+if __name__ == '__main__':
+
+    import BaseHTTPServer, SocketServer, cgi, shutil, urlparse
+    from ceo.test import test, assert_equal, success, fail
+
+    # a stand-in for Amazon that knows the books in CATALOGUE,
+    # and records the ItemIds of each request it serves
+    CATALOGUE = dict(('978%09d' % i + isbn13_check('978%09d' % i),
+                      'Book %d' % i) for i in xrange(30))
+    requests = []
+    # set to 'throttle' or 'garbage' to make the stand-in misbehave
+    mode = [ None ]
+
+    ITEM = '''<Item><ItemAttributes><Author>A. Author</Author><EAN>%s</EAN>
+    <Edition>1</Edition><ISBN>%s</ISBN><PublicationDate>1999-01-01</PublicationDate>
+    <Publisher>Publisher</Publisher><Title>%s</Title></ItemAttributes></Item>'''
+    ERROR = '''<Error><Code>AWS.InvalidParameterValue</Code>
+    <Message>%s is not a valid value for ItemId.</Message></Error>'''
+
+    class StandIn(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = cgi.parse_qs(urlparse.urlparse(self.path)[4])
+            isbns = query['ItemId'][0].split(',')
+            requests.append(isbns)
+            if mode[0] == 'throttle':
+                body = ('<ItemLookupResponse><Errors><Error><Code>RequestThrottled</Code>'
+                        '<Message>Request is throttled.</Message></Error></Errors>'
+                        '</ItemLookupResponse>')
+            elif mode[0] == 'garbage':
+                body = '<ItemLookupResponse'
+            else:
+                items = [ ITEM % (isbn, isbn[3:12] + isbn10_check(isbn[3:12]), CATALOGUE[isbn])
+                          for isbn in isbns if isbn in CATALOGUE ]
+                errors = [ ERROR % isbn for isbn in isbns if isbn not in CATALOGUE ]
+                body = '<ItemLookupResponse><Items>'
+                if errors:
+                    body += '<Request><Errors>%s</Errors></Request>' % ''.join(errors)
+                body += '%s</Items></ItemLookupResponse>' % ''.join(items)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever).start()
+    host = '127.0.0.1:%d' % server.server_address[1]
+    cache_dir = tempfile.mkdtemp(prefix='pymazon-')
+    isbns = sorted(CATALOGUE)
+
+    try:
+        test(normalize_isbn)
+        assert_equal('9780201896831', normalize_isbn('0-201-89683-4'))
+        assert_equal('9780201896831', normalize_isbn('978 0201896831'))
+        assert_equal(None, normalize_isbn('020189683'))
+        success()
+
+        test(isbn_forms)
+        assert_equal([ '0-201-89683-4', '0201896834', '9780201896831' ],
+                     isbn_forms('0-201-89683-4'))
+        success()
+
+        test(TokenBucket)
+        bucket = TokenBucket(20)
+        start = time.time()
+        for i in xrange(5):
+            bucket.take()
+        assert_equal(True, 0.19 < time.time() - start < 0.5)
+        success()
+
+        test(PyMazon.lookup)
+        pymazon = PyMazon('key', 'secret', host=host, rate=100)
+        book = pymazon.lookup(isbns[0][3:12] + isbn10_check(isbns[0][3:12]))
+        assert_equal(('Book 0', [ 'A. Author' ], '1999', isbns[0]),
+                     (book.title, book.authors, book.year, book.isbn13))
+        try:
+            pymazon.lookup('9781111111111')
+            fail('no PyMazonError for an unknown ISBN')
+        except PyMazonError, e:
+            assert_equal('9781111111111 is not a valid value for ItemId.', e.message)
+        success()
+
+        test(PyMazon.lookup_many)
+        del requests[:]
+        pymazon = PyMazon('key', 'secret', host=host, rate=10)
+        start = time.time()
+        results = pymazon.lookup_many(isbns[:23] + [ '9781111111111', isbns[0] ])
+        elapsed = time.time() - start
+        assert_equal(3, len(requests))
+        assert_equal([ 10, 10, 4 ], sorted(map(len, requests), reverse=True))
+        assert_equal([ 'Book %d' % i for i in xrange(23) ],
+                     [ results[isbn].title for isbn in isbns[:23] ])
+        assert_equal(True, isinstance(results['9781111111111'], PyMazonError))
+        # the first request goes at once, the next two 0.1s apart
+        assert_equal(True, elapsed >= 0.19)
+        success()
+
+        test(PyMazonCache)
+        del requests[:]
+        pymazon = PyMazon('key', 'secret', PyMazonCache(cache_dir), host=host, rate=100)
+        # neither request-level errors nor broken responses are cached
+        mode[0] = 'throttle'
+        results = pymazon.lookup_many(isbns[:12])
+        assert_equal([ 'RequestThrottled' ], results[isbns[0]].codes)
+        mode[0] = 'garbage'
+        try:
+            pymazon.lookup(isbns[0])
+            fail('no error for a malformed response')
+        except PyMazonError:
+            fail('a malformed response was reported as a PyMazonError')
+        except Exception:
+            pass
+        mode[0] = None
+        del requests[:]
+        pymazon.lookup_many(isbns + [ '9781111111111' ])
+        assert_equal(4, len(requests))
+        results = pymazon.lookup_many(isbns + [ '9781111111111' ])
+        assert_equal(4, len(requests))
+        assert_equal('Book 29', results[isbns[29]].title)
+        assert_equal(True, isinstance(results['9781111111111'], PyMazonError))
+        cache = PyMazonCache(cache_dir)
+        cache.put_error(isbns[0], PyMazonError([ 'Request throttled' ], [ 'RequestThrottled' ]))
+        assert_equal('Book 0', cache.get(isbns[0]).title)
+        success()
+    finally:
+        server.shutdown()
+        shutil.rmtree(cache_dir)
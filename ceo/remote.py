@@ -1,18 +1,72 @@
 import os
 import subprocess
+import time
+import uuid
+
+# (trace id, op, seconds) for the most recent remote calls
+timings = []
+MAX_TIMINGS = 100
 
 class RemoteException(Exception):
     """Exception class for bad argument values."""
-    def __init__(self, status, stdout, stderr):
+    def __init__(self, status, stdout, stderr, trace_id=None):
         self.status, self.stdout, self.stderr = status, stdout, stderr
+        self.trace_id = trace_id
     def __str__(self):
+        if self.trace_id:
+            return 'Error executing ceoc (%d, trace %s)\n\n%s' % (self.status, self.trace_id, self.stderr)
         return 'Error executing ceoc (%d)\n\n%s' % (self.status, self.stderr)
 
-def run_remote(op, data):
-    ceoc = '%s/ceoc' % os.environ.get('CEO_LIB_DIR', '/usr/lib/ceod')
-    addmember = subprocess.Popen([ceoc, op], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = addmember.communicate(data)
-    status = addmember.wait()
+def new_trace_id():
+    """Returns a fresh id for correlating a request with ceod logs."""
+    return uuid.uuid4().hex[:16]
+
+def ceoc_path():
+    return '%s/ceoc' % os.environ.get('CEO_LIB_DIR', '/usr/lib/ceod')
+
+def record_timing(trace_id, op, seconds):
+    timings.append((trace_id, op, seconds))
+    del timings[:-MAX_TIMINGS]
+
+def run_ceoc(args, data, trace_id=None):
+    env = os.environ.copy()
+    if trace_id:
+        env['CEO_TRACE_ID'] = trace_id
+    ceoc = subprocess.Popen([ceoc_path()] + args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, err = ceoc.communicate(data)
+    status = ceoc.wait()
     if status:
-        raise RemoteException(status, out, err)
+        raise RemoteException(status, out, err, trace_id)
     return out
+
+def run_remote(op, data, trace_id=None):
+    """
+    Runs an op through ceoc. The trace id (a new one by default) is sent
+    to ceod and appears in its log lines and those of the op.
+    """
+
+    trace_id = trace_id or new_trace_id()
+    start = time.time()
+    try:
+        return run_ceoc([op], data, trace_id)
+    finally:
+        record_timing(trace_id, op, time.time() - start)
+
+def get_stats(host):
+    """
+    Fetches the latency histograms kept by ceod on a host.
+
+    Returns: a dictionary mapping (op, phase) to a dictionary with the
+             keys count, p50, p95 and max; times are in microseconds
+    """
+
+    out = run_ceoc(['--stats', host], '')
+    stats = {}
+    for line in out.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) != 6:
+            continue
+        op, phase = fields[:2]
+        count, p50, p95, maximum = map(int, fields[2:])
+        stats[(op, phase)] = { 'count': count, 'p50': p50, 'p95': p95, 'max': maximum }
+    return stats
@@ -7,9 +7,10 @@ from sqlobject.sqlbuilder import *
 from datetime import datetime, timedelta
 from ceo.pymazon import PyMazon
 from ceo.pymazon import PyMazonError
+from ceo.pymazon import PyMazonCache
+from ceo.pymazon import isbn_forms
 from ceo import conf
 
-from ceo import terms
 
 import ceo.library as lib
 
@@ -59,13 +60,10 @@ def overdue_books(data):
     """
     Display a list of all books that are overdue.
     """
-    oldest = datetime.today() - timedelta(weeks=2)
-    overdue = lib.Signout.select(AND(lib.Signout.q.outdate<oldest, lib.Signout.q.indate==None))
-
     widgets = []
 
-    for s in overdue:
-        widgets.append(urwid.AttrWrap(ButtonText(None, s.book, str(s.book)),
+    for d in lib.overdue_report():
+        widgets.append(urwid.AttrWrap(ButtonText(None, d.book_id, str(d)),
                                       None, 'selected'))
         widgets.append(urwid.Divider())
         
@@ -77,12 +75,10 @@ def outbooks_search(data):
     """
     Display a list of all books that are signed out.
     """
-    overdue = lib.Signout.select(lib.Signout.q.indate==None)
-
     widgets = []
 
-    for s in overdue:
-        widgets.append(urwid.AttrWrap(ButtonText(None, s.book, str(s.book)),
+    for d in lib.display_signouts(lib.outstanding()):
+        widgets.append(urwid.AttrWrap(ButtonText(None, d.book, str(d)),
                                       None, 'selected'))
         widgets.append(urwid.Divider())
         
@@ -126,17 +122,23 @@ class BookAddPage(WizardPanel):
         configure()
         isbn = self.isbn.get_edit_text()
 
+        # the catalogue may have it under another form of the isbn
+        currents = lib.Book.select(IN(lib.Book.q.isbn, isbn_forms(isbn)))
+        if currents.count() != 0:
+            set_status("Book already exists, fucker.")
+            return False
+
         try:
-            pymazon = PyMazon(cfg["aws_account_key"], cfg["aws_secret_key"])
+            # only cache lookups where the administrator asked for it
+            cache = None
+            if cfg.get("isbn_cache_dir"):
+                cache = PyMazonCache(cfg["isbn_cache_dir"])
+            pymazon = PyMazon(cfg["aws_account_key"], cfg["aws_secret_key"], cache)
             book = pymazon.lookup(isbn)
 
-            currents = lib.Book.select(lib.Book.q.isbn==isbn)
-            if currents.count() == 0:
-                lib.Book(isbn=isbn, title=book.title,
-                         year=book.year, publisher=book.publisher)
-                pop_window()
-            else:
-                set_status("Book already exists, fucker.")
+            lib.Book(isbn=isbn, title=book.title,
+                     year=book.year, publisher=book.publisher)
+            pop_window()
         except PyMazonError, e:
             set_status("Amazon thinks this is not a book.  Take it up with them.")
         return False
@@ -153,7 +155,7 @@ class BookSearchPage(WizardPanel):
         self.search = None
         self.state["book"] = None
         self.isbn = SingleEdit("ISBN: ")
-        self.title = SingleEdit("Title: ")
+        self.title = SingleEdit("Title/author: ")
 
         self.widgets = [
             urwid.Text("Book Search"),
@@ -200,7 +202,7 @@ class CheckoutPage(WizardPanel):
 
     def check(self):
         self.state['user'] = self.user.get_edit_text()
-        if not members.registered(self.state['user'], terms.current()):
+        if not members.registered_current(self.state['user']):
             set_status("User not registered for this term!")
             return True
         return False
@@ -264,32 +266,25 @@ class SearchPage(urwid.WidgetWrap):
         This does the actual search, and sets up the screen
         when it's done.
 
-        title -> search by (partial) title
+        title -> search the catalogue (title, authors, publisher, isbn)
         isbn -> search by (partial) isbn
         user -> search by username (for checked-out books)
         """
         self.state = state
-        books = []
         widgets = []
         if not title is None and not title=="":
-            books = lib.Book.select(LIKE(lib.Book.q.title, "%" + title + "%"))
+            books = lib.display_books(lib.search_books(title))
         elif not isbn is None and not isbn=="":
-            books = lib.Book.select(lib.Book.q.isbn==isbn)
-        elif (not (user is None)) and (not (user=="")):
-            st = lib.Signout.select(AND(lib.Signout.q.username==user, lib.Signout.q.indate==None))
-            for s in st:
-                books.append(s.book)
+            books = lib.display_books(lib.isbn_search(isbn))
         else:
-            st = lib.Signout.select(lib.Signout.q.indate==None)
-            for s in st:
-                books.append(s.book)
+            books = lib.display_signouts(lib.outstanding(user))
 
-        if ((type(books) != type([])) and books.count() == 0) or books == []:
+        if not books:
             widgets.append(urwid.Text("No results. Hit ESC to return to search page."))
             widgets.append(urwid.Divider())
 
-        for b in books:
-            widgets.append(urwid.AttrWrap(ButtonText(self.select, b, str(b)),
+        for d in books:
+            widgets.append(urwid.AttrWrap(ButtonText(self.select, d.book, str(d)),
                                           None, 'selected'))
             widgets.append(urwid.Divider())
 
@@ -1,8 +1,10 @@
 import os, grp, pwd, sys, random, urwid.curses_display
+from ceo import members
 from ceo.urwid.widgets import *
 from ceo.urwid.window import *
-from ceo.urwid import newmember, renew, info, search, positions, groups, \
-    shell, library, databases
+
+# the wizard modules are imported when their menu item is chosen, so that
+# ceo starts without loading the library database or amazon lookup code
 
 def program_name():
     cwords = [ "CSC" ] * 20 + [ "Club" ] * 10 + [ "Campus" ] * 5 + \
@@ -31,6 +33,7 @@ def program_name():
     return "%s %s %s" % (cword, eword, oword)
 
 def new_member(*args, **kwargs):
+    from ceo.urwid import newmember
     push_wizard("New Member", [
         newmember.IntroPage,
         newmember.InfoPage,
@@ -41,6 +44,7 @@ def new_member(*args, **kwargs):
     ], (60, 15))
 
 def new_club(*args, **kwargs):
+    from ceo.urwid import newmember
     push_wizard("New Club Account", [
         newmember.ClubIntroPage,
         newmember.ClubInfoPage,
@@ -48,6 +52,7 @@ def new_club(*args, **kwargs):
     ], (60, 15))
 
 def new_club_user(*args, **kwargs):
+    from ceo.urwid import newmember
     push_wizard("New Club Rep Account", [
         newmember.ClubUserIntroPage,
         newmember.InfoPage,
@@ -58,12 +63,14 @@ def new_club_user(*args, **kwargs):
     ], (60, 15))
 
 def manage_group(*args, **kwargs):
+    from ceo.urwid import groups
     push_wizard("Manage Club or Group Members", [
         groups.IntroPage,
         groups.InfoPage,
     ], (60, 15))
 
 def renew_member(*args, **kwargs):
+    from ceo.urwid import renew
     push_wizard("Renew Membership", [
         renew.IntroPage,
         renew.UserPage,
@@ -75,6 +82,7 @@ def renew_member(*args, **kwargs):
     ], (60, 15))
 
 def renew_club_user(*args, **kwargs):
+    from ceo.urwid import renew
     push_wizard("Renew Club Rep Account", [
         renew.ClubUserIntroPage,
         renew.UserPage,
@@ -85,6 +93,7 @@ def renew_club_user(*args, **kwargs):
     ], (60, 15))
 
 def display_member(data):
+    from ceo.urwid import renew, info
     push_wizard("Display Member", [
         renew.UserPage,
         info.InfoPage,
@@ -100,15 +109,19 @@ def search_members(data):
     push_window(menu, "Search Members")
 
 def search_name(data):
+    from ceo.urwid import search
     push_wizard("By Name", [ search.NamePage ])
 
 def search_term(data):
+    from ceo.urwid import search
     push_wizard("By Term", [ search.TermPage ])
 
 def search_group(data):
+    from ceo.urwid import search
     push_wizard("By Group", [ search.GroupPage ])
 
 def manage_positions(data):
+    from ceo.urwid import positions
     push_wizard("Manage Positions", [
         positions.IntroPage,
         positions.InfoPage,
@@ -116,6 +129,7 @@ def manage_positions(data):
     ], (50, 15))
 
 def change_shell(data):
+    from ceo.urwid import shell
     push_wizard("Change Shell", [
         shell.IntroPage,
         shell.YouPage,
@@ -124,12 +138,17 @@ def change_shell(data):
     ], (50, 20))
 
 def create_mysql_db(data):
+    from ceo.urwid import databases
     push_wizard("Create MySQL database", [
         databases.IntroPage,
         databases.UserPage,
         databases.EndPage,
     ], (60, 15))
 
+def library_menu(data):
+    from ceo.urwid import library
+    library.library(data)
+
 def check_group(group):
     try:
         me = pwd.getpwuid(os.getuid()).pw_name
@@ -144,7 +163,7 @@ def top_menu():
         ("Renew Membership", renew_member, None),
         ("Renew Club Rep", renew_club_user, None),
         ("New Club", new_club, None),
-        ("Library", library.library, None),
+        ("Library", library_menu, None),
     ]
     syscom_only = [
         ("Manage Club or Group Members", manage_group, None),
@@ -183,8 +202,28 @@ def run():
     push_window(top_menu(), program_name())
     event_loop(ui)
 
+def flush_mailing_list():
+    # new members are subscribed in one op-mailman request once the
+    # office is done adding them; anything lost here is picked up by
+    # 'ceo mailinglist sync'
+    if not members.mailing_list_queue:
+        return
+    print "Subscribing %d new members to the mailing list..." % len(members.mailing_list_queue)
+    try:
+        out = members.flush_mailing_list_queue()
+    except members.MemberException, e:
+        print "Failed to subscribe new members to the mailing list: %s" % e
+        print "Run 'ceo mailinglist sync' to try again."
+        return
+    for line in out.splitlines():
+        if line.strip() and line.split(': ',1)[0] not in members.MAILMAN_OK:
+            print line
+
 def start():
-    ui.run_wrapper( run )
+    try:
+        ui.run_wrapper( run )
+    finally:
+        flush_mailing_list()
 
 if __name__ == '__main__':
     start()
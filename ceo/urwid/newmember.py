@@ -215,8 +215,10 @@ class EndPage(WizardPanel):
                         self.state['email'])
                 members.register(self.state['userid'], self.state['terms'])
 
-                mailman_result = members.subscribe_to_mailing_list(self.state['userid'])
-                if mailman_result.split(': ',1)[0] not in ('Subscribed', 'Already a member', 'Disabled'):
+                # subscribed along with everyone else added this session
+                # when ceo exits, see ceo.urwid.main.flush_mailing_list
+                mailman_result = members.subscribe_to_mailing_list(self.state['userid'], defer=True)
+                if mailman_result.split(': ',1)[0] not in members.MAILMAN_OK + ('Queued',):
                     problem = mailman_result
 
             elif self.utype == 'clubuser':
@@ -256,3 +258,6 @@ class EndPage(WizardPanel):
                 "successfully. You should also rebuild the website in "
                 "order to update the memberlist."
                 % self.state['userid'])
+            if self.utype == 'member':
+                self.midtext.set_text(self.midtext.get_text()[0] + " They will "
+                    "be subscribed to the mailing list when you exit ceo.")
@@ -87,7 +87,7 @@ class LdapWordEdit(WordEdit):
     def __init__(self, uri, base, attr, *args):
         try:
             self.ldap = ldap.initialize(uri)
-            self.ldap.simple_bind_s("", "")
+            ldapi.call('bind', uri, None, self.ldap.simple_bind_s, "", "")
         except ldap.LDAPError:
             return WordEdit.__init__(self, *args)
         self.base = base
@@ -108,7 +108,7 @@ class LdapWordEdit(WordEdit):
                 try:
                     text = self.get_edit_text()
                     search = ldapi.escape(text)
-                    matches = self.ldap.search_s(self.base,
+                    matches = ldapi.search_s(self.ldap, self.base,
                         ldap.SCOPE_SUBTREE, '(%s=%s*)' % (self.attr, search))
                     self.choices = [ text ]
                     for match in matches:
@@ -132,7 +132,7 @@ class LdapFilterWordEdit(LdapWordEdit):
             if key == 'enter' or key == 'down' or key == 'up':
                 search = ldapi.escape(self.get_edit_text())
                 try:
-                    matches = self.ldap.search_s(self.base,
+                    matches = ldapi.search_s(self.ldap, self.base,
                         ldap.SCOPE_SUBTREE, '(%s=%s)' % (self.attr, search))
                     if len(matches) > 0:
                         (_, attrs) = matches[0]
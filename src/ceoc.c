@@ -3,21 +3,24 @@
 #include <unistd.h>
 #include <getopt.h>
 #include <libgen.h>
+#include <netdb.h>
 
 #include "util.h"
 #include "net.h"
 #include "gss.h"
 #include "ops.h"
 #include "config.h"
+#include "ceo.pb-c.h"
 
 char *prog = NULL;
 
 static struct option opts[] = {
+    { "stats", 1, NULL, 's' },
     { NULL, 0, NULL, '\0' },
 };
 
 static void usage() {
-    fprintf(stderr, "Usage: %s op\n", prog);
+    fprintf(stderr, "Usage: %s op\n       %s --stats host\n", prog, prog);
     exit(2);
 }
 
@@ -64,27 +67,82 @@ static void client_gss_auth(int sock, struct sockaddr *addr, socklen_t addrlen)
     strbuf_release(&msg);
 }
 
-void run_remote(struct op *op, struct strbuf *in, struct strbuf *out) {
-    const char *hostname = op->hostname;
-    int sock = socket(PF_INET, SOCK_STREAM, IPPROTO_TCP);
-    struct sockaddr_in addr;
+/*
+ * Servers older than MSG_TRACE treat it as an unknown op and drop the
+ * connection, so the server must acknowledge it before the op is sent.
+ * Returns nonzero if the connection was closed instead.
+ */
+static int send_trace(int sock, const char *trace_id) {
+    Ceo__TraceContext trace;
+    struct strbuf plain = STRBUF_INIT, cipher = STRBUF_INIT;
     uint32_t msgtype;
-    struct strbuf in_cipher = STRBUF_INIT, out_cipher = STRBUF_INIT;
+    int ret = 0;
 
-    if (!in->len)
-        fatal("no data to send");
+    ceo__trace_context__init(&trace);
+    trace.trace_id = (char *)trace_id;
+
+    strbuf_grow(&plain, ceo__trace_context__get_packed_size(&trace));
+    strbuf_setlen(&plain, ceo__trace_context__pack(&trace, (uint8_t *)plain.buf));
+
+    gss_encipher(&plain, &cipher);
+
+    if (ceo_send_message(sock, cipher.buf, cipher.len, MSG_TRACE))
+        fatalpe("write");
+
+    if (ceo_receive_message(sock, &cipher, &msgtype))
+        ret = -1;
+    else if (msgtype != MSG_TRACE)
+        fatal("wrong message type from server: expected %d got %d", MSG_TRACE, msgtype);
+
+    strbuf_release(&plain);
+    strbuf_release(&cipher);
+
+    return ret;
+}
+
+static int connect_server(struct op *op) {
+    int sock = socket(PF_INET, SOCK_STREAM, IPPROTO_TCP);
+    struct sockaddr_in addr;
 
     memset(&addr, 0, sizeof(addr));
     addr.sin_family = AF_INET;
-    addr.sin_port = htons(9987);
+    addr.sin_port = htons(ceo_port());
+#ifdef CEO_INSECURE_NOAUTH
+    /* the no-auth daemon only listens on loopback */
+    addr.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+#else
     addr.sin_addr = op->addr;
+#endif
 
     if (connect(sock, (struct sockaddr *)&addr, sizeof(addr)))
         fatalpe("connect");
 
-    client_acquire_creds("ceod", hostname);
+    client_acquire_creds("ceod", op->hostname);
     client_gss_auth(sock, (sa *)&addr, sizeof(addr));
 
+    return sock;
+}
+
+void run_remote(struct op *op, struct strbuf *in, struct strbuf *out) {
+    int sock;
+    uint32_t msgtype;
+    struct strbuf in_cipher = STRBUF_INIT, out_cipher = STRBUF_INIT;
+
+    if (!in->len)
+        fatal("no data to send");
+
+    sock = connect_server(op);
+
+    char *trace_id = getenv("CEO_TRACE_ID");
+    if (trace_id && *trace_id && send_trace(sock, trace_id)) {
+        /* an older ceod: start again, without the trace id */
+        debug("%s does not accept trace ids", op->hostname);
+        if (close(sock))
+            fatalpe("close");
+        free_gss();
+        sock = connect_server(op);
+    }
+
     gss_encipher(in, &in_cipher);
 
     if (ceo_send_message(sock, in_cipher.buf, in_cipher.len, op->id))
@@ -95,6 +153,11 @@ void run_remote(struct op *op, struct strbuf *in, struct strbuf *out) {
 
     gss_decipher(&out_cipher, out);
 
+    if (msgtype == MSG_ERROR) {
+        strbuf_rtrim(out);
+        fatal("%s: %s", op->hostname, out->buf);
+    }
+
     if (msgtype != op->id)
         fatal("wrong message type from server: expected %d got %d", op->id, msgtype);
 
@@ -128,10 +191,39 @@ int client_main(char *op_name) {
     return 0;
 }
 
+int stats_main(char *host) {
+    struct hostent *hostent = gethostbyname(host);
+    struct op op;
+    struct strbuf in = STRBUF_INIT;
+    struct strbuf out = STRBUF_INIT;
+
+    if (!hostent)
+        fatal("cannot get stats from %s: %s", host, hstrerror(h_errno));
+
+    memset(&op, 0, sizeof(op));
+    op.name = "stats";
+    op.id = MSG_STATS;
+    op.hostname = hostent->h_name;
+    op.addr = *(struct in_addr *)hostent->h_addr_list[0];
+
+    strbuf_addstr(&in, "stats\n");
+
+    run_remote(&op, &in, &out);
+
+    if (strbuf_write(&out, STDOUT_FILENO) < 0)
+        fatalpe("write");
+
+    strbuf_release(&in);
+    strbuf_release(&out);
+
+    return 0;
+}
+
 int main(int argc, char *argv[]) {
     int opt;
     int ret;
     char *op;
+    char *stats_host = NULL;
 
     prog = xstrdup(basename(argv[0]));
     init_log(prog, LOG_PID, LOG_USER, 1);
@@ -142,6 +234,9 @@ int main(int argc, char *argv[]) {
 
     while ((opt = getopt_long(argc, argv, "", opts, NULL)) != -1) {
         switch (opt) {
+            case 's':
+                stats_host = optarg;
+                break;
             case '?':
                 usage();
                 break;
@@ -150,12 +245,16 @@ int main(int argc, char *argv[]) {
         }
     }
 
-    if (argc - optind != 1)
-        usage();
-
-    op = argv[optind++];
-
-    ret = client_main(op);
+    if (stats_host) {
+        if (argc != optind)
+            usage();
+        ret = stats_main(stats_host);
+    } else {
+        if (argc - optind != 1)
+            usage();
+        op = argv[optind++];
+        ret = client_main(op);
+    }
 
     free_gss();
     free_fqdn();
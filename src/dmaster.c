@@ -20,6 +20,7 @@
 #include "kadm.h"
 #include "krb5.h"
 #include "ops.h"
+#include "stats.h"
 
 static struct option opts[] = {
     { "detach", 0, NULL, 'd' },
@@ -146,8 +147,13 @@ static int master_main(void) {
 
     memset(&addr, 0, sizeof(addr));
     addr.sin_family = AF_INET;
-    addr.sin_port = htons(9987);
+    addr.sin_port = htons(ceo_port());
+#ifdef CEO_INSECURE_NOAUTH
+    /* anyone who can connect can claim to be anyone */
+    addr.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+#else
     addr.sin_addr.s_addr = INADDR_ANY;
+#endif
 
     sock = socket(PF_INET, SOCK_STREAM, IPPROTO_TCP);
     if (sock < 0)
@@ -167,6 +173,8 @@ static int master_main(void) {
     setup_signals();
     setup_auth();
     setup_ops();
+    setup_stats();
+    setup_slave();
     setup_daemon();
 
     notice("now accepting connections");
@@ -177,6 +185,7 @@ static int master_main(void) {
     free_gss();
     free_fqdn();
     free_ops();
+    free_stats();
 
     return 0;
 }
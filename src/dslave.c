@@ -9,6 +9,9 @@
 #include <errno.h>
 #include <netdb.h>
 #include <alloca.h>
+#include <ctype.h>
+#include <time.h>
+#include <fcntl.h>
 
 #include "util.h"
 #include "strbuf.h"
@@ -20,6 +23,23 @@
 #include "kadm.h"
 #include "krb5.h"
 #include "ops.h"
+#include "stats.h"
+#include "ceo.pb-c.h"
+
+static const size_t MAX_TRACE_LEN = 64;
+
+/* trace id of the current request, passed on to ops */
+static char *trace_id;
+
+/* seconds to wait for a free slot on a busy op */
+static const int OP_QUEUE_TIMEOUT = 120;
+
+/* how often a queued request looks for a free slot */
+static const long OP_QUEUE_POLL_NS = 20 * 1000 * 1000;
+
+/* op slot held by this slave: a byte of the op's lock file */
+static struct op *held_op;
+static off_t held_slot;
 
 static void signal_handler(int sig) {
     if (sig == SIGSEGV) {
@@ -51,12 +71,15 @@ static void setup_slave_sigs(void) {
 static void handle_auth_message(struct strbuf *in, struct strbuf *out) {
     gss_buffer_desc incoming_tok, outgoing_tok;
     OM_uint32 maj_stat, min_stat;
+    uint64_t start = stats_now();
 
     incoming_tok.value = in->buf;
     incoming_tok.length = in->len;
 
     process_server_token(&incoming_tok, &outgoing_tok);
 
+    stats_record(STATS_NO_OP, PHASE_AUTH, stats_now() - start);
+
     strbuf_add(out, outgoing_tok.value, outgoing_tok.length);
 
     if (outgoing_tok.length) {
@@ -66,10 +89,125 @@ static void handle_auth_message(struct strbuf *in, struct strbuf *out) {
     }
 }
 
-static void handle_op_message(uint32_t in_type, struct strbuf *in, struct strbuf *out) {
+static int lock_slot(int fd, off_t slot, short type) {
+    struct flock fl;
+
+    memset(&fl, 0, sizeof(fl));
+    fl.l_type = type;
+    fl.l_whence = SEEK_SET;
+    fl.l_start = slot;
+    fl.l_len = 1;
+
+    return fcntl(fd, F_SETLK, &fl);
+}
+
+static void release_op_slot(void) {
+    if (!held_op)
+        return;
+
+    if (lock_slot(held_op->lock_fd, held_slot, F_UNLCK))
+        errorpe("fcntl");
+    held_op = NULL;
+}
+
+/*
+ * Each slot of a limited op is a byte of its lock file. A slave holds a
+ * slot with a record lock, which the kernel drops if the slave dies, so
+ * a crashed or killed slave cannot leak it. Returns nonzero if no slot
+ * came free within OP_QUEUE_TIMEOUT.
+ */
+static int acquire_op_slot(struct op *op) {
+    time_t deadline = time(NULL) + OP_QUEUE_TIMEOUT;
+    struct timespec pause = { 0, OP_QUEUE_POLL_NS };
+
+    if (op->lock_fd < 0)
+        return 0;
+
+    for (;;) {
+        for (off_t slot = 0; slot < op->limit; slot++) {
+            if (!lock_slot(op->lock_fd, slot, F_WRLCK)) {
+                held_op = op;
+                held_slot = slot;
+                return 0;
+            }
+            if (errno != EACCES && errno != EAGAIN)
+                fatalpe("fcntl");
+        }
+
+        if (time(NULL) >= deadline)
+            return -1;
+        nanosleep(&pause, NULL);
+    }
+}
+
+/* called by the master before accepting connections */
+void setup_slave(void) {
+    struct op *op;
+
+    for (op = get_ops(); op; op = op->next) {
+        if (!op->local || !op->limit)
+            continue;
+
+        char path[] = "/tmp/ceod-slots-XXXXXX";
+        int fd = mkstemp(path);
+        if (fd < 0)
+            fatalpe("mkstemp");
+        if (unlink(path))
+            fatalpe("unlink");
+        /* ops must not inherit it: closing it would drop the locks */
+        if (fcntl(fd, F_SETFD, FD_CLOEXEC))
+            fatalpe("fcntl");
+
+        op->lock_fd = fd;
+        debug("limiting op %s to %d at a time", op->name, op->limit);
+    }
+}
+
+static void handle_trace_message(struct strbuf *in, struct strbuf *out) {
+    struct strbuf in_plain = STRBUF_INIT, out_plain = STRBUF_INIT;
+    Ceo__TraceContext *trace;
+
+    if (!client_username())
+        fatal("unathenticated");
+
+    gss_decipher(in, &in_plain);
+
+    trace = ceo__trace_context__unpack(&protobuf_c_default_allocator,
+            in_plain.len, (uint8_t *)in_plain.buf);
+    if (!trace)
+        fatal("malformed trace context");
+
+    /* the id ends up in the environment and in log lines */
+    size_t len = strlen(trace->trace_id);
+    for (size_t i = 0; i < len; i++) {
+        if (!isalnum((unsigned char)trace->trace_id[i]) && trace->trace_id[i] != '-') {
+            len = 0;
+            break;
+        }
+    }
+
+    if (len && len <= MAX_TRACE_LEN) {
+        free(trace_id);
+        trace_id = xstrdup(trace->trace_id);
+        log_set_trace(trace_id);
+    } else {
+        warn("ignoring invalid trace id from %s", client_username());
+    }
+
+    /* the client waits for this before sending its op */
+    strbuf_addstr(&out_plain, "ok\n");
+    gss_encipher(&out_plain, out);
+
+    ceo__trace_context__free_unpacked(trace, &protobuf_c_default_allocator);
+    strbuf_release(&in_plain);
+    strbuf_release(&out_plain);
+}
+
+static void handle_op_message(uint32_t in_type, struct strbuf *in, struct strbuf *out, uint32_t *out_type) {
     struct op *op = get_local_op(in_type);
     struct strbuf in_plain = STRBUF_INIT, out_plain = STRBUF_INIT;
     char *envp[16];
+    uint64_t start, deciphered, started, finished, enciphered;
 
     if (!op)
         fatal("operation %x does not exist", in_type);
@@ -80,34 +218,101 @@ static void handle_op_message(uint32_t in_type, struct strbuf *in, struct strbuf
     if (!client_username())
         fatal("unathenticated");
 
+    start = stats_now();
+
     gss_decipher(in, &in_plain);
 
+    deciphered = stats_now();
+
     make_env(envp, "LANG", "C", "CEO_USER", client_username(),
-                   "CEO_CONFIG_DIR", config_dir, NULL);
+                   "CEO_CONFIG_DIR", config_dir, "CEO_TRACE_ID", trace_id, NULL);
     char *argv[] = { op->path, NULL, };
 
+    if (acquire_op_slot(op)) {
+        warn("op %s busy: no slot free after %d seconds", op->name, OP_QUEUE_TIMEOUT);
+        strbuf_addf(&out_plain, "op %s is busy; try again later\n", op->name);
+        gss_encipher(&out_plain, out);
+        *out_type = MSG_ERROR;
+        stats_record(op->id, PHASE_QUEUE, stats_now() - deciphered);
+        free_env(envp);
+        strbuf_release(&in_plain);
+        strbuf_release(&out_plain);
+        return;
+    }
+
+    started = stats_now();
+
     if (spawnvemu(op->path, argv, envp, &in_plain, &out_plain, 0, op->user))
         fatal("child %s failed", op->path);
 
+    finished = stats_now();
+
+    release_op_slot();
+
     gss_encipher(&out_plain, out);
 
+    enciphered = stats_now();
+
     if (!out->len)
         fatal("no response from op");
 
+    if (out->len > MAX_MSGLEN) {
+        warn("op %s response of %zu bytes exceeds the message size limit", op->name, out->len);
+        strbuf_reset(&out_plain);
+        strbuf_addf(&out_plain, "response from op %s is too large (%zu bytes)\n", op->name, out->len);
+        strbuf_reset(out);
+        gss_encipher(&out_plain, out);
+        *out_type = MSG_ERROR;
+    }
+
+    stats_record(op->id, PHASE_DECIPHER, deciphered - start);
+    stats_record(op->id, PHASE_QUEUE, started - deciphered);
+    stats_record(op->id, PHASE_OP, finished - started);
+    stats_record(op->id, PHASE_ENCIPHER, enciphered - finished);
+    stats_record(op->id, PHASE_TOTAL, enciphered - start);
+
+    notice("op %s finished: decipher %lluus queue %lluus op %lluus encipher %lluus total %lluus", op->name,
+            (unsigned long long)(deciphered - start), (unsigned long long)(started - deciphered),
+            (unsigned long long)(finished - started),
+            (unsigned long long)(enciphered - finished), (unsigned long long)(enciphered - start));
+
     free_env(envp);
     strbuf_release(&in_plain);
     strbuf_release(&out_plain);
 }
 
+static void handle_stats_message(struct strbuf *in, struct strbuf *out) {
+    struct strbuf in_plain = STRBUF_INIT, out_plain = STRBUF_INIT;
+
+    if (!client_username())
+        fatal("unathenticated");
+
+    debug("reporting stats to %s", client_username());
+
+    gss_decipher(in, &in_plain);
+
+    stats_format(&out_plain);
+
+    gss_encipher(&out_plain, out);
+
+    strbuf_release(&in_plain);
+    strbuf_release(&out_plain);
+}
+
 static void handle_one_message(int sock, struct strbuf *in, uint32_t msgtype) {
     struct strbuf out = STRBUF_INIT;
+    uint32_t out_type = msgtype;
 
     if (msgtype == MSG_AUTH)
         handle_auth_message(in, &out);
+    else if (msgtype == MSG_STATS)
+        handle_stats_message(in, &out);
+    else if (msgtype == MSG_TRACE)
+        handle_trace_message(in, &out);
     else
-        handle_op_message(msgtype, in, &out);
+        handle_op_message(msgtype, in, &out, &out_type);
 
-    if (out.len && ceo_send_message(sock, out.buf, out.len, msgtype))
+    if (out.len && ceo_send_message(sock, out.buf, out.len, out_type))
         fatalpe("write");
 
     strbuf_release(&out);
@@ -144,6 +349,8 @@ void slave_main(int sock, struct sockaddr *addr) {
     free_config();
     free_fqdn();
     free_ops();
+    free_stats();
+    free(trace_id);
     free(prog);
 }
 
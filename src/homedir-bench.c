@@ -0,0 +1,143 @@
+/*
+ * homedir-bench: time home directory creation from a skeleton
+ *
+ * Builds a small skeleton in an empty scratch directory and creates
+ * homes from it one at a time with a plain copy, one at a time with
+ * the clone/copy_file_range fast path, and as a single batch.
+ *
+ * Run it as root (skeleton files must be owned by root) against a
+ * tmpfs mount, e.g.
+ *
+ *   mount -t tmpfs none /mnt/bench && ./homedir-bench /mnt/bench 1000
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <unistd.h>
+#include <limits.h>
+#include <time.h>
+#include <fcntl.h>
+#include <libgen.h>
+#include <sys/stat.h>
+
+#include "homedir.h"
+#include "util.h"
+
+char *prog;
+
+static double now(void) {
+    struct timespec ts;
+
+    if (clock_gettime(CLOCK_MONOTONIC, &ts))
+        fatalpe("clock_gettime");
+
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static void make_file(const char *skel, const char *name, size_t size) {
+    char path[PATH_MAX];
+    char buf[4096];
+    int fd;
+
+    snprintf(path, sizeof(path), "%s/%s", skel, name);
+    fd = open(path, O_WRONLY|O_CREAT|O_EXCL, 0644);
+    if (fd < 0)
+        fatalpe("open: %s", path);
+
+    memset(buf, '#', sizeof(buf));
+    while (size) {
+        size_t chunk = size < sizeof(buf) ? size : sizeof(buf);
+        if (full_write(fd, buf, chunk))
+            fatalpe("write: %s", path);
+        size -= chunk;
+    }
+
+    close(fd);
+}
+
+static void make_skel(const char *skel) {
+    char path[PATH_MAX];
+
+    if (mkdir(skel, 0755))
+        fatalpe("mkdir: %s", skel);
+
+    make_file(skel, ".bashrc", 3 * 1024);
+    make_file(skel, ".profile", 700);
+    make_file(skel, ".emacs", 16 * 1024);
+    make_file(skel, "README", 256 * 1024);
+
+    snprintf(path, sizeof(path), "%s/www", skel);
+    if (mkdir(path, 0755))
+        fatalpe("mkdir: %s", path);
+
+    snprintf(path, sizeof(path), "%s/.plan", skel);
+    if (symlink(".profile", path))
+        fatalpe("symlink: %s", path);
+}
+
+static void run(const char *dir, const char *skel, const char *name, const char *label,
+        int count, int batch, int fast) {
+    char base[PATH_MAX];
+    struct ceo_home *homes = xcalloc(count, sizeof(*homes));
+    double start, elapsed;
+    int i, failures = 0;
+
+    snprintf(base, sizeof(base), "%s/%s", dir, name);
+    if (mkdir(base, 0755))
+        fatalpe("mkdir: %s", base);
+
+    for (i = 0; i < count; i++) {
+        homes[i].homedir = xmalloc(PATH_MAX);
+        snprintf(homes[i].homedir, PATH_MAX, "%s/user%d", base, i);
+        homes[i].uid = getuid();
+        homes[i].gid = getgid();
+    }
+
+    ceo_home_fast_copy = fast;
+
+    start = now();
+    if (batch) {
+        failures = ceo_create_homes((char *)skel, homes, count) ? 1 : 0;
+    } else {
+        for (i = 0; i < count; i++)
+            if (ceo_create_home(homes[i].homedir, (char *)skel, homes[i].uid, homes[i].gid, NULL, NULL, NULL))
+                failures++;
+    }
+    elapsed = now() - start;
+
+    printf("%-24s %6d homes %9.3f s %9.1f homes/s%s\n", label, count, elapsed,
+            count / elapsed, failures ? " (with failures)" : "");
+
+    for (i = 0; i < count; i++)
+        free(homes[i].homedir);
+    free(homes);
+}
+
+int main(int argc, char *argv[]) {
+    char skel[PATH_MAX];
+    int count = 500;
+
+    prog = xstrdup(basename(argv[0]));
+    init_log(prog, LOG_PID, LOG_USER, 1);
+
+    if (argc < 2 || argc > 3) {
+        fprintf(stderr, "usage: %s scratch-dir [count]\n", prog);
+        exit(2);
+    }
+
+    if (argc == 3)
+        count = atoi(argv[2]);
+
+    if (getuid())
+        warn("not running as root; skeleton files will be skipped");
+
+    snprintf(skel, sizeof(skel), "%s/skel", argv[1]);
+    make_skel(skel);
+
+    run(argv[1], skel, "plain", "one at a time, plain", count, 0, 0);
+    run(argv[1], skel, "fast", "one at a time, fast", count, 0, 1);
+    run(argv[1], skel, "batch", "batch, fast", count, 1, 1);
+
+    free(prog);
+
+    return 0;
+}
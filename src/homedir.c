@@ -1,16 +1,40 @@
+#define _GNU_SOURCE
 #include <stdio.h>
 #include <unistd.h>
+#include <errno.h>
+#include <limits.h>
 #include <sys/types.h>
 #include <sys/stat.h>
 #include <sys/acl.h>
+#include <sys/ioctl.h>
+#include <sys/syscall.h>
+#include <sys/quota.h>
+#include <linux/fs.h>
 #include <dirent.h>
 #include <pwd.h>
 #include <fcntl.h>
+#include <mntent.h>
 
 #include "homedir.h"
 #include "util.h"
 #include "config.h"
 
+/* clone or copy_file_range skeleton files where the filesystem allows */
+int ceo_home_fast_copy = 1;
+
+struct skel_entry {
+    char name[NAME_MAX + 1];
+    struct stat sb;
+    int fd;
+    char *link;
+};
+
+struct skel {
+    char *path;
+    struct skel_entry *entries;
+    int n;
+};
+
 static int set_acl(char *dir, char *acl_text, acl_type_t type) {
     acl_t acl = acl_from_text(acl_text);
     if (acl == (acl_t)NULL) {
@@ -27,132 +51,231 @@ static int set_acl(char *dir, char *acl_text, acl_type_t type) {
     return 0;
 }
 
-int ceo_create_home(char *homedir, char *skel, uid_t uid, gid_t gid, char *access_acl, char *default_acl, char *email) {
-    int mask;
+static int load_skel(char *path, struct skel *skel) {
     DIR *skeldir;
     struct dirent *skelent;
+    int alloc = 16;
 
-    mask = umask(0);
+    skel->path = path;
+    skel->n = 0;
+    skel->entries = xmalloc(alloc * sizeof(*skel->entries));
 
-    if (mkdir(homedir, 0755)) {
-        errorpe("failed to create %s", homedir);
-        return -1;
-    }
-
-    if (access_acl && set_acl(homedir, access_acl, ACL_TYPE_ACCESS) != 0)
-        return -1;
-    if (default_acl && set_acl(homedir, default_acl, ACL_TYPE_DEFAULT) != 0)
-        return -1;
-
-    skeldir = opendir(skel);
+    skeldir = opendir(path);
     if (!skeldir) {
-        errorpe("failed to open %s", skel);
+        errorpe("failed to open %s", path);
+        free(skel->entries);
         return -1;
     }
 
     while ((skelent = readdir(skeldir))) {
-        struct stat sb;
-        char src[PATH_MAX], dest[PATH_MAX];
+        struct skel_entry *ent;
+        char src[PATH_MAX];
 
         if (!strcmp(skelent->d_name, ".") || !strcmp(skelent->d_name, ".."))
             continue;
 
-        snprintf(src, sizeof(src), "%s/%s", skel, skelent->d_name);
-        snprintf(dest, sizeof(dest), "%s/%s", homedir, skelent->d_name);
-        lstat(src, &sb);
+        if (skel->n == alloc) {
+            alloc *= 2;
+            skel->entries = xrealloc(skel->entries, alloc * sizeof(*skel->entries));
+        }
+
+        ent = &skel->entries[skel->n];
+        snprintf(ent->name, sizeof(ent->name), "%s", skelent->d_name);
+        snprintf(src, sizeof(src), "%s/%s", path, skelent->d_name);
+        ent->fd = -1;
+        ent->link = NULL;
 
-        if (sb.st_uid || sb.st_gid) {
-            warn("not creating %s due to ownership", dest);
+        if (lstat(src, &ent->sb)) {
+            warnpe("lstat: %s", src);
             continue;
         }
 
-        if (S_ISREG(sb.st_mode)) {
-            int bytes;
-            char buf[4096];
+        if (ent->sb.st_uid || ent->sb.st_gid) {
+            warn("not copying %s due to ownership", src);
+            continue;
+        }
 
-            int srcfd = open(src, O_RDONLY);
-            if (srcfd == -1) {
+        if (S_ISREG(ent->sb.st_mode)) {
+            ent->fd = open(src, O_RDONLY);
+            if (ent->fd == -1) {
                 warnpe("open: %s", src);
                 continue;
             }
+        } else if (S_ISLNK(ent->sb.st_mode)) {
+            char lnkdest[PATH_MAX];
+            int bytes = readlink(src, lnkdest, sizeof(lnkdest) - 1);
+            if (bytes == -1) {
+                warnpe("readlink: %s", src);
+                continue;
+            }
+            lnkdest[bytes] = '\0';
+            ent->link = xstrdup(lnkdest);
+        } else if (!S_ISDIR(ent->sb.st_mode)) {
+            warn("not copying %s", src);
+            continue;
+        }
+
+        skel->n++;
+    }
+
+    closedir(skeldir);
+
+    return 0;
+}
+
+static void free_skel(struct skel *skel) {
+    for (int i = 0; i < skel->n; i++) {
+        if (skel->entries[i].fd != -1)
+            close(skel->entries[i].fd);
+        free(skel->entries[i].link);
+    }
+    free(skel->entries);
+}
+
+static int copy_contents(int srcfd, int destfd, off_t size) {
+    off_t offset = 0;
+    ssize_t bytes;
+    char buf[4096];
+
+    if (ceo_home_fast_copy) {
+#ifdef FICLONE
+        if (!ioctl(destfd, FICLONE, srcfd))
+            return 0;
+#endif
+#ifdef __NR_copy_file_range
+        while (offset < size) {
+            loff_t off_in = offset;
+            bytes = syscall(__NR_copy_file_range, srcfd, &off_in, destfd, NULL, size - offset, 0);
+            if (bytes <= 0)
+                break;
+            offset += bytes;
+        }
+        if (offset >= size)
+            return 0;
+#endif
+    }
+
+    /* plain copy of whatever the fast paths did not handle */
+    for (;;) {
+        bytes = pread(srcfd, buf, sizeof(buf), offset);
+        if (!bytes)
+            break;
+        if (bytes < 0) {
+            warnpe("read");
+            return -1;
+        }
+        if (full_write(destfd, buf, bytes)) {
+            warnpe("write");
+            return -1;
+        }
+        offset += bytes;
+    }
+
+    return 0;
+}
+
+static int create_home(struct skel *skel, struct ceo_home *home) {
+    if (mkdir(home->homedir, 0755)) {
+        errorpe("failed to create %s", home->homedir);
+        return -1;
+    }
+
+    if (home->access_acl && set_acl(home->homedir, home->access_acl, ACL_TYPE_ACCESS) != 0)
+        return -1;
+    if (home->default_acl && set_acl(home->homedir, home->default_acl, ACL_TYPE_DEFAULT) != 0)
+        return -1;
 
-            int destfd = open(dest, O_WRONLY|O_CREAT|O_EXCL, sb.st_mode & 0777);
+    for (int i = 0; i < skel->n; i++) {
+        struct skel_entry *ent = &skel->entries[i];
+        char dest[PATH_MAX];
+
+        snprintf(dest, sizeof(dest), "%s/%s", home->homedir, ent->name);
+
+        if (S_ISREG(ent->sb.st_mode)) {
+            int destfd = open(dest, O_WRONLY|O_CREAT|O_EXCL, ent->sb.st_mode & 0777);
             if (destfd == -1) {
                 warnpe("open: %s", dest);
-                close(srcfd);
                 continue;
             }
 
-            for (;;) {
-                bytes = read(srcfd, buf, sizeof(buf));
-                if (!bytes)
-                    break;
-                if (bytes < 0) {
-                    warnpe("read");
-                    break;
-                }
-                if (full_write(destfd, buf, bytes)) {
-                    warnpe("write: %s", src);
-                    break;
-                }
-            }
+            if (copy_contents(ent->fd, destfd, ent->sb.st_size))
+                warn("failed to copy %s/%s", skel->path, ent->name);
 
-            if (fchown(destfd, uid, gid))
+            if (fchown(destfd, home->uid, home->gid))
                 errorpe("chown: %s", dest);
 
-            close(srcfd);
             close(destfd);
-        } else if (S_ISDIR(sb.st_mode)) {
-            if (mkdir(dest, sb.st_mode & 0777)) {
+        } else if (S_ISDIR(ent->sb.st_mode)) {
+            if (mkdir(dest, ent->sb.st_mode & 0777)) {
                 warnpe("mkdir: %s", dest);
                 continue;
             }
-            if (chown(dest, uid, gid))
+            if (chown(dest, home->uid, home->gid))
                 errorpe("chown: %s", dest);
-        } else if (S_ISLNK(sb.st_mode)) {
-            char lnkdest[PATH_MAX];
-            int bytes;
-            bytes = readlink(src, lnkdest, sizeof(lnkdest));
-            lnkdest[bytes] = '\0';
-            if (bytes == -1) {
-                warnpe("readlink: %s", src);
-                continue;
-            }
-            if (symlink(lnkdest, dest)) {
+        } else if (S_ISLNK(ent->sb.st_mode)) {
+            if (symlink(ent->link, dest)) {
                 warnpe("symlink: %s", dest);
                 continue;
             }
-            if (lchown(dest, uid, gid))
+            if (lchown(dest, home->uid, home->gid))
                 errorpe("lchown: %s", dest);
-        } else {
-            warn("not creating %s", dest);
         }
     }
 
-    closedir(skeldir);
-
-    if (email && *email) {
+    if (home->email && *home->email) {
         char dest[PATH_MAX];
-        snprintf(dest, sizeof(dest), "%s/%s", homedir, ".forward");
+        snprintf(dest, sizeof(dest), "%s/%s", home->homedir, ".forward");
         int destfd = open(dest, O_WRONLY|O_CREAT|O_EXCL, 0644);
 
-        if (full_write(destfd, email, strlen(email)))
+        if (full_write(destfd, home->email, strlen(home->email)))
             warnpe("write: %s", dest);
 
-        if (fchown(destfd, uid, gid))
+        if (fchown(destfd, home->uid, home->gid))
             errorpe("chown: %s", dest);
 
         close(destfd);
     }
 
-    if (chown(homedir, uid, gid)) {
-        errorpe("failed to chown %s", homedir);
+    if (chown(home->homedir, home->uid, home->gid)) {
+        errorpe("failed to chown %s", home->homedir);
         return -1;
     }
 
+    return 0;
+}
+
+int ceo_create_homes(char *skelpath, struct ceo_home *homes, int n) {
+    struct skel skel;
+    int mask;
+    int ret = 0;
+
+    if (load_skel(skelpath, &skel))
+        return -1;
+
+    mask = umask(0);
+
+    for (int i = 0; i < n; i++)
+        if (create_home(&skel, &homes[i]))
+            ret = -1;
+
     umask(mask);
 
-    return 0;
+    free_skel(&skel);
+
+    return ret;
+}
+
+int ceo_create_home(char *homedir, char *skel, uid_t uid, gid_t gid, char *access_acl, char *default_acl, char *email) {
+    struct ceo_home home = {
+        .homedir = homedir,
+        .uid = uid,
+        .gid = gid,
+        .access_acl = access_acl,
+        .default_acl = default_acl,
+        .email = email,
+    };
+
+    return ceo_create_homes(skel, &home, 1);
 }
 
 int ceo_set_quota(char *proto, int id) {
@@ -169,3 +292,65 @@ int ceo_set_quota(char *proto, int id) {
 
     return 0;
 }
+
+/* mounts setquota -a would update: NFS through rquotad, or a local
+ * filesystem with user quotas on, whether from mount options or the
+ * ext4 quota feature */
+static int count_quota_filesystems(void) {
+    struct mntent *mnt;
+    struct if_dqinfo info;
+    FILE *mtab;
+    int filesystems = 0;
+
+    mtab = setmntent(MOUNTED, "r");
+    if (!mtab) {
+        errorpe("setmntent: %s", MOUNTED);
+        return -1;
+    }
+
+    while ((mnt = getmntent(mtab))) {
+        if (!strcmp(mnt->mnt_type, "nfs") || !strcmp(mnt->mnt_type, "nfs4") ||
+                !quotactl(QCMD(Q_GETINFO, USRQUOTA), mnt->mnt_fsname, 0, (caddr_t)&info))
+            filesystems++;
+    }
+
+    endmntent(mtab);
+
+    return filesystems;
+}
+
+/* accounts named on one setquota command line */
+#define QUOTA_BATCH 256
+
+int ceo_set_quotas(char *proto, int *ids, int n) {
+    char *sqargs[QUOTA_BATCH + 5] = { "setquota", "-a", "-p", proto, };
+    char users[QUOTA_BATCH][16];
+    int filesystems, ret = 0;
+
+    filesystems = count_quota_filesystems();
+    if (filesystems < 0)
+        return -1;
+    if (!filesystems) {
+        error("no filesystems with user quotas are mounted");
+        return -1;
+    }
+
+    /* setquota copies the prototype to every name given, on the same
+     * filesystems as ceo_set_quota(), so one run covers a whole batch */
+    for (int start = 0; start < n; start += QUOTA_BATCH) {
+        int count = n - start < QUOTA_BATCH ? n - start : QUOTA_BATCH;
+
+        for (int i = 0; i < count; i++) {
+            snprintf(users[i], sizeof(users[i]), "%d", ids[start + i]);
+            sqargs[4 + i] = users[i];
+        }
+        sqargs[4 + count] = NULL;
+
+        if (spawnv("/usr/sbin/setquota", sqargs)) {
+            error("failed to set quota for %d accounts starting with %s", count, users[0]);
+            ret = -1;
+        }
+    }
+
+    return ret;
+}
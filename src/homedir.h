@@ -2,5 +2,22 @@
 
 #define CLUB_ACL "u::rwx,g::r-x,o::r-x,g:%d:rwx,m::rwx"
 
+/* users whose quotas are copied to new accounts */
+#define MEMBER_QUOTA_PROTO "ctdalek"
+#define CLUB_QUOTA_PROTO "csc"
+
+struct ceo_home {
+    char *homedir;
+    uid_t uid;
+    gid_t gid;
+    char *access_acl;
+    char *default_acl;
+    char *email;
+};
+
+extern int ceo_home_fast_copy;
+
 int ceo_create_home(char *homedir, char *skel, uid_t uid, gid_t gid, char *access_acl, char *default_acl, char *email);
+int ceo_create_homes(char *skel, struct ceo_home *homes, int n);
 int ceo_set_quota(char *proto, int id);
+int ceo_set_quotas(char *proto, int *ids, int n);
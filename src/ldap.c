@@ -1,5 +1,6 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <strings.h>
 #include <pwd.h>
 #include <grp.h>
 #include <sasl/sasl.h>
@@ -12,6 +13,7 @@
 #include "krb5.h"
 #include "config.h"
 #include "util.h"
+#include "strbuf.h"
 
 extern char *prog;
 
@@ -57,7 +59,57 @@ static void ldap_err(char *msg) {
         error("%s", msg);
 }
 
-int ceo_add_group(char *cn, char *basedn, int no) {
+static int add_entry(char *dn, LDAPMod **mods, char *what) {
+    int msgid;
+
+    if (ldap_add_ext(ld, dn, mods, NULL, NULL, &msgid) != LDAP_SUCCESS) {
+        ldap_err(what);
+        return -1;
+    }
+
+    return msgid;
+}
+
+static int del_entry(char *dn, char *what) {
+    if (ldap_delete_s(ld, dn) != LDAP_SUCCESS) {
+        ldap_err(what);
+        return -1;
+    }
+
+    return 0;
+}
+
+int ceo_ldap_wait(int msgid, char *what) {
+    LDAPMessage *res = NULL;
+    char *detail = NULL;
+    int errnum = 0;
+
+    if (msgid < 0)
+        return -1;
+
+    if (ldap_result(ld, msgid, LDAP_MSG_ALL, NULL, &res) <= 0) {
+        ldap_err(what);
+        return -1;
+    }
+
+    if (ldap_parse_result(ld, res, &errnum, NULL, &detail, NULL, NULL, 1) != LDAP_SUCCESS) {
+        ldap_err(what);
+        return -1;
+    }
+
+    if (errnum != LDAP_SUCCESS) {
+        if (detail && *detail)
+            error("%s: %s (%d): %s", what, ldap_err2string(errnum), errnum, detail);
+        else
+            error("%s: %s (%d)", what, ldap_err2string(errnum), errnum);
+    }
+
+    ldap_memfree(detail);
+
+    return errnum == LDAP_SUCCESS ? 0 : -1;
+}
+
+int ceo_add_group_async(char *cn, char *basedn, int no) {
     if (!cn || !basedn)
         fatal("addgroup: Invalid argument");
 
@@ -90,10 +142,7 @@ int ceo_add_group(char *cn, char *basedn, int no) {
     char dn[1024];
     snprintf(dn, sizeof(dn), "cn=%s,%s", cn, basedn);
 
-    if (ldap_add_s(ld, dn, mods) != LDAP_SUCCESS) {
-        ldap_err("addgroup");
-        ret = -1;
-    }
+    ret = add_entry(dn, mods, "addgroup");
 
     for (i = 0; mods[i]; i++)
         free(mods[i]);
@@ -101,7 +150,18 @@ int ceo_add_group(char *cn, char *basedn, int no) {
     return ret;
 }
 
-int ceo_add_group_sudo(char *group, char *basedn) {
+int ceo_add_group(char *cn, char *basedn, int no) {
+    return ceo_ldap_wait(ceo_add_group_async(cn, basedn, no), "addgroup");
+}
+
+int ceo_del_group(char *cn, char *basedn) {
+    char dn[1024];
+    snprintf(dn, sizeof(dn), "cn=%s,%s", cn, basedn);
+
+    return del_entry(dn, "delgroup");
+}
+
+int ceo_add_group_sudo_async(char *group, char *basedn) {
     if (!group || !basedn)
         fatal("addgroup: Invalid argument");
 
@@ -159,10 +219,7 @@ int ceo_add_group_sudo(char *group, char *basedn) {
 
     mods[++i] = NULL;
 
-    if (ldap_add_s(ld, dn, mods) != LDAP_SUCCESS) {
-        ldap_err("addgroup");
-        ret = -1;
-    }
+    ret = add_entry(dn, mods, "addgroup");
 
     for (i = 0; mods[i]; i++)
         free(mods[i]);
@@ -170,9 +227,18 @@ int ceo_add_group_sudo(char *group, char *basedn) {
     return ret;
 }
 
-int ceo_add_user(char *uid, char *basedn, char *objclass, char *cn, char *home, char *shell, int no, ...) {
-    va_list args;
+int ceo_add_group_sudo(char *group, char *basedn) {
+    return ceo_ldap_wait(ceo_add_group_sudo_async(group, basedn), "addgroup");
+}
+
+int ceo_del_group_sudo(char *group, char *basedn) {
+    char dn[1024];
+    snprintf(dn, sizeof(dn), "cn=%%%s,%s", group, basedn);
 
+    return del_entry(dn, "delgroup");
+}
+
+static int vadd_user(char *uid, char *basedn, char *objclass, char *cn, char *home, char *shell, int no, va_list args) {
     if (!uid || !basedn || !cn || !home || !shell)
         fatal("adduser: Invalid argument");
 
@@ -227,7 +293,6 @@ int ceo_add_user(char *uid, char *basedn, char *objclass, char *cn, char *home,
     char *homeDirectory[] = { home, NULL };
     mods[i]->mod_values = homeDirectory;
 
-    va_start(args, no);
     char *attr;
     while ((attr = va_arg(args, char *))) {
         char *val = va_arg(args, char *);
@@ -253,10 +318,7 @@ int ceo_add_user(char *uid, char *basedn, char *objclass, char *cn, char *home,
     char dn[1024];
     snprintf(dn, sizeof(dn), "uid=%s,%s", uid, basedn);
 
-    if (ldap_add_s(ld, dn, mods) != LDAP_SUCCESS) {
-        ldap_err("adduser");
-        ret = -1;
-    }
+    ret = add_entry(dn, mods, "adduser");
 
     for (i = 0; mods[i]; i++)
         free(mods[i]);
@@ -264,38 +326,203 @@ int ceo_add_user(char *uid, char *basedn, char *objclass, char *cn, char *home,
     return ret;
 }
 
+int ceo_add_user_async(char *uid, char *basedn, char *objclass, char *cn, char *home, char *shell, int no, ...) {
+    va_list args;
+    int ret;
+
+    va_start(args, no);
+    ret = vadd_user(uid, basedn, objclass, cn, home, shell, no, args);
+    va_end(args);
+
+    return ret;
+}
+
+int ceo_add_user(char *uid, char *basedn, char *objclass, char *cn, char *home, char *shell, int no, ...) {
+    va_list args;
+    int ret;
+
+    va_start(args, no);
+    ret = vadd_user(uid, basedn, objclass, cn, home, shell, no, args);
+    va_end(args);
+
+    return ceo_ldap_wait(ret, "adduser");
+}
+
+int ceo_del_user(char *uid, char *basedn) {
+    char dn[1024];
+    snprintf(dn, sizeof(dn), "uid=%s,%s", uid, basedn);
+
+    return del_entry(dn, "deluser");
+}
+
+#define ID_TAKEN(map, i)    ((map)[(i) / 8] & (1 << ((i) % 8)))
+#define ID_SET(map, i)      ((map)[(i) / 8] |= (1 << ((i) % 8)))
+
+/* entries fetched per page of the uid range search */
+#define UID_PAGE_SIZE 500
+
+static void mark_ids(LDAPMessage *entry, char *attr, unsigned char *taken, int min, int max) {
+    char **vals = ldap_get_values(ld, entry, attr);
+    int i;
+
+    if (!vals)
+        return;
+
+    for (i = 0; vals[i]; i++) {
+        long id = strtol(vals[i], NULL, 10);
+        if (id >= min && id <= max)
+            ID_SET(taken, id - min);
+    }
+
+    ldap_value_free(vals);
+}
+
+/* marks the ids in one page of the search; the cookie is left empty
+ * after the last page */
+static int search_id_page(char *filter, unsigned char *taken, int min, int max,
+        struct berval *cookie) {
+    char *attrs[] = { "uidNumber", "gidNumber", NULL };
+    LDAPControl *page = NULL, *ctrls[2] = { NULL, NULL }, **resctrls = NULL, *pagectrl;
+    LDAPMessage *res = NULL, *entry;
+    ber_int_t estimate;
+    int ret;
+
+    if (ldap_create_page_control(ld, UID_PAGE_SIZE, cookie, 1, &page) != LDAP_SUCCESS) {
+        ldap_err("firstuid");
+        return -1;
+    }
+    ctrls[0] = page;
+
+    ret = ldap_search_ext_s(ld, ldap_users_base, LDAP_SCOPE_SUBTREE, filter, attrs, 0,
+                ctrls, NULL, NULL, LDAP_NO_LIMIT, &res);
+    ldap_control_free(page);
+    if (ret != LDAP_SUCCESS) {
+        ldap_err("firstuid");
+        ldap_msgfree(res);
+        return -1;
+    }
+
+    for (entry = ldap_first_entry(ld, res); entry; entry = ldap_next_entry(ld, entry)) {
+        mark_ids(entry, "uidNumber", taken, min, max);
+        mark_ids(entry, "gidNumber", taken, min, max);
+    }
+
+    if (ldap_parse_result(ld, res, NULL, NULL, NULL, NULL, &resctrls, 1) != LDAP_SUCCESS) {
+        ldap_err("firstuid");
+        return -1;
+    }
+
+    ber_memfree(cookie->bv_val);
+    cookie->bv_val = NULL;
+    cookie->bv_len = 0;
+
+    pagectrl = ldap_control_find(LDAP_CONTROL_PAGEDRESULTS, resctrls, NULL);
+    ret = 0;
+    if (!pagectrl || ldap_parse_pageresponse_control(ld, pagectrl, &estimate, cookie) != LDAP_SUCCESS) {
+        error("firstuid: no paged results control in the response");
+        ret = -1;
+    }
+
+    ldap_controls_free(resctrls);
+
+    return ret;
+}
+
 int ceo_new_uid(int min, int max) {
-    char filter[64];
-    char *attrs[] = { LDAP_NO_ATTRS, NULL };
-    LDAPMessage *res;
+    char filter[128];
+    struct berval cookie = { 0, NULL };
+    unsigned char *taken;
+    int ret = -1;
     int i;
 
-    for (i = min; i <= max; i++) {
-        // id taken due to passwd
-        if (getpwuid(i) != NULL)
-            continue;
+    if (min > max)
+        return -1;
 
-        // id taken due to group
-        if (getgrgid(i) != NULL)
-            continue;
+    snprintf(filter, sizeof(filter),
+            "(|(&(uidNumber>=%d)(uidNumber<=%d))(&(gidNumber>=%d)(gidNumber<=%d)))",
+            min, max, min, max);
 
-        snprintf(filter, sizeof(filter), "(|(uidNumber=%d)(gidNumber=%d))", i, i);
-        if (ldap_search_s(ld, ldap_users_base, LDAP_SCOPE_SUBTREE, filter, attrs, 1, &res) != LDAP_SUCCESS) {
-            ldap_err("firstuid");
+    taken = xcalloc((max - min) / 8 + 1, 1);
+
+    /* page through the range so the server's size limit never applies */
+    do {
+        if (search_id_page(filter, taken, min, max, &cookie)) {
+            ber_memfree(cookie.bv_val);
+            free(taken);
             return -1;
         }
+    } while (cookie.bv_len);
 
-        int count = ldap_count_entries(ld, res);
-        ldap_msgfree(res);
+    ber_memfree(cookie.bv_val);
 
+    for (i = 0; i <= max - min; i++) {
         // id taken due to LDAP
-        if (count)
+        if (ID_TAKEN(taken, i))
+            continue;
+
+        // id taken due to passwd or group
+        if (getpwuid(min + i) != NULL || getgrgid(min + i) != NULL)
+            continue;
+
+        ret = min + i;
+        break;
+    }
+
+    free(taken);
+
+    return ret;
+}
+
+/* found, if not NULL, has an entry set for each of uids matched */
+int ceo_user_ids(char *objclass, char **uids, int n_uids, int **ids, int *found) {
+    char *attrs[] = { "uidNumber", "uid", NULL };
+    struct strbuf filter = STRBUF_INIT;
+    LDAPMessage *res = NULL, *entry;
+    int count = 0, i;
+
+    *ids = NULL;
+
+    strbuf_addf(&filter, "(&(objectClass=%s)", objclass);
+    if (n_uids) {
+        strbuf_addstr(&filter, "(|");
+        for (i = 0; i < n_uids; i++)
+            strbuf_addf(&filter, "(uid=%s)", uids[i]);
+        strbuf_addstr(&filter, ")");
+    }
+    strbuf_addstr(&filter, ")");
+
+    if (ldap_search_ext_s(ld, ldap_users_base, LDAP_SCOPE_SUBTREE, filter.buf, attrs, 0,
+                NULL, NULL, NULL, LDAP_NO_LIMIT, &res) != LDAP_SUCCESS) {
+        ldap_err("user_ids");
+        ldap_msgfree(res);
+        strbuf_release(&filter);
+        return -1;
+    }
+
+    strbuf_release(&filter);
+
+    *ids = xmalloc((ldap_count_entries(ld, res) + 1) * sizeof(int));
+
+    for (entry = ldap_first_entry(ld, res); entry; entry = ldap_next_entry(ld, entry)) {
+        char **vals = ldap_get_values(ld, entry, "uidNumber");
+        if (!vals)
             continue;
+        if (vals[0])
+            (*ids)[count++] = strtol(vals[0], NULL, 10);
+        ldap_value_free(vals);
 
-        return i;
+        if (!found || !(vals = ldap_get_values(ld, entry, "uid")))
+            continue;
+        for (char **val = vals; *val; val++)
+            for (i = 0; i < n_uids; i++)
+                if (!strcasecmp(*val, uids[i]))
+                    found[i] = 1;
+        ldap_value_free(vals);
     }
 
-    return -1;
+    ldap_msgfree(res);
+
+    return count;
 }
 
 int ceo_user_exists(char *uid) {
@@ -4,6 +4,17 @@ int ceo_add_user(char *, char *, char *, char *, char *, char *, int, ...);
 int ceo_add_group(char *, char *, int);
 int ceo_add_group_sudo(char *, char *);
 int ceo_new_uid(int, int);
+int ceo_user_ids(char *, char **, int, int **, int *);
+
+/* asynchronous variants return a message id for ceo_ldap_wait() */
+int ceo_add_user_async(char *, char *, char *, char *, char *, char *, int, ...);
+int ceo_add_group_async(char *, char *, int);
+int ceo_add_group_sudo_async(char *, char *);
+int ceo_ldap_wait(int, char *);
+
+int ceo_del_user(char *, char *);
+int ceo_del_group(char *, char *);
+int ceo_del_group_sudo(char *, char *);
 
 void ceo_ldap_init();
 void ceo_ldap_cleanup();
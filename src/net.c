@@ -1,4 +1,5 @@
 #include <stdio.h>
+#include <stdlib.h>
 #include <sys/utsname.h>
 #include <unistd.h>
 #include <netdb.h>
@@ -14,6 +15,24 @@ struct strbuf fqdn = STRBUF_INIT;
 const size_t MAX_MSGLEN = 65536;
 const size_t MSG_BUFINC = 4096;
 
+static const long DEFAULT_PORT = 9987;
+
+/* CEO_PORT lets a test instance run alongside the real daemon */
+uint16_t ceo_port(void) {
+    char *env = getenv("CEO_PORT"), *end;
+    long port;
+
+    if (!env || !*env)
+        return DEFAULT_PORT;
+
+    errno = 0;
+    port = strtol(env, &end, 10);
+    if (errno || *end || port <= 0 || port > 65535)
+        fatal("invalid CEO_PORT: %s", env);
+
+    return port;
+}
+
 void setup_fqdn(void) {
     struct utsname uts;
     struct hostent *lo;
@@ -6,6 +6,8 @@
 
 typedef struct sockaddr sa;
 
+extern const size_t MAX_MSGLEN;
+
 extern struct strbuf fqdn;
 extern void setup_fqdn(void);
 extern void free_fqdn(void);
@@ -13,6 +15,9 @@ extern void free_fqdn(void);
 enum {
     MSG_AUTH    = 0x8000000,
     MSG_EXPLODE = 0x8000001,
+    MSG_STATS   = 0x8000002,
+    MSG_TRACE   = 0x8000003,
+    MSG_ERROR   = 0x8000004,
 };
 
 #define EKERB -2
@@ -20,5 +25,6 @@ enum {
 #define EHOME -4
 #define EQUOTA -5
 
+uint16_t ceo_port(void);
 int ceo_receive_message(int sock, struct strbuf *msg, uint32_t *msgtype);
 int ceo_send_message(int sock, void *msg, size_t len, uint32_t msgtype);
@@ -0,0 +1,104 @@
+#include <string.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <unistd.h>
+#include <pwd.h>
+
+#include "util.h"
+#include "gss.h"
+#include "net.h"
+#include "strbuf.h"
+
+/*
+ * Stand-in for gss.c used by ceod-noauth and ceoc-noauth, the loopback
+ * benchmark builds. The client sends its username as the only auth
+ * token and the server believes it; messages are sent in the clear.
+ * Never install these.
+ */
+
+#ifndef CEO_INSECURE_NOAUTH
+#error "noauth.c must only be built with -DCEO_INSECURE_NOAUTH"
+#endif
+
+static char *peer_principal;
+static char *peer_username;
+static int complete;
+
+void free_gss(void) {
+    free(peer_principal);
+    free(peer_username);
+}
+
+void gss_fatal(char *msg, OM_uint32 maj_stat, OM_uint32 min_stat) {
+    logmsg(LOG_ERR, "fatal: %s (major %u minor %u)", msg, maj_stat, min_stat);
+    exit(1);
+}
+
+void server_acquire_creds(const char *service) {
+    warn("built with CEO_INSECURE_NOAUTH: %s clients are not authenticated", service);
+}
+
+void client_acquire_creds(const char *service, const char *hostname) {
+}
+
+int process_server_token(gss_buffer_t incoming_tok, gss_buffer_t outgoing_tok) {
+    if (complete)
+        fatal("unexpected %zd-byte token from peer", incoming_tok->length);
+
+    peer_username = xmalloc(incoming_tok->length + 1);
+    memcpy(peer_username, incoming_tok->value, incoming_tok->length);
+    peer_username[incoming_tok->length] = '\0';
+
+    peer_principal = xmalloc(strlen(peer_username) + strlen("@NOAUTH") + 1);
+    sprintf(peer_principal, "%s@NOAUTH", peer_username);
+
+    outgoing_tok->value = NULL;
+    outgoing_tok->length = 0;
+    complete = 1;
+
+    notice("client claims to be %s", peer_principal);
+
+    return complete;
+}
+
+int process_client_token(gss_buffer_t incoming_tok, gss_buffer_t outgoing_tok) {
+    fatal("unexpected token from peer");
+}
+
+int initial_client_token(gss_buffer_t outgoing_tok) {
+    char *user = getenv("CEO_NOAUTH_USER");
+
+    if (!user || !*user) {
+        struct passwd *pw = getpwuid(getuid());
+        if (!pw)
+            fatalpe("getpwuid");
+        user = pw->pw_name;
+    }
+
+    /* released with gss_release_buffer, which calls free() */
+    outgoing_tok->value = xstrdup(user);
+    outgoing_tok->length = strlen(user);
+    complete = 1;
+
+    return complete;
+}
+
+char *client_principal(void) {
+    if (!complete)
+        fatal("authentication checked before finishing");
+    return peer_principal;
+}
+
+char *client_username(void) {
+    if (!complete)
+        fatal("authentication checked before finishing");
+    return peer_username;
+}
+
+void gss_encipher(struct strbuf *plain, struct strbuf *cipher) {
+    strbuf_add(cipher, plain->buf, plain->len);
+}
+
+void gss_decipher(struct strbuf *cipher, struct strbuf *plain) {
+    strbuf_add(plain, cipher->buf, cipher->len);
+}
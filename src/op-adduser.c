@@ -147,6 +147,7 @@ static int32_t addmember(Ceo__AddUser *in, Ceo__AddUserResponse *out) {
     char homedir[1024];
     char principal[1024];
     int user_stat, group_stat, krb_stat, home_stat, quota_stat;
+    int user_msg, group_msg;
     int id;
 
     if (snprintf(principal, sizeof(principal), "%s@%s",
@@ -163,18 +164,35 @@ static int32_t addmember(Ceo__AddUser *in, Ceo__AddUserResponse *out) {
     if ((krb_stat = ceo_del_princ(in->username)))
         return response_message(out, EEXIST, "unable to overwrite orphaned kerberos principal %s", in->username);
 
-    if ((user_stat = ceo_add_user(in->username, ldap_users_base, "member", in->realname, homedir,
-            member_shell, id, "program", in->program, NULL)))
-        return response_message(out, ELDAP, "unable to create ldap account %s", in->username);
-    response_message(out, 0, "successfully created ldap account");
+    /* the ldap adds are in flight while kadmin creates the principal */
+    user_msg = ceo_add_user_async(in->username, ldap_users_base, "member", in->realname, homedir,
+            member_shell, id, "program", in->program, NULL);
+    group_msg = ceo_add_group_async(in->username, ldap_groups_base, id);
 
-    /* errors that occur after this point are not fatal  */
+    krb_stat = ceo_add_princ(in->username, in->password);
 
-    if ((krb_stat = ceo_add_princ(in->username, in->password)))
+    user_stat = ceo_ldap_wait(user_msg, "adduser");
+    group_stat = ceo_ldap_wait(group_msg, "addgroup");
+
+    /* without both the account and the principal, undo whatever was created */
+    if (user_stat || krb_stat) {
+        if (!user_stat && ceo_del_user(in->username, ldap_users_base))
+            response_message(out, ELDAP, "unable to roll back ldap account %s", in->username);
+        if (!group_stat && ceo_del_group(in->username, ldap_groups_base))
+            response_message(out, ELDAP, "unable to roll back ldap group %s", in->username);
+        if (!krb_stat && ceo_del_princ(in->username))
+            response_message(out, EKERB, "unable to roll back kerberos principal %s", in->username);
+
+        if (user_stat)
+            return response_message(out, ELDAP, "unable to create ldap account %s", in->username);
         return response_message(out, EKERB, "unable to create kerberos principal %s", in->username);
+    }
+    response_message(out, 0, "successfully created ldap account");
     response_message(out, 0, "successfully created principal");
 
-    if ((group_stat = ceo_add_group(in->username, ldap_groups_base, id)))
+    /* errors that occur after this point are not fatal  */
+
+    if (group_stat)
         response_message(out, ELDAP, "unable to create ldap group %s", in->username);
     else
         response_message(out, 0, "successfully created ldap group");
@@ -184,7 +202,7 @@ static int32_t addmember(Ceo__AddUser *in, Ceo__AddUserResponse *out) {
     else
         response_message(out, 0, "successfully created home directory");
 
-    if ((quota_stat = ceo_set_quota("ctdalek", id)))
+    if ((quota_stat = ceo_set_quota(MEMBER_QUOTA_PROTO, id)))
         response_message(out, EQUOTA, "unable to set quota for %s", in->username);
     else
         response_message(out, 0, "successfully set quota");
@@ -196,6 +214,7 @@ static int32_t addclub(Ceo__AddUser *in, Ceo__AddUserResponse *out) {
     char homedir[1024];
     char acl[64];
     int krb_stat, user_stat, group_stat, sudo_stat, home_stat, quota_stat;
+    int user_msg, group_msg, sudo_msg;
     int id;
 
     if (snprintf(homedir, sizeof(homedir), "%s/%s", club_home, in->username) >= sizeof(homedir))
@@ -210,19 +229,32 @@ static int32_t addclub(Ceo__AddUser *in, Ceo__AddUserResponse *out) {
     if ((krb_stat = ceo_del_princ(in->username)))
         return response_message(out, EKERB, "unable to clear principal %s", in->username);
 
-    if ((user_stat = ceo_add_user(in->username, ldap_users_base, "club", in->realname, homedir,
-            NULL, club_shell, id, NULL)))
+    user_msg = ceo_add_user_async(in->username, ldap_users_base, "club", in->realname, homedir,
+            club_shell, id, NULL);
+    group_msg = ceo_add_group_async(in->username, ldap_groups_base, id);
+    sudo_msg = ceo_add_group_sudo_async(in->username, ldap_sudo_base);
+
+    user_stat = ceo_ldap_wait(user_msg, "adduser");
+    group_stat = ceo_ldap_wait(group_msg, "addgroup");
+    sudo_stat = ceo_ldap_wait(sudo_msg, "addgroup");
+
+    if (user_stat) {
+        if (!group_stat && ceo_del_group(in->username, ldap_groups_base))
+            response_message(out, ELDAP, "unable to roll back ldap group %s", in->username);
+        if (!sudo_stat && ceo_del_group_sudo(in->username, ldap_sudo_base))
+            response_message(out, ELDAP, "unable to roll back ldap sudoers %s", in->username);
         return response_message(out, ELDAP, "unable to create ldap account %s", in->username);
+    }
     response_message(out, 0, "successfully created ldap account");
 
     /* errors that occur after this point are not fatal  */
 
-    if ((group_stat = ceo_add_group(in->username, ldap_groups_base, id)))
+    if (group_stat)
         response_message(out, ELDAP, "unable to create ldap group %s", in->username);
     else
         response_message(out, 0, "successfully created ldap group");
 
-    if ((sudo_stat = ceo_add_group_sudo(in->username, ldap_sudo_base)))
+    if (sudo_stat)
         response_message(out, ELDAP, "unable to create ldap sudoers %s", in->username);
     else
         response_message(out, 0, "successfully created ldap sudoers");
@@ -232,7 +264,7 @@ static int32_t addclub(Ceo__AddUser *in, Ceo__AddUserResponse *out) {
     else
         response_message(out, 0, "successfully created home directory");
 
-    if ((quota_stat = ceo_set_quota("csc", id)))
+    if ((quota_stat = ceo_set_quota(CLUB_QUOTA_PROTO, id)))
         response_message(out, EQUOTA, "unable to set quota for %s", in->username);
     else
         response_message(out, 0, "successfully set quota");
@@ -0,0 +1,191 @@
+#include <string.h>
+#include <stdio.h>
+#include <unistd.h>
+#include <syslog.h>
+#include <libgen.h>
+#include <errno.h>
+#include <ctype.h>
+
+#include "util.h"
+#include "net.h"
+#include "ceo.pb-c.h"
+#include "config.h"
+#include "krb5.h"
+#include "ldap.h"
+#include "homedir.h"
+#include "strbuf.h"
+
+char *prog;
+
+static const int MAX_MESSAGES = 32;
+static const int MAX_MESGSIZE = 512;
+
+Ceo__ApplyQuotaResponse *response_create(void) {
+    Ceo__ApplyQuotaResponse *r = xmalloc(sizeof(Ceo__ApplyQuotaResponse));
+    ceo__apply_quota_response__init(r);
+    r->n_messages = 0;
+    r->messages = xmalloc(MAX_MESSAGES *  sizeof(Ceo__StatusMessage *));
+    return r;
+}
+
+PRINTF_LIKE(2)
+int32_t response_message(Ceo__ApplyQuotaResponse *r, int32_t status, char *fmt, ...) {
+    va_list args;
+    Ceo__StatusMessage *statusmsg = xmalloc(sizeof(Ceo__StatusMessage));
+    char *message = xmalloc(MAX_MESGSIZE);
+
+    va_start(args, fmt);
+    vsnprintf(message, MAX_MESGSIZE, fmt, args);
+    va_end(args);
+
+    ceo__status_message__init(statusmsg);
+    statusmsg->status = status;
+    statusmsg->message = message;
+
+    /* one message per unknown username can outgrow the initial array */
+    if (r->n_messages && r->n_messages % MAX_MESSAGES == 0)
+        r->messages = xrealloc(r->messages, (r->n_messages + MAX_MESSAGES) * sizeof(Ceo__StatusMessage *));
+    r->messages[r->n_messages++] = statusmsg;
+
+    if (status)
+        error("%s", message);
+    else
+        notice("%s", message);
+
+    return status;
+}
+
+void response_delete(Ceo__ApplyQuotaResponse *r) {
+    int i;
+
+    for (i = 0; i < r->n_messages; i++) {
+        free(r->messages[i]->message);
+        free(r->messages[i]);
+    }
+    free(r->messages);
+    free(r);
+}
+
+static int check_apply_quota(Ceo__ApplyQuota *in, Ceo__ApplyQuotaResponse *out, char *client) {
+    int syscom = check_group(client, "syscom");
+
+    notice("applying quotas to %s by %s", in->n_usernames ? "selected accounts" : "all accounts", client);
+
+    if (!syscom)
+        return response_message(out, EPERM, "%s not authorized to apply quotas", client);
+
+    /* usernames are pasted into an LDAP filter */
+    for (int i = 0; i < in->n_usernames; i++) {
+        for (char *p = in->usernames[i]; *p; p++) {
+            if (!isalnum((unsigned char)*p) && *p != '-' && *p != '_' && *p != '.')
+                return response_message(out, EINVAL, "invalid character in username: %c", *p);
+        }
+    }
+
+    return 0;
+}
+
+static int32_t apply_quota_class(Ceo__ApplyQuota *in, Ceo__ApplyQuotaResponse *out,
+        char *objclass, char *proto, int *found) {
+    int *ids;
+    int count;
+
+    count = ceo_user_ids(objclass, in->usernames, in->n_usernames, &ids, found);
+    if (count < 0)
+        return response_message(out, EQUOTA, "unable to list %s accounts", objclass);
+
+    if (count && ceo_set_quotas(proto, ids, count)) {
+        free(ids);
+        return response_message(out, EQUOTA, "unable to set quota for some %s accounts", objclass);
+    }
+
+    free(ids);
+
+    return response_message(out, 0, "applied %s quota to %d %s accounts", proto, count, objclass);
+}
+
+static int32_t apply_quota(Ceo__ApplyQuota *in, Ceo__ApplyQuotaResponse *out, char *client) {
+    int32_t chk_stat, member_stat, club_stat, missing_stat = 0;
+    int *found;
+
+    chk_stat = check_apply_quota(in, out, client);
+    if (chk_stat)
+        return chk_stat;
+
+    found = xcalloc(in->n_usernames + 1, sizeof(int));
+
+    member_stat = apply_quota_class(in, out, "member", MEMBER_QUOTA_PROTO, found);
+    club_stat = apply_quota_class(in, out, "club", CLUB_QUOTA_PROTO, found);
+
+    /* after a failed search the found flags may be incomplete */
+    if (!member_stat && !club_stat) {
+        for (int i = 0; i < in->n_usernames; i++)
+            if (!found[i])
+                missing_stat = response_message(out, ENOENT, "no member or club account named %s",
+                        in->usernames[i]);
+    }
+
+    free(found);
+
+    if (member_stat)
+        return member_stat;
+    return club_stat ? club_stat : missing_stat;
+}
+
+void cmd_apply_quota(void) {
+    Ceo__ApplyQuota *in_proto;
+    Ceo__ApplyQuotaResponse *out_proto = response_create();
+    struct strbuf in = STRBUF_INIT;
+    struct strbuf out = STRBUF_INIT;
+
+    if (strbuf_read(&in, STDIN_FILENO, 0) < 0)
+        fatalpe("read");
+
+    in_proto = ceo__apply_quota__unpack(&protobuf_c_default_allocator,
+            in.len, (uint8_t *)in.buf);
+    if (!in_proto)
+        fatal("malformed apply quota message");
+
+    char *client = getenv("CEO_USER");
+    if (!client)
+        fatal("environment variable CEO_USER is not set");
+
+    apply_quota(in_proto, out_proto, client);
+
+    strbuf_grow(&out, ceo__apply_quota_response__get_packed_size(out_proto));
+    strbuf_setlen(&out, ceo__apply_quota_response__pack(out_proto, (uint8_t *)out.buf));
+
+    if (full_write(STDOUT_FILENO, out.buf, out.len))
+        fatalpe("write: stdout");
+
+    ceo__apply_quota__free_unpacked(in_proto, &protobuf_c_default_allocator);
+    response_delete(out_proto);
+
+    strbuf_release(&in);
+    strbuf_release(&out);
+}
+
+int main(int argc, char *argv[]) {
+    prog = xstrdup(basename(argv[0]));
+    init_log(prog, LOG_PID, LOG_AUTHPRIV, 0);
+
+    configure();
+
+    if (setenv("KRB5CCNAME", "MEMORY:quota", 1))
+        fatalpe("setenv");
+
+    ceo_krb5_init();
+    ceo_krb5_auth(ldap_admin_principal);
+    ceo_ldap_init();
+
+    cmd_apply_quota();
+
+    ceo_ldap_cleanup();
+    ceo_krb5_deauth();
+    ceo_krb5_cleanup();
+
+    free_config();
+    free(prog);
+
+    return 0;
+}
@@ -16,7 +16,7 @@ static struct op *ops;
 static const char *default_op_dir = "/usr/lib/ceod";
 static const char *op_dir;
 
-static void add_op(char *host, char *name, char *user, uint32_t id) {
+static void add_op(char *host, char *name, char *user, uint32_t id, int limit) {
     struct op *new = xmalloc(sizeof(struct op));
     errno = 0;
     new->next = ops;
@@ -24,6 +24,8 @@ static void add_op(char *host, char *name, char *user, uint32_t id) {
     new->id = id;
     new->path = NULL;
     new->user = xstrdup(user);
+    new->limit = limit;
+    new->lock_fd = -1;
 
     struct hostent *hostent = gethostbyname(host);
     if (!hostent)
@@ -56,6 +58,10 @@ struct op *get_local_op(uint32_t id) {
     return NULL;
 }
 
+struct op *get_ops(void) {
+    return ops;
+}
+
 struct op *find_op(const char *name) {
     for (struct op *op = ops; op; op = op->next) {
         if (!strcmp(name, op->name))
@@ -94,8 +100,9 @@ void setup_ops(void) {
 
             struct strbuf **words = strbuf_splitws(&line);
 
-            if (strbuf_list_len(words) != 4)
-                badconf("%s/%s: expected four words on line %d", op_config_dir, de->d_name, lineno);
+            int nwords = strbuf_list_len(words);
+            if (nwords != 4 && nwords != 5)
+                badconf("%s/%s: expected four or five words on line %d", op_config_dir, de->d_name, lineno);
 
             errno = 0;
             char *end;
@@ -103,7 +110,16 @@ void setup_ops(void) {
             if (errno || *end)
                 badconf("%s/%s: invalid id '%s' on line %d", op_config_dir, de->d_name, words[2]->buf, lineno);
 
-            add_op(words[0]->buf, words[1]->buf, words[2]->buf, id);
+            /* optional limit on concurrent instances, 0 for no limit */
+            int limit = 0;
+            if (nwords == 5) {
+                errno = 0;
+                limit = strtol(words[4]->buf, &end, 0);
+                if (errno || *end || limit < 0)
+                    badconf("%s/%s: invalid limit '%s' on line %d", op_config_dir, de->d_name, words[4]->buf, lineno);
+            }
+
+            add_op(words[0]->buf, words[1]->buf, words[2]->buf, id, limit);
             op_count++;
 
             strbuf_list_free(words);
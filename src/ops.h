@@ -7,9 +7,12 @@ struct op {
     struct in_addr addr;
     struct op *next;
     char *user;
+    int limit;
+    int lock_fd;
 };
 
 void setup_ops(void);
 void free_ops(void);
 struct op *find_op(const char *name);
 struct op *get_local_op(uint32_t id);
+struct op *get_ops(void);
@@ -0,0 +1,167 @@
+#include <stdio.h>
+#include <string.h>
+#include <time.h>
+#include <sys/mman.h>
+
+#include "stats.h"
+#include "util.h"
+#include "net.h"
+#include "ops.h"
+
+/*
+ * Latency histograms shared between the master and all slaves. The table
+ * is mapped before the master forks, and slaves update it with atomic
+ * adds so that no locking is needed. Bucket i counts samples of
+ * [2^i, 2^(i+1)) microseconds.
+ */
+
+#define STATS_MAX_OPS 32
+#define STATS_BUCKETS 40
+
+struct histogram {
+    uint64_t count;
+    uint64_t max;
+    uint64_t buckets[STATS_BUCKETS];
+};
+
+struct op_stats {
+    uint32_t id;
+    char name[32];
+    struct histogram phases[NUM_PHASES];
+};
+
+struct stats_table {
+    int n_ops;
+    struct op_stats ops[STATS_MAX_OPS];
+};
+
+static struct stats_table *table;
+
+static const char *phase_names[] = {
+    [PHASE_AUTH]     = "auth",
+    [PHASE_DECIPHER] = "decipher",
+    [PHASE_QUEUE]    = "queue",
+    [PHASE_OP]       = "op",
+    [PHASE_ENCIPHER] = "encipher",
+    [PHASE_TOTAL]    = "total",
+};
+
+static void add_slot(uint32_t id, const char *name) {
+    struct op_stats *slot;
+
+    if (table->n_ops >= STATS_MAX_OPS) {
+        warn("too many ops, not recording stats for %s", name);
+        return;
+    }
+
+    slot = &table->ops[table->n_ops++];
+    slot->id = id;
+    snprintf(slot->name, sizeof(slot->name), "%s", name);
+}
+
+void setup_stats(void) {
+    table = mmap(NULL, sizeof(*table), PROT_READ|PROT_WRITE, MAP_SHARED|MAP_ANONYMOUS, -1, 0);
+    if (table == MAP_FAILED)
+        fatalpe("mmap");
+
+    memset(table, 0, sizeof(*table));
+
+    add_slot(STATS_NO_OP, "-");
+    for (struct op *op = get_ops(); op; op = op->next)
+        if (op->local)
+            add_slot(op->id, op->name);
+}
+
+void free_stats(void) {
+    if (table && munmap(table, sizeof(*table)))
+        warnpe("munmap");
+    table = NULL;
+}
+
+uint64_t stats_now(void) {
+    struct timespec ts;
+
+    if (clock_gettime(CLOCK_MONOTONIC, &ts))
+        fatalpe("clock_gettime");
+
+    return (uint64_t)ts.tv_sec * 1000000 + ts.tv_nsec / 1000;
+}
+
+static struct op_stats *find_slot(uint32_t op_id) {
+    if (!table)
+        return NULL;
+
+    for (int i = 0; i < table->n_ops; i++)
+        if (table->ops[i].id == op_id)
+            return &table->ops[i];
+
+    return NULL;
+}
+
+void stats_record(uint32_t op_id, enum stats_phase phase, uint64_t usec) {
+    struct op_stats *slot = find_slot(op_id);
+    struct histogram *hist;
+    uint64_t max;
+    int bucket = 0;
+
+    if (!slot)
+        return;
+
+    hist = &slot->phases[phase];
+
+    while (bucket < STATS_BUCKETS - 1 && usec >> (bucket + 1))
+        bucket++;
+
+    __sync_fetch_and_add(&hist->buckets[bucket], 1);
+    __sync_fetch_and_add(&hist->count, 1);
+
+    max = hist->max;
+    while (usec > max && !__sync_bool_compare_and_swap(&hist->max, max, usec))
+        max = hist->max;
+}
+
+/* estimate a percentile by interpolating within its bucket */
+static uint64_t percentile(struct histogram *hist, uint64_t count, int pct) {
+    uint64_t seen = 0, want = (count * pct + 99) / 100;
+
+    for (int i = 0; i < STATS_BUCKETS; i++) {
+        uint64_t n = hist->buckets[i];
+
+        if (seen + n >= want && n) {
+            uint64_t low = i ? UINT64_C(1) << i : 0;
+            uint64_t high = (UINT64_C(2) << i) - 1;
+
+            if (high > hist->max)
+                high = hist->max;
+            return low + (high - low) * (want - seen) / n;
+        }
+        seen += n;
+    }
+
+    return hist->max;
+}
+
+void stats_format(struct strbuf *out) {
+    strbuf_addf(out, "%-16s %-9s %10s %10s %10s %10s\n", "op", "phase", "count", "p50_us", "p95_us", "max_us");
+
+    if (!table)
+        return;
+
+    for (int i = 0; i < table->n_ops; i++) {
+        struct op_stats *slot = &table->ops[i];
+
+        for (int phase = 0; phase < NUM_PHASES; phase++) {
+            struct histogram *hist = &slot->phases[phase];
+            uint64_t count = hist->count;
+
+            if (!count)
+                continue;
+
+            strbuf_addf(out, "%-16s %-9s %10llu %10llu %10llu %10llu\n", slot->name, phase_names[phase],
+                    (unsigned long long)count,
+                    (unsigned long long)percentile(hist, count, 50),
+                    (unsigned long long)percentile(hist, count, 95),
+                    (unsigned long long)hist->max);
+        }
+    }
+}
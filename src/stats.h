@@ -0,0 +1,27 @@
+#ifndef CEO_STATS_H
+#define CEO_STATS_H
+
+#include <stdint.h>
+
+#include "strbuf.h"
+
+enum stats_phase {
+    PHASE_AUTH,
+    PHASE_DECIPHER,
+    PHASE_QUEUE,
+    PHASE_OP,
+    PHASE_ENCIPHER,
+    PHASE_TOTAL,
+    NUM_PHASES,
+};
+
+/* slot used for messages that are not tied to an op, i.e. authentication */
+#define STATS_NO_OP 0
+
+void setup_stats(void);
+void free_stats(void);
+uint64_t stats_now(void);
+void stats_record(uint32_t op_id, enum stats_phase phase, uint64_t usec);
+void stats_format(struct strbuf *out);
+
+#endif
@@ -15,20 +15,34 @@
 
 static int log_stderr = 1;
 static int log_maxprio = LOG_DEBUG;
+static char *log_trace;
 
 void init_log(const char *ident, int option, int facility, int lstderr) {
     openlog(ident, option, facility);
     log_stderr = lstderr || isatty(STDERR_FILENO);
+    log_set_trace(getenv("CEO_TRACE_ID"));
 }
 
 void log_set_maxprio(int prio) {
     log_maxprio = prio;
 }
 
+void log_set_trace(const char *trace) {
+    free(log_trace);
+    log_trace = trace && *trace ? xstrdup(trace) : NULL;
+}
+
+static void add_prefix(struct strbuf *msg, const char *prefix) {
+    if (log_trace)
+        strbuf_addf(msg, "[%s] ", log_trace);
+    if (prefix)
+        strbuf_addf(msg, "%s: ", prefix);
+}
+
 static void errmsg(int prio, const char *prefix, const char *fmt, va_list args) {
     struct strbuf msg = STRBUF_INIT;
 
-    strbuf_addf(&msg, "%s: ", prefix);
+    add_prefix(&msg, prefix);
     strbuf_vaddf(&msg, fmt, args);
     strbuf_addch(&msg, '\n');
 
@@ -42,7 +56,7 @@ static void errmsg(int prio, const char *prefix, const char *fmt, va_list args)
 static void errmsgpe(int prio, const char *prefix, const char *fmt, va_list args) {
     struct strbuf msg = STRBUF_INIT;
 
-    strbuf_addf(&msg, "%s: ", prefix);
+    add_prefix(&msg, prefix);
     strbuf_vaddf(&msg, fmt, args);
     strbuf_addf(&msg, ": %s\n", strerror(errno));
 
@@ -99,16 +113,21 @@ void debug(const char *msg, ...) {
 }
 
 void logmsg(int priority, const char *msg, ...) {
+    struct strbuf buf = STRBUF_INIT;
     va_list args;
+
+    add_prefix(&buf, NULL);
     va_start(args, msg);
-    vsyslog(priority, msg, args);
+    strbuf_vaddf(&buf, msg, args);
     va_end(args);
-    va_start(args, msg);
+
+    syslog(priority, "%s", buf.buf);
     if (log_stderr && priority <= log_maxprio) {
-        vfprintf(stderr, msg, args);
+        fputs(buf.buf, stderr);
         fputc('\n', stderr);
     }
-    va_end(args);
+
+    strbuf_release(&buf);
 }
 
 NORETURN void deny(const char *msg, ...) {
@@ -205,6 +224,12 @@ int spawnvemu(const char *path, char *const *argv, char *const *envp, const stru
         close(fmchild[0]);
         close(fmchild[1]);
 
+#ifdef CEO_INSECURE_NOAUTH
+        /* the benchmark daemon runs its ops as the user running it */
+        struct passwd *self = user ? getpwnam(user) : NULL;
+        if (self && self->pw_uid == geteuid())
+            user = NULL;
+#endif
         if (user) {
             struct passwd *pw = getpwnam(user);
             if (!pw)
@@ -37,6 +37,7 @@ void free_env(char **envp);
 void init_log(const char *ident, int option, int facility, int lstderr);
 int check_group(char *username, char *group);
 void log_set_maxprio(int prio);
+void log_set_trace(const char *trace);
 
 PRINTF_LIKE(0) NORETURN void fatal(const char *, ...);
 PRINTF_LIKE(0) NORETURN void fatalpe(const char *, ...);